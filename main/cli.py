@@ -0,0 +1,155 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+'''
+2025年10月19日
+统一命令行入口（在仓库根目录运行 python -m main.cli <子命令>）：
+  ingest    入库（dinov3_images_persistence_003.py，--replay 重放死信日志），--watch 为目录监听持续入库（watch_ingest.py）
+  search    单张图像检索（dinov3_Images_feature_retrieval.py），--all 为全部查询检索并写结果（milvus_all_result.py）
+  export    snapshot（milvus_snapshot.py）或 fstore（utils/feature_store.py）
+  delete    按图像名删除集合中的实体（milvus_delete.py）
+  evaluate  运行 result_evaluation 下的评估脚本
+  startup   启动耗时基准：多次启动子进程，统计 --help 与轻量子命令的启动时间
+本文件只导入标准库，torch/transformers/pymilvus等重依赖由子命令执行时才导入，--help 与轻量命令无需加载模型栈。
+脚本类子命令与单独运行对应脚本完全一致：切换到脚本所在目录执行，其余参数原样传给脚本，
+因此参数中的相对路径相对于 main/src 或 main/result_evaluation。
+'''
+
+MAIN_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(MAIN_DIR)
+SRC_DIR = os.path.join(MAIN_DIR, 'src')
+EVAL_DIR = os.path.join(MAIN_DIR, 'result_evaluation')
+
+# evaluate 子命令的评估名 -> 脚本
+EVALUATIONS = {
+    'map': 'my_evaluate.py',
+    'results': 'eval_results.py',
+    'pca': 'eval_pca_whitening.py',
+    'qe': 'eval_query_expansion.py',
+    'diffusion': 'eval_diffusion.py',
+    'patch': 'eval_patch_rerank.py',
+    'cascade': 'eval_cascade.py',
+    'token': 'eval_token_reduction.py',
+    'local-index': 'eval_local_index.py',
+}
+
+
+def run_script(directory, script, argv):
+    """在脚本所在目录以 __main__ 身份运行脚本（与 cd 到该目录后 python script 相同）"""
+    import runpy
+    os.chdir(directory)
+    for path in (REPO_ROOT, directory):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    sys.argv = [script, *argv]
+    runpy.run_path(os.path.join(directory, script), run_name='__main__')
+
+
+def cmd_ingest(args, rest):
+    run_script(SRC_DIR, 'watch_ingest.py' if args.watch else 'dinov3_images_persistence_003.py', rest)
+
+
+def cmd_search(args, rest):
+    run_script(SRC_DIR, 'milvus_all_result.py' if args.all else 'dinov3_Images_feature_retrieval.py', rest)
+
+
+def cmd_export(args, rest):
+    if args.format == 'snapshot':
+        run_script(SRC_DIR, 'milvus_snapshot.py', ['export', *rest])
+    else:
+        run_script(os.path.join(MAIN_DIR, 'utils'), 'feature_store.py', rest)
+
+
+def cmd_delete(args, rest):
+    from main.src import milvus_delete
+    names = list(args.names)
+    if args.from_dir:
+        names += [f for f in os.listdir(args.from_dir) if os.path.isfile(os.path.join(args.from_dir, f))]
+    if not names:
+        raise SystemExit("没有需要删除的图像名")
+    milvus_delete.connect(args.host, args.port)
+    print(f"已删除 {milvus_delete.delete_images(args.collection, names)} 行")
+
+
+def cmd_evaluate(args, rest):
+    run_script(EVAL_DIR, EVALUATIONS[args.name], rest)
+
+
+def _time_command(argv, repeat):
+    """多次启动子进程，返回耗时中位数（秒），失败时为None"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, *argv], cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        if completed.returncode != 0:
+            return None
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def cmd_startup(args, rest):
+    cases = [
+        ('python -c pass', ['-c', 'pass']),
+        ('cli --help', ['-m', 'main.cli', '--help']),
+        ('cli ingest --help', ['-m', 'main.cli', 'ingest', '--help']),
+        ('cli delete --help', ['-m', 'main.cli', 'delete', '--help']),
+        ('cli evaluate --help', ['-m', 'main.cli', 'evaluate', '--help']),
+        ('import get_ipadress', ['-c', 'import main.utils.get_ipadress']),
+        ('import persistence_003', ['-c', 'import main.src.dinov3_images_persistence_003']),
+    ]
+    print(f"启动耗时（{args.repeat} 次中位数）:")
+    for label, argv in cases:
+        duration = _time_command(argv, args.repeat)
+        print(f"  {label:<24} " + (f"{duration * 1000:8.1f} ms" if duration is not None else "     失败（缺少依赖？）"))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m main.cli', description="DINOv3图像检索统一命令行入口")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest = subparsers.add_parser('ingest', help="提取特征并入库", description="其余参数原样传给入库脚本")
+    ingest.add_argument('--watch', action='store_true', help="监听数据集目录持续增量入库")
+    ingest.set_defaults(func=cmd_ingest)
+
+    search = subparsers.add_parser('search', help="检索", description="其余参数原样传给检索脚本")
+    search.add_argument('--all', action='store_true', help="检索全部查询并写出结果")
+    search.set_defaults(func=cmd_search)
+
+    export = subparsers.add_parser('export', help="导出集合", description="其余参数原样传给导出脚本")
+    export.add_argument('format', choices=('snapshot', 'fstore'))
+    export.set_defaults(func=cmd_export)
+
+    delete = subparsers.add_parser('delete', help="按图像名删除")
+    delete.add_argument('--collection', required=True)
+    delete.add_argument('names', nargs='*', help="图像文件名")
+    delete.add_argument('--from-dir', default=None, help="删除该目录下所有文件名对应的实体")
+    delete.add_argument('--host', default=None)
+    delete.add_argument('--port', default="19530")
+    delete.set_defaults(func=cmd_delete, strict=True)
+
+    evaluate = subparsers.add_parser('evaluate', help="运行评估脚本", description="其余参数原样传给评估脚本")
+    evaluate.add_argument('name', choices=sorted(EVALUATIONS))
+    evaluate.set_defaults(func=cmd_evaluate)
+
+    startup = subparsers.add_parser('startup', help="启动耗时基准")
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.set_defaults(func=cmd_startup, strict=True)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if rest and getattr(args, 'strict', False):
+        parser.error(f"无法识别的参数: {' '.join(rest)}")
+    args.func(args, rest)
+
+
+if __name__ == '__main__':
+    main()
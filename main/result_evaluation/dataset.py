@@ -3,14 +3,36 @@ import pickle
 
 DATASETS = ['roxford5k', 'rparis6k', 'revisitop1m']
 
-def configdataset(dataset, dir_main):
+def configdataset(dataset, dir_main, use_cache=False):
 
     dataset = dataset.lower()
 
     if dataset not in DATASETS:    
         raise ValueError('Unknown dataset: {}!'.format(dataset))
 
-    if dataset == 'roxford5k' or dataset == 'rparis6k':
+    if use_cache:
+        # 使用内存映射的gnd缓存（main/utils/gnd_cache.py），避免每次反序列化pkl/读取1M行txt
+        from main.utils import gnd_cache
+        if dataset == 'revisitop1m':
+            src_fname = os.path.join(dir_main, dataset, '{}.txt'.format(dataset))
+        else:
+            src_fname = os.path.join(dir_main, dataset, 'gnd_{}.pkl'.format(dataset))
+        cache = gnd_cache.load_gnd_cache(src_fname)
+        cfg = {}
+        cfg['gnd_cache'] = cache
+        cfg['imlist'] = cache.imlist
+        cfg['qimlist'] = cache.qimlist
+        if dataset == 'revisitop1m':
+            cfg['imlist_fname'] = src_fname
+            cfg['ext'] = ''
+            cfg['qext'] = ''
+        else:
+            cfg['gnd'] = cache.gnd
+            cfg['gnd_fname'] = src_fname
+            cfg['ext'] = '.jpg'
+            cfg['qext'] = '.jpg'
+
+    elif dataset == 'roxford5k' or dataset == 'rparis6k':
         # loading imlist, qimlist, and gnd, in cfg as a dict
         gnd_fname = os.path.join(dir_main, dataset, 'gnd_{}.pkl'.format(dataset))
         with open(gnd_fname, 'rb') as f:
@@ -0,0 +1,77 @@
+import argparse
+import time
+
+import numpy as np
+
+from eval_utils import load_features, exact_search, ranks_from_indices, evaluate_ranks, timed_search, print_report
+
+'''
+2025年10月19日
+级联检索 vs 单阶段检索（在result_evaluation目录下运行，需要项目根目录在PYTHONPATH中）：
+小编码器特征(ViT-S)精确召回shortlist，再用ViT-B存储向量对shortlist重打分。
+报告E/M/H的mAP、检索部分的单条延迟，以及加上编码器前向（--measure-forward）后的端到端CPU延迟。
+用法:
+    python eval_cascade.py --small-queries qs.npy --small-database xs.npy --queries q.npy --database x.npy \
+        --measure-forward facebook/dinov3-vits16-pretrain-lvd1689m,facebook/dinov3-vitb16-pretrain-lvd1689m
+'''
+
+
+def measure_forward_ms(model_dir, repeats=10):
+    """单张图像在CPU上的前向延迟（毫秒，取中位数）"""
+    import torch
+    from PIL import Image
+    from transformers import AutoImageProcessor, AutoModel
+    processor = AutoImageProcessor.from_pretrained(model_dir)
+    model = AutoModel.from_pretrained(model_dir).eval()
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8))
+    latencies = []
+    with torch.no_grad():
+        for i in range(repeats + 1):
+            start = time.perf_counter()
+            model(**processor(images=[image], return_tensors="pt"))
+            if i:  # 第一次为预热
+                latencies.append((time.perf_counter() - start) * 1000)
+    return float(np.median(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="级联检索评估")
+    parser.add_argument('--small-queries', required=True, help="小编码器查询特征.npy")
+    parser.add_argument('--small-database', required=True, help="小编码器数据库特征.npy")
+    parser.add_argument('--queries', required=True, help="ViT-B查询特征.npy")
+    parser.add_argument('--database', required=True, help="ViT-B数据库特征.npy（与小编码器数据库顺序一致）")
+    parser.add_argument('--dataset', default='roxford5k')
+    parser.add_argument('--shortlist', type=int, default=100)
+    parser.add_argument('--topk', type=int, default=100)
+    parser.add_argument('--measure-forward', help="小编码器,ViT-B 的模型目录，测量单张图像前向延迟")
+    args = parser.parse_args()
+
+    Qs, Xs = load_features(args.small_queries, args.small_database)
+    Q, X = load_features(args.queries, args.database)
+    print(f">> 查询 {len(Q)}，数据库 {len(X)}，小编码器维度 {Xs.shape[1]}，ViT-B维度 {X.shape[1]}")
+    small_ms = large_ms = 0.0
+    if args.measure_forward:
+        small_dir, large_dir = args.measure_forward.split(',')
+        small_ms, large_ms = measure_forward_ms(small_dir), measure_forward_ms(large_dir)
+
+    def cascade(q):
+        # q为拼接后的 [小编码器特征, ViT-B特征]
+        _, shortlist = exact_search(q[:, :Xs.shape[1]], Xs, args.shortlist)
+        candidates = shortlist[0]
+        distances = ((X[candidates] - q[0, Xs.shape[1]:]) ** 2).sum(axis=1)
+        return None, candidates[np.argsort(distances, kind='stable')][None, :]
+
+    rows = []
+    for method, search_fn, queries, forward_ms in (
+            ('vitb', lambda q: exact_search(q, X, args.topk), Q, large_ms),
+            ('small', lambda q: exact_search(q, Xs, args.topk), Qs, small_ms),
+            (f"cascade(top{args.shortlist})", cascade, np.concatenate([Qs, Q], axis=1), small_ms + large_ms)):
+        indices, qps, latencies = timed_search(search_fn, queries)
+        search_ms = float(np.mean(latencies) * 1000)
+        rows.append({'method': method, 'mAP': evaluate_ranks(ranks_from_indices(indices, len(X)), args.dataset),
+                     'search ms': search_ms, 'end2end ms': search_ms + forward_ms})
+    print_report(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+import argparse
+
+import numpy as np
+
+from eval_utils import load_features, exact_search, ranks_from_indices, evaluate_ranks, print_report
+from main.utils.diffusion import DiffusionReranker, build_knn_graph, load_graph
+from main.utils.query_expansion import l2_to_similarity
+
+'''
+2025年10月19日
+扩散重排序的mAP与单条查询延迟（在result_evaluation目录下运行，需要项目根目录在PYTHONPATH中）：
+先用 utils/diffusion.py 离线建图（或用 --build 现场建图），再对每个查询的top-n截断集合做扩散。
+用法:
+    python eval_diffusion.py --queries q.npy --database x.npy [--distractors r1m.npy] --graph ../data/diffusion_graph
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="扩散重排序评估")
+    parser.add_argument('--queries', help="查询特征.npy")
+    parser.add_argument('--database', help="数据库特征.npy")
+    parser.add_argument('--mat', help="或使用包含Q、X的.mat文件")
+    parser.add_argument('--distractors', help="干扰项特征.npy（revisitop1m），需与建图时的顺序一致")
+    parser.add_argument('--dataset', default='roxford5k')
+    parser.add_argument('--graph', help="离线构建的kNN图目录")
+    parser.add_argument('--build', action='store_true', help="不使用离线图，现场构建")
+    parser.add_argument('--k', type=int, default=50, help="现场建图的近邻数")
+    parser.add_argument('--truncate', type=int, default=1000, help="每个查询参与扩散的top-n")
+    parser.add_argument('--alpha', type=float, default=0.99)
+    parser.add_argument('--gamma', type=float, default=3.0)
+    parser.add_argument('--query-k', type=int, default=10)
+    parser.add_argument('--iters', type=int, default=20)
+    args = parser.parse_args()
+
+    Q, X = load_features(args.queries, args.database, args.mat, args.distractors)
+    print(f">> 查询 {len(Q)}，数据库 {len(X)}，维度 {X.shape[1]}")
+    if args.build or not args.graph:
+        graph = build_knn_graph(X, args.k, args.gamma)
+    else:
+        graph, meta = load_graph(args.graph)
+        if meta['n'] != len(X):
+            raise ValueError(f"图节点数 {meta['n']} 与数据库大小 {len(X)} 不一致")
+    print(f">> kNN图: {graph.nnz} 条边")
+
+    distances, indices = exact_search(Q, X, args.truncate)
+    rows = [{'method': 'baseline', 'mAP': evaluate_ranks(ranks_from_indices(indices, len(X)), args.dataset),
+             'ms/query': 0.0, 'p95 ms': 0.0}]
+
+    reranker = DiffusionReranker(graph, args.alpha, args.gamma, args.query_k, args.iters)
+    reranked, latencies = reranker.rerank_batch(indices, l2_to_similarity(distances))
+    latencies = np.asarray(latencies) * 1000
+    rows.append({'method': f"diffusion(n={args.truncate})",
+                 'mAP': evaluate_ranks(ranks_from_indices(reranked, len(X)), args.dataset),
+                 'ms/query': float(latencies.mean()), 'p95 ms': float(np.percentile(latencies, 95))})
+    print_report(rows)
+
+
+if __name__ == '__main__':
+    main()
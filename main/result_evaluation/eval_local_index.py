@@ -0,0 +1,65 @@
+import argparse
+
+from eval_utils import load_features, exact_search, ranks_from_indices, evaluate_ranks, timed_search, print_report
+from main.utils.hnsw_index import HNSWIndex
+from main.utils.ivfpq_index import IVFPQIndex
+
+'''
+2025年10月19日
+本地索引与精确检索的对比（在result_evaluation目录下运行，需要项目根目录在PYTHONPATH中）：
+报告每向量内存、单条查询QPS、以及roxford5k（可加revisitop1m干扰项）上E/M/H的mAP。
+用法:
+    python eval_local_index.py --queries q.npy --database x.npy [--distractors r1m.npy] --methods exact,ivfpq,ivfpq_rerank,hnsw
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地索引 vs 精确检索")
+    parser.add_argument('--queries', help="查询特征.npy")
+    parser.add_argument('--database', help="数据库特征.npy")
+    parser.add_argument('--mat', help="或使用包含Q、X的.mat文件")
+    parser.add_argument('--distractors', help="干扰项特征.npy（revisitop1m）")
+    parser.add_argument('--dataset', default='roxford5k')
+    parser.add_argument('--methods', default='exact,ivfpq,ivfpq_rerank')
+    parser.add_argument('--topk', type=int, default=100, help="参与mAP计算的返回结果数")
+    parser.add_argument('--nlist', type=int, default=1024)
+    parser.add_argument('--m', type=int, default=32)
+    parser.add_argument('--nprobe', type=int, default=16)
+    parser.add_argument('--rerank', type=int, default=200)
+    parser.add_argument('--ef', type=int, default=128)
+    args = parser.parse_args()
+
+    Q, X = load_features(args.queries, args.database, args.mat, args.distractors)
+    dim = X.shape[1]
+    print(f">> 查询 {len(Q)}，数据库 {len(X)}，维度 {dim}")
+    methods = args.methods.split(',')
+    rows = []
+
+    if 'exact' in methods:
+        indices, qps, _ = timed_search(lambda q: exact_search(q, X, args.topk), Q)
+        rows.append({'method': 'exact', 'mAP': evaluate_ranks(ranks_from_indices(indices, len(X)), args.dataset),
+                     'bytes/vector': 4 * dim, 'QPS': qps})
+
+    if 'ivfpq' in methods or 'ivfpq_rerank' in methods:
+        index = IVFPQIndex(dim, nlist=min(args.nlist, len(X)), m=args.m, nprobe=args.nprobe)
+        index.train(X).add(X)
+        for method, rerank in (('ivfpq', None), ('ivfpq_rerank', args.rerank)):
+            if method not in methods:
+                continue
+            indices, qps, _ = timed_search(lambda q: index.search(q, args.topk, rerank=rerank), Q)
+            rows.append({'method': f"{method}(m={args.m},nprobe={args.nprobe})",
+                         'mAP': evaluate_ranks(ranks_from_indices(indices, len(X)), args.dataset),
+                         'bytes/vector': index.bytes_per_vector(), 'QPS': qps})
+
+    if 'hnsw' in methods:
+        index = HNSWIndex(dim).build(X)
+        indices, qps, _ = timed_search(lambda q: index.search(q, args.topk, ef=max(args.ef, args.topk)), Q)
+        graph_bytes = index.layer0.shape[1] * 4 + 4 * dim
+        rows.append({'method': f"hnsw(ef={args.ef})", 'mAP': evaluate_ranks(ranks_from_indices(indices, len(X)), args.dataset),
+                     'bytes/vector': graph_bytes, 'QPS': qps})
+
+    print_report(rows)
+
+
+if __name__ == '__main__':
+    main()
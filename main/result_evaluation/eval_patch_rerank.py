@@ -0,0 +1,63 @@
+import argparse
+import time
+
+import numpy as np
+
+from eval_utils import exact_search, ranks_from_indices, evaluate_ranks, print_report
+from main.utils import vector_io
+from main.utils.patch_store import PatchStore, PatchReranker
+
+'''
+2025年10月19日
+patch匹配重排序的mAP与单条查询延迟（在result_evaluation目录下运行，需要项目根目录在PYTHONPATH中）：
+查询和数据库都需要在入库时开启patch_store，特征.npy用 vector_io 导出（配套_names.txt与patch存储中的图像名一致）。
+用法:
+    python eval_patch_rerank.py --queries q.npy --database x.npy \
+        --query-store ../data/patch_store/oxford5k_query_dinov3 --db-store ../data/patch_store/oxford5k_raw_dinov3
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="patch匹配重排序评估")
+    parser.add_argument('--queries', required=True, help="查询特征.npy")
+    parser.add_argument('--database', required=True, help="数据库特征.npy")
+    parser.add_argument('--query-store', required=True, help="查询图像的patch存储目录")
+    parser.add_argument('--db-store', required=True, help="数据库图像的patch存储目录")
+    parser.add_argument('--dataset', default='roxford5k')
+    parser.add_argument('--shortlist', type=int, default=100)
+    parser.add_argument('--threshold', type=float, default=0.5)
+    args = parser.parse_args()
+
+    Q, q_names = vector_io.load_vectors(args.queries, mmap=False)
+    X, x_names = vector_io.load_vectors(args.database)
+    x_names = np.asarray(x_names)
+    print(f">> 查询 {len(Q)}，数据库 {len(X)}，维度 {X.shape[1]}")
+
+    _, indices = exact_search(np.asarray(Q, dtype=np.float32), X, args.shortlist)
+    rows = [{'method': 'cls', 'mAP': evaluate_ranks(ranks_from_indices(indices, len(X)), args.dataset),
+             'ms/query': 0.0, 'p95 ms': 0.0}]
+
+    query_store = PatchStore(args.query_store)
+    reranker = PatchReranker(PatchStore(args.db_store), args.shortlist, args.threshold)
+    reranked, latencies, missing = [], [], []
+    for qi, idx in enumerate(indices):
+        # 查询不在patch存储中时保持CLS检索的顺序，不能用其他图像的patch重排
+        if q_names[qi] not in query_store:
+            missing.append(q_names[qi])
+            reranked.append(idx)
+            continue
+        start = time.perf_counter()
+        order, _ = reranker.rerank(query_store.get([q_names[qi]])[0], x_names[idx].tolist())
+        latencies.append((time.perf_counter() - start) * 1000)
+        reranked.append(idx[order])
+    rows.append({'method': f"patch_rerank(top{args.shortlist})",
+                 'mAP': evaluate_ranks(ranks_from_indices(np.stack(reranked), len(X)), args.dataset),
+                 'ms/query': float(np.mean(latencies or [0.0])),
+                 'p95 ms': float(np.percentile(latencies or [0.0], 95))})
+    if missing:
+        print(f">> {len(missing)} 条查询不在查询patch存储中，未重排（保持CLS顺序）: {missing[:5]}")
+    print_report(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+import argparse
+
+from eval_utils import load_features, exact_search, ranks_from_indices, evaluate_ranks, timed_search, print_report
+from main.utils import vector_io
+from main.utils.pca_whitening import PCAWhitening
+
+'''
+2025年10月19日
+PCA白化降维的mAP取舍（在result_evaluation目录下运行，需要项目根目录在PYTHONPATH中）：
+在留出集（如revisitop1m干扰项）上学习PCA白化，对Q、X降到各目标维度后精确检索，
+报告E/M/H的mAP、每向量字节数与单条查询QPS。
+用法:
+    python eval_pca_whitening.py --queries q.npy --database x.npy --train r1m.npy --dims 128,256,512
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PCA白化降维 mAP 对比")
+    parser.add_argument('--queries', help="查询特征.npy")
+    parser.add_argument('--database', help="数据库特征.npy")
+    parser.add_argument('--mat', help="或使用包含Q、X的.mat文件")
+    parser.add_argument('--train', help="学习PCA的留出集特征.npy（不能与评估集重叠）")
+    parser.add_argument('--pca', help="或直接使用已学习的PCA白化参数.npz")
+    parser.add_argument('--dataset', default='roxford5k')
+    parser.add_argument('--dims', default='128,256,512')
+    parser.add_argument('--topk', type=int, default=100)
+    args = parser.parse_args()
+
+    if not args.train and not args.pca:
+        parser.error("需要 --train 或 --pca 之一")
+    Q, X = load_features(args.queries, args.database, args.mat)
+    if args.pca:
+        pca = PCAWhitening.load(args.pca)
+    else:
+        train, _ = vector_io.load_vectors(args.train)
+        pca = PCAWhitening.learn(train)
+    print(f">> 查询 {len(Q)}，数据库 {len(X)}，原始维度 {X.shape[1]}")
+
+    rows = []
+    indices, qps, _ = timed_search(lambda q: exact_search(q, X, args.topk), Q)
+    rows.append({'method': f"raw({X.shape[1]})", 'mAP': evaluate_ranks(ranks_from_indices(indices, len(X)), args.dataset),
+                 'bytes/vector': 4 * X.shape[1], 'QPS': qps})
+    for dim in (int(d) for d in args.dims.split(',')):
+        Qd, Xd = pca.apply(Q, dim), pca.apply(X, dim)
+        indices, qps, _ = timed_search(lambda q: exact_search(q, Xd, args.topk), Qd)
+        rows.append({'method': f"pcaw({dim})", 'mAP': evaluate_ranks(ranks_from_indices(indices, len(Xd)), args.dataset),
+                     'bytes/vector': 4 * dim, 'QPS': qps})
+    print_report(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import argparse
+
+from eval_utils import load_features, exact_search, ranks_from_indices, evaluate_ranks, timed_search, print_report
+from main.utils.query_expansion import alpha_query_expansion, database_side_augmentation, l2_to_similarity
+
+'''
+2025年10月19日
+αQE / DBA 的mAP对比（在result_evaluation目录下运行，需要项目根目录在PYTHONPATH中）：
+baseline、αQE、DBA、DBA+αQE 四种组合，报告E/M/H的mAP与单条查询QPS（αQE的额外检索计入查询耗时）。
+用法:
+    python eval_query_expansion.py --queries q.npy --database x.npy --qe-k 2 --dba-k 2 --alpha 3
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="αQE / DBA 对比")
+    parser.add_argument('--queries', help="查询特征.npy")
+    parser.add_argument('--database', help="数据库特征.npy")
+    parser.add_argument('--mat', help="或使用包含Q、X的.mat文件")
+    parser.add_argument('--distractors', help="干扰项特征.npy（revisitop1m）")
+    parser.add_argument('--dataset', default='roxford5k')
+    parser.add_argument('--qe-k', type=int, default=2)
+    parser.add_argument('--dba-k', type=int, default=2)
+    parser.add_argument('--alpha', type=float, default=3.0)
+    parser.add_argument('--topk', type=int, default=100)
+    args = parser.parse_args()
+
+    Q, X = load_features(args.queries, args.database, args.mat, args.distractors)
+    print(f">> 查询 {len(Q)}，数据库 {len(X)}，维度 {X.shape[1]}")
+    X_dba = database_side_augmentation(X, args.dba_k, args.alpha)
+
+    rows = []
+    for method, database, qe in (('baseline', X, False), ('aqe', X, True),
+                                 ('dba', X_dba, False), ('dba+aqe', X_dba, True)):
+        def search(q, database=database, qe=qe):
+            if qe:
+                dist, idx = exact_search(q, database, args.qe_k)
+                q = alpha_query_expansion(q, database, args.qe_k, args.alpha, sims=l2_to_similarity(dist), indices=idx)
+            return exact_search(q, database, args.topk)
+        indices, qps, _ = timed_search(search, Q)
+        rows.append({'method': method, 'mAP': evaluate_ranks(ranks_from_indices(indices, len(X)), args.dataset), 'QPS': qps})
+    print_report(rows)
+
+
+if __name__ == '__main__':
+    main()
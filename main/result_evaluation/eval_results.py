@@ -0,0 +1,34 @@
+import argparse
+import os
+
+from eval_utils import ranks_from_indices, evaluate_ranks, print_report, data_root
+from dataset import configdataset
+from main.utils.result_store import ResultStore
+
+'''
+2025年10月19日
+直接评估 milvus_all_result.py 写出的二进制检索结果（在result_evaluation目录下运行，需要项目根目录在PYTHONPATH中）：
+结果中已经是imlist序号，按qimlist顺序取出后补全ranks即可计算E/M/H的mAP，不需要再解析图像名。
+用法:
+    python eval_results.py ../data/results/oxford5k_dinov3 [更多结果目录...]
+'''
+
+
+def main():
+    parser = argparse.ArgumentParser(description="评估二进制检索结果")
+    parser.add_argument('result_dirs', nargs='+')
+    parser.add_argument('--dataset', default='roxford5k')
+    args = parser.parse_args()
+
+    cfg = configdataset(args.dataset, os.path.join(data_root, "datasets"), use_cache=True)
+    gnd = cfg['gnd_cache']
+    rows = []
+    for result_dir in args.result_dirs:
+        store = ResultStore(result_dir)
+        ranks = ranks_from_indices(store.ordered_ids(gnd.qimlist.tolist()), gnd.n)
+        rows.append({'method': result_dir, 'mAP': evaluate_ranks(ranks, args.dataset), 'k': store.k, 'nq': store.nq})
+    print_report(rows)
+
+
+if __name__ == '__main__':
+    main()
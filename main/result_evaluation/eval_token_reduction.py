@@ -0,0 +1,72 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from PIL import Image
+from transformers import AutoImageProcessor, AutoModel
+
+from eval_utils import data_root, exact_search, ranks_from_indices, evaluate_ranks, print_report
+from main.utils import gnd_cache
+from main.utils.token_reduction import TokenReducedModel
+
+'''
+2025年10月19日
+token剪枝/合并的速度与mAP取舍（在result_evaluation目录下运行，需要项目根目录在PYTHONPATH中）：
+对roxford5k的查询与数据库图像分别用各设置提取CLS特征，报告前向吞吐(images/s)与compute_map的E/M/H mAP。
+用法:
+    python eval_token_reduction.py --images ../data/datasets/roxford5k/jpg --settings none,prune:0.25,merge:0.25
+'''
+
+
+def extract(processor, model, image_dir, names, batch_size):
+    """按names顺序提取L2归一化的CLS特征，返回(特征, 纯前向耗时秒)"""
+    features, forward_time = [], 0.0
+    with torch.no_grad():
+        for start in range(0, len(names), batch_size):
+            images = [Image.open(os.path.join(image_dir, f"{name}.jpg")).convert('RGB')
+                      for name in names[start:start + batch_size]]
+            inputs = processor(images=images, return_tensors="pt")
+            begin = time.perf_counter()
+            cls_feat = model(**inputs).last_hidden_state[:, 0, :]
+            forward_time += time.perf_counter() - begin
+            features.append(torch.nn.functional.normalize(cls_feat, p=2, dim=1).numpy().astype('float32'))
+    return np.concatenate(features), forward_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="token剪枝/合并评估")
+    parser.add_argument('--images', default=os.path.join(data_root, 'datasets', 'roxford5k', 'jpg'))
+    parser.add_argument('--model', default="facebook/dinov3-vitb16-pretrain-lvd1689m")
+    parser.add_argument('--dataset', default='roxford5k')
+    parser.add_argument('--settings', default='none,prune:0.25,merge:0.25', help="none 或 模式:比例，逗号分隔")
+    parser.add_argument('--layers', default='3,6,9', help="在这些层之前减少token")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--topk', type=int, default=100)
+    args = parser.parse_args()
+
+    gnd = gnd_cache.load_gnd_cache(os.path.join(data_root, 'datasets', args.dataset, f'gnd_{args.dataset}.pkl'))
+    imlist, qimlist = gnd.imlist.tolist(), gnd.qimlist.tolist()
+    processor = AutoImageProcessor.from_pretrained(args.model)
+    base_model = AutoModel.from_pretrained(args.model).eval()
+    layers = [int(layer) for layer in args.layers.split(',')]
+
+    rows = []
+    for setting in args.settings.split(','):
+        if setting == 'none':
+            model = base_model
+        else:
+            mode, rate = setting.split(':')
+            model = TokenReducedModel(base_model, mode, float(rate), layers).eval()
+        X, x_time = extract(processor, model, args.images, imlist, args.batch_size)
+        Q, q_time = extract(processor, model, args.images, qimlist, args.batch_size)
+        _, indices = exact_search(Q, X, args.topk)
+        rows.append({'method': setting, 'mAP': evaluate_ranks(ranks_from_indices(indices, len(X)), args.dataset),
+                     'images/s': (len(X) + len(Q)) / (x_time + q_time)})
+        print(f">> {setting}: {rows[-1]['images/s']:.2f} images/s")
+    print_report(rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import os
+import time
+
+import numpy as np
+from scipy.io import loadmat
+
+from dataset import configdataset
+from evaluate import compute_map
+from main.utils import vector_io
+
+'''
+2025年10月19日
+对比评估脚本（eval_*.py）共用的工具：
+加载Q/X特征（.npy或.mat，可追加revisitop1m干扰项）、分块精确检索、把top-k结果转换成ranks、
+按E/M/H三种协议计算mAP并打印。
+'''
+
+data_root = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'data')
+
+
+def load_features(queries=None, database=None, mat=None, distractors=None):
+    """
+    加载查询特征Q[nq, d]和数据库特征X[n, d]
+    :param queries: 查询特征.npy（vector_io格式）
+    :param database: 数据库特征.npy
+    :param mat: 或者使用milvus_to_mat生成的.mat文件（包含Q、X）
+    :param distractors: 可选的干扰项特征.npy（如revisitop1m），追加在X之后
+    """
+    if mat:
+        features = loadmat(mat)
+        Q, X = features['Q'], features['X']
+        # 统一成每行一个向量
+        if X.shape[0] < X.shape[1]:
+            X = X.T
+        if Q.shape[1] != X.shape[1]:
+            Q = Q.T
+    else:
+        Q, _ = vector_io.load_vectors(queries)
+        X, _ = vector_io.load_vectors(database)
+    Q = np.ascontiguousarray(Q, dtype=np.float32)
+    X = np.asarray(X, dtype=np.float32)
+    if distractors:
+        D, _ = vector_io.load_vectors(distractors)
+        X = np.concatenate([X, np.asarray(D, dtype=np.float32)])
+    return Q, X
+
+
+def exact_search(Q, X, k, block=65536):
+    """
+    分块精确检索（平方L2）
+    :return: (distances [nq, k], indices [nq, k])
+    """
+    k = min(k, len(X))
+    q_sq = np.einsum('ij,ij->i', Q, Q)[:, None]
+    best_d = np.full((len(Q), 0), np.inf, dtype=np.float32)
+    best_i = np.empty((len(Q), 0), dtype=np.int64)
+    for start in range(0, len(X), block):
+        xb = np.asarray(X[start:start + block], dtype=np.float32)
+        d = q_sq - 2.0 * (Q @ xb.T) + np.einsum('ij,ij->i', xb, xb)[None, :]
+        cand_d = np.concatenate([best_d, d], axis=1)
+        cand_i = np.concatenate([best_i, np.broadcast_to(np.arange(start, start + len(xb)), d.shape)], axis=1)
+        top = np.argpartition(cand_d, k - 1, axis=1)[:, :k] if cand_d.shape[1] > k else \
+            np.argsort(cand_d, axis=1)
+        best_d = np.take_along_axis(cand_d, top, axis=1)
+        best_i = np.take_along_axis(cand_i, top, axis=1)
+    order = np.argsort(best_d, axis=1)
+    return np.take_along_axis(best_d, order, axis=1), np.take_along_axis(best_i, order, axis=1)
+
+
+def ranks_from_indices(indices, n):
+    """
+    [nq, k]的检索结果 -> compute_map需要的完整ranks[n, nq]
+    top-k之外的图像按序号依次排在后面（compute_map要求每个查询至少能找到一个正样本）
+    :param n: 数据库大小
+    """
+    indices = np.asarray(indices)
+    ranks = np.empty((n, len(indices)), dtype=np.int32)
+    for qi, idx in enumerate(indices):
+        idx = idx[idx >= 0]
+        rest = np.ones(n, dtype=bool)
+        rest[idx] = False
+        ranks[:len(idx), qi] = idx
+        ranks[len(idx):, qi] = np.flatnonzero(rest)
+    return ranks
+
+
+def evaluate_ranks(ranks, dataset='roxford5k', ks=(1, 5, 10)):
+    """
+    按revisited协议计算mAP
+    :return: {'easy': mAP, 'medium': mAP, 'hard': mAP}（百分数）
+    """
+    cfg = configdataset(dataset, os.path.join(data_root, 'datasets'), use_cache=True)
+    result = {}
+    for protocol in ('easy', 'medium', 'hard'):
+        mAP, _, _, _ = compute_map(ranks, cfg['gnd_cache'].protocol(protocol), list(ks))
+        result[protocol] = float(np.around(mAP * 100, decimals=2))
+    return result
+
+
+def timed_search(search_fn, Q):
+    """
+    逐条查询计时
+    :param search_fn: 输入单个查询[1, d]，返回(distances, indices)
+    :return: (indices [nq, k], QPS, 每条查询延迟列表(秒))
+    """
+    latencies, indices = [], []
+    for q in Q:
+        start = time.perf_counter()
+        _, idx = search_fn(q[None, :])
+        latencies.append(time.perf_counter() - start)
+        indices.append(idx[0])
+    return np.stack(indices), len(Q) / sum(latencies), latencies
+
+
+def print_report(rows):
+    """
+    打印对比表
+    :param rows: [{'method': ..., 'mAP': {'easy','medium','hard'}, ...其它列}]
+    """
+    extra = [key for key in rows[0] if key not in ('method', 'mAP')]
+    header = f"{'方法':<28}{'mAP E':>8}{'mAP M':>8}{'mAP H':>8}" + ''.join(f"{key:>16}" for key in extra)
+    print(header)
+    for row in rows:
+        line = f"{row['method']:<28}{row['mAP']['easy']:>8.2f}{row['mAP']['medium']:>8.2f}{row['mAP']['hard']:>8.2f}"
+        for key in extra:
+            value = row[key]
+            line += f"{value:>16.3f}" if isinstance(value, float) else f"{str(value):>16}"
+        print(line)
@@ -1,21 +1,15 @@
 import scipy.io as sio
 import numpy as np
-from mpmath import limit
 from pymilvus import connections, Collection
 from main.utils import get_ipadress
-from pymilvus import MilvusClient
 
 '''
 将milvus中的特征数据写入.mat文件当中
 '''
 
-host_ip = get_ipadress.get_host_ip()
-print("ip = " + host_ip)
-client = MilvusClient("http://" + host_ip + ":19530")
-
 
 def replace_q_x_with_milvus_data(mat_file_path, output_file_path,
-                                 milvus_host=host_ip, milvus_port='19530',
+                                 milvus_host=None, milvus_port='19530',
                                  collection_name_q='oxford5k_query_dinov3',
                                  collection_name_x='oxford5k_raw_dinov3'):
     """
@@ -24,7 +18,7 @@ def replace_q_x_with_milvus_data(mat_file_path, output_file_path,
     参数:
     - mat_file_path: 原始.mat文件路径
     - output_file_path: 输出文件路径
-    - milvus_host: Milvus服务器地址
+    - milvus_host: Milvus服务器地址，默认本机IP
     - milvus_port: Milvus端口
     - collection_name_q: 存储Q向量的集合名
     - collection_name_x: 存储X向量的集合名
@@ -32,6 +26,7 @@ def replace_q_x_with_milvus_data(mat_file_path, output_file_path,
 
     # 1. 连接Milvus
     print("连接Milvus...")
+    milvus_host = milvus_host or get_ipadress.get_host_ip()
     connections.connect(host=milvus_host, port=milvus_port)
 
     # 2. 从Milvus读取Q数据
@@ -85,6 +80,8 @@ def replace_q_x_with_milvus_data(mat_file_path, output_file_path,
 # 使用示例
 if __name__ == "__main__":
     # 替换为您的实际参数
+    host_ip = get_ipadress.get_host_ip()
+    print("ip = " + host_ip)
     input_file = "../data/features/roxford5k_resnet_rsfm120k_gem.mat"
     output_file = "../data/features/roxford5k_resnet_rsfm120k_gem_modified001.mat"
 
@@ -15,6 +15,8 @@ from scipy.io import loadmat
 from dataset import configdataset
 from download import download_datasets, download_features
 from evaluate import compute_map
+from main.utils.query_expansion import alpha_query_expansion, database_side_augmentation
+from main.utils.feature_store import open_feature_store
 
 #---------------------------------------------------------------------
 # Set data folder and testing parameters
@@ -28,6 +30,13 @@ data_root = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file
 
 # Set test dataset: roxford5k | rparis6k
 test_dataset = 'roxford5k'
+# 本地特征存储文件（入库时写出，见config.yml中feature_store），为None时仍读取.mat
+query_store = None  # 例如 os.path.join(data_root, 'features', 'oxford5k_query_dinov3.fstore')
+database_store = None  # 例如 os.path.join(data_root, 'features', 'oxford5k_raw_dinov3.fstore')
+# α加权查询扩展(αQE)与数据库端增强(DBA)的近邻数，0表示不使用
+qe_k = 0
+dba_k = 0
+alpha = 3.0
 
 #---------------------------------------------------------------------
 # Evaluate
@@ -36,16 +45,26 @@ test_dataset = 'roxford5k'
 print('>> {}: Evaluating test dataset...'.format(test_dataset))
 # config file for the dataset
 # separates query image list from database image list, when revisited protocol used
-cfg = configdataset(test_dataset, os.path.join(data_root, 'datasets'))
+cfg = configdataset(test_dataset, os.path.join(data_root, 'datasets'), use_cache=True)
 
 # load query and database features
 print('>> {}: Loading features...'.format(test_dataset))
 
-# 4993 = 5063 - 70 将70张查询图从raw里面摘出
-features = loadmat(os.path.join(data_root, 'features', '{}_resnet_rsfm120k_gem_modified.mat'.format(test_dataset)))
-Q = features['Q']
-X = features['X']
-print(features)
+if query_store and database_store:
+    # 内存映射读取，每行一个向量
+    Q = open_feature_store(query_store).vectors
+    X = open_feature_store(database_store).vectors
+else:
+    # 4993 = 5063 - 70 将70张查询图从raw里面摘出
+    features = loadmat(os.path.join(data_root, 'features', '{}_resnet_rsfm120k_gem_modified.mat'.format(test_dataset)))
+    Q = features['Q']
+    X = features['X']
+    print(features)
+# 可选：先做DBA，再在增强后的数据库上做αQE（均为批量矩阵运算）
+if dba_k > 0:
+    X = database_side_augmentation(X, dba_k, alpha)
+if qe_k > 0:
+    Q = alpha_query_expansion(Q, X, qe_k, alpha)
 # perform search
 print('>> {}: Retrieval...'.format(test_dataset))
 # sim = np.dot(X.T, Q) #原本的矩阵
@@ -53,37 +72,20 @@ sim = np.dot(X, Q.T)
 ranks = np.argsort(-sim, axis=0)
 
 # revisited evaluation
-gnd = cfg['gnd']
+# E/M/H三种协议的ok/junk已在gnd缓存中预先拼接好，这里直接取内存映射视图
+gnd_cache = cfg['gnd_cache']
 
 # evaluate ranks
 ks = [1, 5, 10]
 
 # search for easy
-gnd_t = []
-for i in range(len(gnd)):
-    g = {}
-    g['ok'] = np.concatenate([gnd[i]['easy']])
-    g['junk'] = np.concatenate([gnd[i]['junk'], gnd[i]['hard']])
-    gnd_t.append(g)
-mapE, apsE, mprE, prsE = compute_map(ranks, gnd_t, ks)
+mapE, apsE, mprE, prsE = compute_map(ranks, gnd_cache.protocol('easy'), ks)
 
 # search for easy & hard
-gnd_t = []
-for i in range(len(gnd)):
-    g = {}
-    g['ok'] = np.concatenate([gnd[i]['easy'], gnd[i]['hard']])
-    g['junk'] = np.concatenate([gnd[i]['junk']])
-    gnd_t.append(g)
-mapM, apsM, mprM, prsM = compute_map(ranks, gnd_t, ks)
+mapM, apsM, mprM, prsM = compute_map(ranks, gnd_cache.protocol('medium'), ks)
 
 # search for hard
-gnd_t = []
-for i in range(len(gnd)):
-    g = {}
-    g['ok'] = np.concatenate([gnd[i]['hard']])
-    g['junk'] = np.concatenate([gnd[i]['junk'], gnd[i]['easy']])
-    gnd_t.append(g)
-mapH, apsH, mprH, prsH = compute_map(ranks, gnd_t, ks)
+mapH, apsH, mprH, prsH = compute_map(ranks, gnd_cache.protocol('hard'), ks)
 
 print('>> {}: mAP E: {}, M: {}, H: {}'.format(test_dataset, np.around(mapE*100, decimals=2), np.around(mapM*100, decimals=2), np.around(mapH*100, decimals=2)))
 print('>> {}: mP@k{} E: {}, M: {}, H: {}'.format(test_dataset, np.array(ks), np.around(mprE*100, decimals=2), np.around(mprM*100, decimals=2), np.around(mprH*100, decimals=2)))
@@ -0,0 +1,237 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import queue
+import re
+import time
+
+import numpy as np
+import yaml
+
+'''
+2025年10月19日
+CPU特征提取参数自动调优（在main/src目录下运行）：
+1.用数据集中的样例图像，对 进程数 × 每进程线程数 × batch size 的组合各做一次短时试验，
+  测量 gen_batch_image_features 的总吞吐（images/s），选出最优组合。
+2.另外对单张图像（batch=1）测不同线程数下的延迟，作为检索时的query_num_threads。
+  试验进程出错、被杀（如进程数×线程数过大时内存不足）或超过 --trial-timeout 时终止其余进程，该组合记为失败，继续下一组合。
+3.结果写回 config/config.yml 的 processing 段（保留文件中的注释），dinov3_images_persistence_003.py 会直接使用。
+用法:
+    python autotune.py --images 64 --batch-sizes 8,16,32
+'''
+
+CONFIG_PATH = "../config/config.yml"
+
+
+def _parse_list(text):
+    return [int(x) for x in text.split(',') if x.strip()]
+
+
+def _default_grid(cpu_count):
+    values = [1]
+    while values[-1] * 2 <= cpu_count:
+        values.append(values[-1] * 2)
+    if values[-1] != cpu_count:
+        values.append(cpu_count)
+    return values
+
+
+def _trial_worker(model_dir, num_threads, interop_threads, image_paths, batch_size, barrier, result_queue,
+                  timeout):
+    """单个试验进程：加载模型、预解码图像、同步后开始计时；出错时放弃同步，让其余进程也退出"""
+    try:
+        result_queue.put(('ok', _run_trial_worker(model_dir, num_threads, interop_threads, image_paths,
+                                                  batch_size, barrier, timeout)))
+    except Exception as e:
+        barrier.abort()
+        result_queue.put(('error', repr(e)))
+
+
+def _run_trial_worker(model_dir, num_threads, interop_threads, image_paths, batch_size, barrier, timeout):
+    import torch
+    from PIL import Image
+    from transformers import AutoImageProcessor, AutoModel
+    from main.src import dinov3_images_persistence_003 as persistence
+
+    persistence.apply_thread_config(num_threads, interop_threads)
+    processor = AutoImageProcessor.from_pretrained(model_dir)
+    model = AutoModel.from_pretrained(model_dir).eval()
+    device = torch.device("cpu")
+    images = [Image.open(path).convert('RGB') for path in image_paths]
+
+    # 预热一个批次
+    persistence.gen_batch_image_features(processor, model, device, images[:batch_size])
+    barrier.wait(timeout)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        batch_start = time.perf_counter()
+        persistence.gen_batch_image_features(processor, model, device, images[i:i + batch_size])
+        latencies.append(time.perf_counter() - batch_start)
+    end = time.perf_counter()
+    return len(images), end - start, latencies
+
+
+def _collect_results(workers, result_queue, timeout):
+    """
+    收集每个试验进程的结果
+    :return: (结果列表, 失败原因)，失败原因为None表示全部成功
+    """
+    results = []
+    deadline = time.monotonic() + timeout
+    while len(results) < len(workers):
+        try:
+            status, value = result_queue.get(timeout=1.0)
+        except queue.Empty:
+            crashed = [w.exitcode for w in workers if w.exitcode not in (None, 0)]
+            if crashed:
+                return results, f"试验进程异常退出（exitcode {crashed[0]}）"
+            if all(w.exitcode == 0 for w in workers):
+                return results, "试验进程未返回结果"
+            if time.monotonic() > deadline:
+                return results, f"超过 {timeout:.0f}s 未完成"
+            continue
+        if status != 'ok':
+            return results, value
+        results.append(value)
+    return results, None
+
+
+def run_trial(model_dir, image_paths, processes, threads, batch_size, timeout=600.0):
+    """
+    运行一次试验
+    :param timeout: 整个试验（含加载模型）的最长秒数
+    :return: {'images_per_s', 'p50_ms'}，p50_ms为单个批次的中位延迟；试验失败时为 {'error': 原因}
+    """
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(processes)
+    result_queue = ctx.Queue()
+    workers = [
+        ctx.Process(target=_trial_worker,
+                    args=(model_dir, threads, 1 if processes > 1 else None, image_paths, batch_size,
+                          barrier, result_queue, timeout))
+        for _ in range(processes)
+    ]
+    for w in workers:
+        w.start()
+    results, error = _collect_results(workers, result_queue, timeout)
+    for w in workers:
+        if error is not None and w.is_alive():
+            w.terminate()
+        w.join()
+    if error is not None:
+        return {'error': error}
+
+    total_images = sum(r[0] for r in results)
+    # 所有进程同时开始，按最慢的进程计算总吞吐
+    wall_time = max(r[1] for r in results)
+    latencies = [lat for r in results for lat in r[2]]
+    return {
+        'images_per_s': total_images / wall_time,
+        'p50_ms': float(np.median(latencies)) * 1000.0,
+    }
+
+
+def update_config_section(config_path, section, values):
+    """
+    以文本方式更新yml中某一段的键值，保留原有注释和其它段落
+    :param section: 顶层段名，如 processing
+    :param values: {键: 值}
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    start = next(i for i, line in enumerate(lines) if line.rstrip() == f"{section}:")
+    end = start + 1
+    while end < len(lines) and (lines[end].startswith((' ', '\t')) or not lines[end].strip()):
+        end += 1
+    # 段末尾的空行不属于本段
+    while end > start + 1 and not lines[end - 1].strip():
+        end -= 1
+
+    remaining = dict(values)
+    for i in range(start + 1, end):
+        match = re.match(r'^(\s+)([A-Za-z_][\w]*):(\s*)([^#]*?)(\s*#.*)?$', lines[i])
+        if match and match.group(2) in remaining:
+            indent, key, _, _, comment = match.groups()
+            value = yaml.safe_dump(remaining.pop(key), default_flow_style=True).strip().removesuffix('...').strip()
+            lines[i] = f"{indent}{key}: {value}{'  ' + comment.strip() if comment else ''}"
+    for key, v in remaining.items():
+        value = yaml.safe_dump(v, default_flow_style=True).strip().removesuffix('...').strip()
+        lines.insert(end, f"  {key}: {value}")
+        end += 1
+
+    with open(config_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="CPU特征提取线程数/进程数/batch size自动调优")
+    parser.add_argument('--images', type=int, default=64, help="每个试验进程使用的样例图像数")
+    parser.add_argument('--processes', default=','.join(map(str, _default_grid(cpu_count))))
+    parser.add_argument('--threads', default=','.join(map(str, _default_grid(cpu_count))))
+    parser.add_argument('--batch-sizes', default='8,16,32')
+    parser.add_argument('--query-threads', default=','.join(map(str, _default_grid(cpu_count))))
+    parser.add_argument('--config', default=CONFIG_PATH)
+    parser.add_argument('--trial-timeout', type=float, default=600.0, help="单次试验（含加载模型）的最长秒数")
+    parser.add_argument('--dry-run', action='store_true', help="只打印结果，不写回config.yml")
+    args = parser.parse_args()
+
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    model_dir = config['model']['dir']
+    dataset_path = config['data']['dataset_path']
+    extensions = tuple(config['data']['image_extensions'])
+    names = sorted(n for n in os.listdir(dataset_path) if n.lower().endswith(extensions))[:args.images]
+    image_paths = [os.path.join(dataset_path, n) for n in names]
+    print(f"样例图像: {len(image_paths)} 张，CPU核数: {cpu_count}")
+
+    # 1.批量提取：进程数 × 线程数 × batch size，进程数×线程数不超过CPU核数
+    trials = []
+    for processes, threads, batch_size in itertools.product(
+            _parse_list(args.processes), _parse_list(args.threads), _parse_list(args.batch_sizes)):
+        if processes * threads > cpu_count:
+            continue
+        result = run_trial(model_dir, image_paths, processes, threads, batch_size, args.trial_timeout)
+        if 'error' in result:
+            print(f"进程 {processes} × 线程 {threads} × batch {batch_size}: 失败（{result['error']}）")
+            continue
+        trials.append(((processes, threads, batch_size), result))
+        print(f"进程 {processes} × 线程 {threads} × batch {batch_size}: "
+              f"{result['images_per_s']:.2f} images/s, 批次p50 {result['p50_ms']:.1f} ms")
+    if not trials:
+        raise RuntimeError("所有批量提取试验均失败")
+    (best_processes, best_threads, best_batch), best = max(trials, key=lambda t: t[1]['images_per_s'])
+
+    # 2.检索路径：单进程、batch=1，按延迟选线程数
+    query_trials = []
+    for threads in _parse_list(args.query_threads):
+        result = run_trial(model_dir, image_paths[:16], 1, threads, 1, args.trial_timeout)
+        if 'error' in result:
+            print(f"检索 线程 {threads}: 失败（{result['error']}）")
+            continue
+        query_trials.append((threads, result))
+        print(f"检索 线程 {threads}: p50 {result['p50_ms']:.1f} ms")
+    if not query_trials:
+        raise RuntimeError("所有检索线程数试验均失败")
+    best_query_threads, best_query = min(query_trials, key=lambda t: t[1]['p50_ms'])
+
+    print(f"\n最优批量提取配置: 进程 {best_processes}，线程 {best_threads}，batch {best_batch} "
+          f"({best['images_per_s']:.2f} images/s)")
+    print(f"最优检索线程数: {best_query_threads} (p50 {best_query['p50_ms']:.1f} ms)")
+
+    if not args.dry_run:
+        update_config_section(args.config, 'processing', {
+            'batch_size': best_batch,
+            'num_workers': best_processes,
+            'num_threads': best_threads,
+            'interop_threads': 1 if best_processes > 1 else None,
+            'query_num_threads': best_query_threads,
+        })
+        print(f"已写回 {args.config}")
+
+
+if __name__ == '__main__':
+    main()
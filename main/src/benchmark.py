@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+
+'''
+2025年10月19日
+性能基准测试（在main/src目录下运行）：
+1.run：测量 gen_batch_image_features 的 images/s、Milvus插入的 rows/s、检索的QPS和p50/p99延迟、compute_map的耗时，
+  结果写成JSON文件。检索/插入默认使用本地Milvus Lite文件（不需要启动milvus容器），也可以用--milvus-uri指定服务器。
+2.compare：比较两次run的JSON结果，超过阈值的退化会被标出，并以非0状态码退出。
+用法:
+    python benchmark.py run --suite synthetic --output bench_base.json
+    python benchmark.py compare bench_base.json bench_new.json --threshold 0.1
+'''
+
+# 各测试规模: synthetic为快速冒烟测试，oxford与roxford5k规模一致（4993张数据库图像，70张查询）
+SUITES = {
+    'synthetic': {'images': 64, 'batch_sizes': [8, 32], 'rows': 10000, 'queries': 200, 'db_size': 4993, 'nq': 70},
+    'oxford': {'images': 512, 'batch_sizes': [1, 8, 32], 'rows': 4993, 'queries': 70, 'db_size': 4993, 'nq': 70},
+}
+
+
+def _metric(value, unit, better):
+    return {'value': float(value), 'unit': unit, 'better': better}
+
+
+def _percentile_ms(latencies, q):
+    return float(np.percentile(np.asarray(latencies) * 1000.0, q))
+
+
+def _random_vectors(num, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((num, dim)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def _load_images(suite, num_images, dataset_path, extensions):
+    """oxford规模使用数据集中的真实图像，synthetic使用随机图像"""
+    from PIL import Image
+    if suite == 'oxford' and os.path.exists(dataset_path):
+        names = sorted(n for n in os.listdir(dataset_path) if n.lower().endswith(extensions))[:num_images]
+        return [Image.open(os.path.join(dataset_path, n)).convert('RGB') for n in names]
+    rng = np.random.default_rng(0)
+    return [Image.fromarray(rng.integers(0, 256, (480, 640, 3), dtype=np.uint8)) for _ in range(num_images)]
+
+
+def bench_extraction(params, results, suite):
+    """测量不同batch size下 gen_batch_image_features 的吞吐"""
+    import torch
+    from transformers import AutoImageProcessor, AutoModel
+    from main.src import dinov3_images_persistence_003 as persistence
+
+    config = persistence.get_config()
+    processor = AutoImageProcessor.from_pretrained(config["model"]["dir"])
+    model = AutoModel.from_pretrained(config["model"]["dir"])
+    device = torch.device('cuda:0' if torch.cuda.is_available() else "cpu")
+    model.to(device)
+    model.eval()
+
+    images = _load_images(suite, params['images'], config["data"]["dataset_path"],
+                          tuple(config["data"]["image_extensions"]))
+    for batch_size in params['batch_sizes']:
+        # 预热一个批次，排除首次调用的初始化开销
+        persistence.gen_batch_image_features(processor, model, device, images[:batch_size])
+        start = time.perf_counter()
+        for i in range(0, len(images), batch_size):
+            persistence.gen_batch_image_features(processor, model, device, images[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        results[f'extraction.batch{batch_size}.images_per_s'] = _metric(len(images) / elapsed, 'images/s', 'higher')
+        print(f"特征提取 batch={batch_size}: {len(images) / elapsed:.2f} images/s")
+
+
+def bench_milvus(params, results, milvus_uri, dim, insert_batch, limit):
+    """测量插入吞吐、单条检索延迟和批量检索吞吐"""
+    from pymilvus import MilvusClient
+
+    client = MilvusClient(milvus_uri)
+    collection_name = f"benchmark_{os.getpid()}"
+    if client.has_collection(collection_name=collection_name):
+        client.drop_collection(collection_name=collection_name)
+    client.create_collection(collection_name=collection_name, dimension=dim, metric_type="L2", auto_id=True)
+
+    try:
+        vectors = _random_vectors(params['rows'], dim)
+        start = time.perf_counter()
+        for i in range(0, len(vectors), insert_batch):
+            client.insert(
+                collection_name=collection_name,
+                data=[{"vector": v.tolist(), "image_name": f"bench_{i + j:07d}.jpg"}
+                      for j, v in enumerate(vectors[i:i + insert_batch])]
+            )
+        elapsed = time.perf_counter() - start
+        results['milvus.insert.rows_per_s'] = _metric(len(vectors) / elapsed, 'rows/s', 'higher')
+        print(f"Milvus插入: {len(vectors) / elapsed:.1f} rows/s")
+
+        queries = _random_vectors(params['queries'], dim, seed=1)
+        search_params = {"metric_type": "L2", "params": {}}
+        client.search(collection_name=collection_name, data=queries[:1], limit=limit, search_params=search_params)
+        latencies = []
+        for q in queries:
+            start = time.perf_counter()
+            client.search(collection_name=collection_name, data=[q], limit=limit, search_params=search_params)
+            latencies.append(time.perf_counter() - start)
+        results['milvus.search.qps'] = _metric(len(latencies) / sum(latencies), 'queries/s', 'higher')
+        results['milvus.search.p50_ms'] = _metric(_percentile_ms(latencies, 50), 'ms', 'lower')
+        results['milvus.search.p99_ms'] = _metric(_percentile_ms(latencies, 99), 'ms', 'lower')
+
+        start = time.perf_counter()
+        client.search(collection_name=collection_name, data=queries, limit=limit, search_params=search_params)
+        elapsed = time.perf_counter() - start
+        results['milvus.search_batch.qps'] = _metric(len(queries) / elapsed, 'queries/s', 'higher')
+        print(f"Milvus检索: {results['milvus.search.qps']['value']:.1f} QPS, "
+              f"p50 {results['milvus.search.p50_ms']['value']:.2f} ms, "
+              f"p99 {results['milvus.search.p99_ms']['value']:.2f} ms")
+    finally:
+        client.drop_collection(collection_name=collection_name)
+
+
+def _synthetic_gnd(db_size, nq, seed=0):
+    rng = np.random.default_rng(seed)
+    gnd = []
+    for _ in range(nq):
+        ids = rng.choice(db_size, size=rng.integers(20, 120), replace=False)
+        gnd.append({'easy': ids[:len(ids) // 3], 'hard': ids[len(ids) // 3:2 * len(ids) // 3],
+                    'junk': ids[2 * len(ids) // 3:]})
+    return gnd
+
+
+def bench_compute_map(params, results, repeats):
+    """测量E/M/H三种协议下compute_map的耗时（ranks为完整排序）"""
+    from main.result_evaluation.evaluate import compute_map
+
+    db_size, nq = params['db_size'], params['nq']
+    gnd = _synthetic_gnd(db_size, nq)
+    rng = np.random.default_rng(0)
+    ranks = np.argsort(rng.random((db_size, nq)), axis=0)
+    protocols = {
+        'easy': [{'ok': g['easy'], 'junk': np.concatenate([g['junk'], g['hard']])} for g in gnd],
+        'medium': [{'ok': np.concatenate([g['easy'], g['hard']]), 'junk': g['junk']} for g in gnd],
+        'hard': [{'ok': g['hard'], 'junk': np.concatenate([g['junk'], g['easy']])} for g in gnd],
+    }
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for gnd_t in protocols.values():
+            compute_map(ranks, gnd_t, [1, 5, 10])
+        timings.append(time.perf_counter() - start)
+    results['evaluate.compute_map.ms'] = _metric(float(np.median(timings)) * 1000.0, 'ms', 'lower')
+    print(f"compute_map (E/M/H, {db_size}x{nq}): {results['evaluate.compute_map.ms']['value']:.1f} ms")
+
+
+def run(args):
+    params = SUITES[args.suite]
+    results = {}
+    stages = set(args.stages.split(','))
+    if 'extraction' in stages:
+        bench_extraction(params, results, args.suite)
+    if 'milvus' in stages:
+        bench_milvus(params, results, args.milvus_uri, args.dim, args.insert_batch, args.limit)
+    if 'evaluate' in stages:
+        bench_compute_map(params, results, args.repeats)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'suite': args.suite,
+            'stages': sorted(stages),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'milvus_uri': args.milvus_uri,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已保存到 {args.output}")
+
+
+def compare(args):
+    """比较两次结果，返回是否存在退化"""
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        base = json.load(f)['results']
+    with open(args.candidate, 'r', encoding='utf-8') as f:
+        new = json.load(f)['results']
+
+    regressions = []
+    print(f"{'指标':<40}{'基线':>14}{'当前':>14}{'变化':>10}")
+    for name in sorted(set(base) & set(new)):
+        old_value, new_value = base[name]['value'], new[name]['value']
+        change = (new_value - old_value) / old_value if old_value else 0.0
+        # 统一成"正数表示变差"
+        worse = -change if base[name]['better'] == 'higher' else change
+        flag = ''
+        if worse > args.threshold:
+            flag = '  <-- 退化'
+            regressions.append(name)
+        print(f"{name:<40}{old_value:>14.3f}{new_value:>14.3f}{change * 100:>9.1f}%{flag}")
+    for name in sorted(set(base) ^ set(new)):
+        print(f"{name:<40}（只在其中一次结果中出现）")
+
+    if regressions:
+        print(f"\n发现 {len(regressions)} 项退化（阈值 {args.threshold * 100:.0f}%）: {', '.join(regressions)}")
+    else:
+        print("\n没有发现退化")
+    return bool(regressions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DINOv3检索流程性能基准")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="运行基准测试并写出JSON结果")
+    run_parser.add_argument('--suite', choices=sorted(SUITES), default='synthetic')
+    run_parser.add_argument('--stages', default='extraction,milvus,evaluate',
+                            help="逗号分隔: extraction,milvus,evaluate")
+    run_parser.add_argument('--milvus-uri', default='./benchmark_milvus.db',
+                            help="Milvus地址，默认使用本地Milvus Lite文件")
+    run_parser.add_argument('--dim', type=int, default=768)
+    run_parser.add_argument('--insert-batch', type=int, default=32)
+    run_parser.add_argument('--limit', type=int, default=10)
+    run_parser.add_argument('--repeats', type=int, default=5)
+    run_parser.add_argument('--output', default='benchmark_results.json')
+
+    compare_parser = subparsers.add_parser('compare', help="比较两次基准结果")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help="允许的相对退化比例")
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif compare(args):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+import yaml
+from PIL import Image
+from pymilvus import DataType
+from tqdm import tqdm
+from transformers import AutoImageProcessor, AutoModel
+
+from main.src import dinov3_images_persistence_003 as persistence
+from main.utils import gnd_cache
+from main.utils import pca_whitening
+from main.utils import search_client
+from main.utils import metrics as pipeline_metrics
+
+'''
+2025年10月19日
+两阶段级联检索（在main/src目录下运行）：
+1.ingest：用小编码器（如DINOv3 ViT-S/16，384维）对数据库图像提特征，存入低维集合 cascade.small_collection。
+2.search：查询图像先经小编码器在低维集合中召回shortlist，
+  再用ViT-B特征只对shortlist里的图像从已存储的向量中重新打分（不再对ViT-B集合做全库检索）。
+  查询本身已在ViT-B集合中（如oxford5k_query_dinov3）时直接取存储的向量，不需要ViT-B前向。
+用法:
+    python cascade_retrieval.py ingest
+    python cascade_retrieval.py search --image ../data/oxford5k_query/hertford_000082.jpg
+'''
+
+
+def load_encoder(model_dir, device):
+    processor = AutoImageProcessor.from_pretrained(model_dir)
+    model = AutoModel.from_pretrained(model_dir).to(device).eval()
+    return processor, model
+
+
+def ingest(config, image_name_list):
+    """用小编码器提取数据库图像特征并写入低维集合（复用003的批处理函数）"""
+    cascade_config = config["cascade"]
+    metrics = pipeline_metrics.from_config(config)
+    client = search_client.create_search_client({**config, "search": {"backend": "milvus"}})
+    collection_name = cascade_config["small_collection"]
+    if not client.has_collection(collection_name=collection_name):
+        client.create_collection(
+            collection_name=collection_name,
+            schema={
+                "fields": [
+                    {"name": "id", "type": DataType.INT64, "is_primary": True, "auto_id": True},
+                    {"name": "vector", "type": DataType.FLOAT_VECTOR, "dim": cascade_config["small_feature_dim"]},
+                    {"name": "image_name", "type": DataType.VARCHAR, "max_length": 256}
+                ]
+            }
+        )
+        print(f"已创建Milvus集合: {collection_name}")
+
+    device = torch.device('cuda:0' if torch.cuda.is_available() else "cpu")
+    processor, model = load_encoder(cascade_config["small_model_dir"], device)
+    # 与003相同，按给定的图像名称列表顺序查找实际文件
+    dataset_path = config["data"]["dataset_path"]
+    image_files = []
+    for base_name in image_name_list:
+        for ext in config["data"]["image_extensions"]:
+            if os.path.exists(os.path.join(dataset_path, f"{base_name}{ext}")):
+                image_files.append(f"{base_name}{ext}")
+                break
+        else:
+            print(f"警告: 未找到图像文件 {base_name}（尝试了所有扩展名）")
+
+    batch_size = config["processing"]["batch_size"]
+    for batch_idx in tqdm(range(0, len(image_files), batch_size), desc="小编码器特征提取"):
+        persistence.process_batch(batch_idx // batch_size, image_files[batch_idx:batch_idx + batch_size],
+                                  dataset_path, None, processor, model, device, client, collection_name, metrics)
+    metrics.close()
+
+
+class CascadeSearcher:
+    """
+    :param client: MilvusClient或LocalSearchClient
+    :param small: 小编码器 (processor, model)
+    :param large: ViT-B编码器 (processor, model)，查询向量全部来自存储时可为None
+    :param shortlist: 第一阶段召回数
+    """
+
+    def __init__(self, client, small, large, small_collection, large_collection, shortlist=100, device=None,
+                 metrics=pipeline_metrics.NULL_METRICS, whitening=None, target_dim=None):
+        self.client = client
+        self.small = small
+        self.large = large
+        self.small_collection = small_collection
+        self.large_collection = large_collection
+        self.shortlist = shortlist
+        self.device = device or torch.device("cpu")
+        self.metrics = metrics
+        # ViT-B集合入库时做了PCA白化的话，查询向量也要做同样的变换
+        self.whitening = whitening
+        self.target_dim = target_dim
+
+    def _embed(self, encoder, image):
+        processor, model = encoder
+        return persistence.gen_batch_image_features(processor, model, self.device, [image], self.metrics)
+
+    def _stored_vectors(self, names):
+        """从ViT-B集合中按图像名取回存储的向量"""
+        entities = self.client.query(collection_name=self.large_collection, filter=f"image_name in {list(names)}",
+                                     output_fields=["image_name", "vector"])
+        by_name = {entity["image_name"]: entity["vector"] for entity in entities}
+        return [name for name in names if name in by_name], \
+            np.asarray([by_name[name] for name in names if name in by_name], dtype=np.float32)
+
+    def search(self, image, limit=10, large_query=None):
+        """
+        :param image: 查询图像（PIL）
+        :param large_query: 已有的ViT-B查询向量[d]，为None时对查询图像做ViT-B前向
+        :return: [(image_name, 平方L2距离), ...] 按距离从小到大
+        """
+        with self.metrics.timer('small_forward'):
+            small_query = self._embed(self.small, image)
+        with self.metrics.timer('small_search'):
+            hits = self.client.search(collection_name=self.small_collection, data=small_query, limit=self.shortlist,
+                                      output_fields=["image_name"], search_params={"metric_type": "L2", "params": {}})
+        names = [hit["entity"]["image_name"] for hit in hits[0]]
+        if large_query is None:
+            with self.metrics.timer('large_forward'):
+                large_query = persistence.whiten_features(self._embed(self.large, image), self.whitening,
+                                                          self.target_dim)[0]
+        with self.metrics.timer('rescore'):
+            names, vectors = self._stored_vectors(names)
+            distances = ((vectors - np.asarray(large_query, dtype=np.float32)) ** 2).sum(axis=1)
+            order = np.argsort(distances, kind='stable')[:limit]
+        return [(names[i], float(distances[i])) for i in order]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="小编码器召回 + ViT-B重打分的级联检索")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('ingest', help="小编码器提取数据库特征")
+    search_parser = sub.add_parser('search', help="级联检索一张查询图像")
+    search_parser.add_argument('--image', default="../data/oxford5k_query/hertford_000082.jpg")
+    search_parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    with open("../config/config.yml", 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    cascade_config = config["cascade"]
+
+    if args.command == 'ingest':
+        gnd = gnd_cache.load_gnd_cache('../data/datasets/roxford5k/gnd_roxford5k.pkl')
+        ingest(config, gnd.imlist.tolist())
+        return
+
+    metrics = pipeline_metrics.from_config(config)
+    device = torch.device('cuda:0' if torch.cuda.is_available() else "cpu")
+    whitening, target_dim = pca_whitening.from_config(config)
+    searcher = CascadeSearcher(search_client.create_search_client(config),
+                               load_encoder(cascade_config["small_model_dir"], device),
+                               load_encoder(config["model"]["dir"], device),
+                               cascade_config["small_collection"], cascade_config["large_collection"],
+                               int(cascade_config.get("shortlist", 100)), device, metrics, whitening, target_dim)
+    image = Image.open(args.image).convert('RGB')
+    start = time.perf_counter()
+    results = searcher.search(image, args.limit)
+    print(f"级联检索耗时: {(time.perf_counter() - start) * 1000:.1f} ms")
+    for i, (name, distance) in enumerate(results, 1):
+        print(f"{i}. {name} (距离: {distance:.4f})")
+    metrics.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,19 @@
 from transformers import AutoImageProcessor, AutoModel  # DINOv3使用的处理器和模型
 from PIL import Image
-from pymilvus import MilvusClient
 import matplotlib.pyplot as plt
 import torch
+import io
 import os
-from main.utils import get_ipadress
+import yaml
+from main.utils import search_client
+from main.utils import metrics as pipeline_metrics
+from main.utils import pca_whitening
+from main.utils import query_expansion
+from main.utils import patch_store
+from main.utils import token_reduction
+from main.utils import query_cache
+from main.utils import fanout_search
+from main.utils import metadata
 
 '''
 2025年10月4日15:25:33
@@ -13,25 +22,39 @@ from main.utils import get_ipadress
 '''
 
 # 生成特征向量（适配DINOv3模型）
-def gen_image_features(processor, model, device, images):
+def gen_image_features(processor, model, device, images, metrics=pipeline_metrics.NULL_METRICS, patch_top_n=None):
     with torch.no_grad():
         # 处理批量图像输入
-        inputs = processor(images=images, return_tensors="pt").to(device)
+        with metrics.timer('processor'):
+            inputs = processor(images=images, return_tensors="pt").to(device)
         # DINOv3通过特征提取获取图像特征
-        outputs = model(**inputs)
-        # 使用[CLS] token的输出作为图像特征
-        cls_feat = outputs.last_hidden_state[:, 0, :]
-        # 增加L2归一化（在特征转换为numpy前执行）
-        normalized_feat = torch.nn.functional.normalize(cls_feat, p=2, dim=1)
+        with metrics.timer('forward'):
+            outputs = model(**inputs)
+            # 使用[CLS] token的输出作为图像特征
+            cls_feat = outputs.last_hidden_state[:, 0, :]
+            # 增加L2归一化（在特征转换为numpy前执行）
+            normalized_feat = torch.nn.functional.normalize(cls_feat, p=2, dim=1)
         # 转换为numpy数组并确保类型为float32（Milvus要求）
-        features = normalized_feat.cpu().numpy().astype('float32')
-        return features
+        with metrics.timer('to_numpy'):
+            features = normalized_feat.cpu().numpy().astype('float32')
+        if patch_top_n is None:
+            return features
+        # 同一次前向中取出patch描述子，用于短名单的patch匹配重排序
+        patches = patch_store.select_patches(outputs.last_hidden_state.cpu().numpy(), patch_top_n,
+                                             getattr(model.config, "num_register_tokens", 0))
+        return features, patches
 
 def main():
-    # 得到当前IP
-    host_ip = get_ipadress.get_host_ip()
-    # 创建Milvus客户端
-    client = MilvusClient("http://"+host_ip+":19530")
+    with open("../config/config.yml", 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    # 分阶段计时（config.yml中的metrics配置）
+    metrics = pipeline_metrics.from_config(config)
+    # 单张图像检索的线程数（可由autotune.py调优）
+    query_num_threads = config["processing"].get("query_num_threads")
+    if query_num_threads:
+        torch.set_num_threads(int(query_num_threads))
+    # 创建检索客户端（Milvus或本地索引，由config.yml中search.backend决定）
+    client = search_client.create_search_client(config)
     # 加载DINOv3模型（使用facebook的dinov3-vitb16-pretrain-lvd1689m）
     model_dir = "facebook/dinov3-vitb16-pretrain-lvd1689m"  # DINOv3模型路径
     processor = AutoImageProcessor.from_pretrained(model_dir)  # DINOv3处理器
@@ -39,23 +62,88 @@ def main():
 
     device = torch.device('cuda:0' if torch.cuda.is_available() else "cpu")
     model.to(device)
+    model.eval()
+    # token剪枝/合并加速前向，需与入库时的设置一致
+    model = token_reduction.wrap(model, config)
     # 检索图像, 采用不在Milvus数据集中的图像
-    image = Image.open("../data/oxford5k_query/hertford_000082.jpg")
+    query_path = "../data/oxford5k_query/hertford_000082.jpg"
+    with open(query_path, 'rb') as f:
+        image_bytes = f.read()
+    with metrics.timer('decode'):
+        image = Image.open(io.BytesIO(image_bytes))
+    # patch匹配重排序（可选，需要入库时开启patch_store）
+    reranker = None
+    patch_config = config.get("patch_store") or {}
+    if patch_config.get("enabled"):
+        store = patch_store.PatchStore(os.path.join(patch_config["dir"], "oxford5k_raw_dinov3"))
+        reranker = patch_store.PatchReranker(store, int(patch_config.get("shortlist", 100)),
+                                             float(patch_config.get("threshold", 0.5)))
+    # 入库时启用了PCA白化的话，查询特征要做同样的变换
+    whitening, target_dim = pca_whitening.from_config(config)
+
+    def embed(query_image):
+        query_features = gen_image_features(processor, model, device, [query_image], metrics)
+        return whitening.apply(query_features, target_dim) if whitening is not None else query_features
+
+    # 两级查询缓存（可选）：图像内容哈希 -> 特征，(特征, 集合版本, 检索参数) -> 检索结果
+    cache = query_cache.from_config(config)
     # 提取特征向量
-    features = gen_image_features(processor, model, device, [image])
+    if reranker is not None:
+        # patch重排序需要查询的patch描述子，不走特征缓存
+        features, query_patches = gen_image_features(processor, model, device, [image], metrics,
+                                                     reranker.store.top_n)
+        if whitening is not None:
+            features = whitening.apply(features, target_dim)
+    elif cache is not None:
+        features = cache.image_features(image_bytes, lambda data: embed(image))
+    else:
+        features = embed(image)
     print("特征类型:", features.dtype)  # 应输出 float32
+    # 启用DBA且DBA集合为最新时检索增强后的集合，启用αQE时先多做一次批量检索扩展查询
+    collection_name = query_expansion.search_collection_name(config, "oxford5k_raw_dinov3")
+    qe_k, alpha, _ = query_expansion.from_config(config)
+    if qe_k > 0:
+        with metrics.timer('query_expansion'):
+            features = query_expansion.expand_with_client(client, collection_name, features, qe_k, alpha)
     # 特征召回10张图片（保持不变）
     limit_num = 10
-    results = client.search(
-        collection_name="oxford5k_raw_dinov3",  # 注意：需要确保该集合使用相同模型提取的特征
-        data=features,
-        limit=limit_num,
-        output_fields=["image_name"],
-        search_params={
-            "metric_type": "L2",  # DINOv3特征适合用L2距离
-            "params": {}
-        }
-    )
+    # 配置了多个检索目标时并发检索各集合/分区并合并为全局top-k，否则只检索单个集合
+    targets, timeout, max_concurrency = fanout_search.from_config(config)
+    # 标量过滤表达式（如 landmark == "hertford"）与向量检索一起下推到Milvus
+    _, search_filter = metadata.from_config(config)
+    with metrics.timer('search'):
+        if targets:
+            def search(**kwargs):
+                merged, errors = fanout_search.fan_out_search_sync(
+                    client, targets, kwargs['data'], kwargs['limit'], kwargs['output_fields'],
+                    kwargs['search_params'], timeout, max_concurrency, kwargs.get('filter', ""))
+                for target, error in errors.items():
+                    print(f"{target} 检索失败: {error}")
+                return merged
+        elif cache is not None:
+            search = lambda **kwargs: cache.search(client, **kwargs)
+        else:
+            search = client.search
+        results = search(
+            collection_name=collection_name,  # 注意：需要确保该集合使用相同模型提取的特征
+            data=features,
+            limit=max(limit_num, reranker.shortlist) if reranker is not None else limit_num,
+            output_fields=["image_name"],
+            search_params={
+                "metric_type": "L2",  # DINOv3特征适合用L2距离
+                "params": {}
+            },
+            **({"filter": search_filter} if search_filter else {})
+        )
+    if cache is not None:
+        cache.report()
+        cache.save()
+    if reranker is not None:
+        # 对短名单做patch匹配验证后重排，只保留前limit_num个
+        with metrics.timer('patch_rerank'):
+            order, _ = reranker.rerank(query_patches[0], [res["entity"]["image_name"] for res in results[0]])
+        results = [[results[0][i] for i in order[:limit_num]]]
+    metrics.close()
     result_image_names = []
     plt.figure(figsize=(20, 4))  # 调整图像显示尺寸
     plt.axis('off')
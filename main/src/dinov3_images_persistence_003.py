@@ -7,16 +7,32 @@ import torch
 import os
 import yaml
 import importlib
+import multiprocessing
 import torch.nn.functional as F
-from main.utils import get_gnd_param
+from main.utils import gnd_cache
+from main.utils import image_shard_cache
+from main.utils import metrics as pipeline_metrics
+from main.utils import pca_whitening
+from main.utils import query_expansion
+from main.utils import patch_store
+from main.utils import token_reduction
+from main.utils import feature_store
+from main.utils import query_cache
+from main.utils import metadata
+from main.utils import memory_governor
+from main.utils import batch_recovery
 
 '''
 2025年10月4日15:20:27
 在002的基础上，用gnd文件给的imlist和qimlist顺序，将提取出的特征存入数据库。
 '''
 
+# 配置文件路径相对本文件确定，不依赖当前工作目录
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'config', 'config.yml')
+
+
 # 加载配置文件
-def load_config(config_path="../config/config.yml"):
+def load_config(config_path=CONFIG_PATH):
     """加载YAML配置文件"""
     with open(config_path, 'r', encoding='utf-8') as f:
         config = yaml.safe_load(f)
@@ -37,35 +53,281 @@ def load_config(config_path="../config/config.yml"):
     return config
 
 
-# 加载配置
-CONFIG = load_config()
+# 配置在首次使用时加载，import本模块时没有读文件等副作用
+_CONFIG = None
+
+
+def get_config():
+    """返回（首次调用时加载的）配置"""
+    global _CONFIG
+    if _CONFIG is None:
+        _CONFIG = load_config()
+    return _CONFIG
 
 
 # 批量生成特征向量（dinov3模型特征提取）
-def gen_batch_image_features(processor, model, device, images):
+def gen_batch_image_features(processor, model, device, images, metrics=pipeline_metrics.NULL_METRICS,
+                             patch_top_n=None):
+    """
+    :param patch_top_n: 不为None时同一次前向中额外返回范数最大的top-N个patch token（float16），
+                        返回值为 (features, patches)
+    """
     with torch.no_grad():
         # 处理批量图像输入
-        inputs = processor(images=images, return_tensors="pt").to(device)
+        with metrics.timer('processor'):
+            inputs = processor(images=images, return_tensors="pt").to(device)
         # DINOv3通过特征提取获取图像特征
-        outputs = model(**inputs)
-        # 使用[CLS] token的输出作为图像特征
-        cls_feat = outputs.last_hidden_state[:, 0, :]
-        # 增加L2归一化（在特征转换为numpy前执行）
-        normalized_feat = torch.nn.functional.normalize(cls_feat, p=2, dim=1)
+        with metrics.timer('forward'):
+            outputs = model(**inputs)
+            del inputs  # 前向结束后立即释放输入张量
+            # 使用[CLS] token的输出作为图像特征
+            cls_feat = outputs.last_hidden_state[:, 0, :]
+            # 增加L2归一化（在特征转换为numpy前执行）
+            normalized_feat = torch.nn.functional.normalize(cls_feat, p=2, dim=1)
         # 转换为numpy数组并确保类型为float32（Milvus要求）
-        features = normalized_feat.cpu().numpy().astype('float32')
+        with metrics.timer('to_numpy'):
+            features = normalized_feat.cpu().numpy().astype('float32')
+        if patch_top_n is None:
+            return features
+        with metrics.timer('patches'):
+            patches = patch_store.select_patches(outputs.last_hidden_state.cpu().numpy(), patch_top_n,
+                                                 getattr(model.config, "num_register_tokens", 0))
+        return features, patches
+
+
+def apply_thread_config(num_threads=None, interop_threads=None):
+    """
+    设置PyTorch CPU线程数（由autotune.py写入config.yml的processing段）
+    :param num_threads: 算子内并行线程数，None表示使用PyTorch默认值
+    :param interop_threads: 算子间并行线程数，只能在进程内首次并行计算前设置
+    """
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(int(interop_threads))
+        except RuntimeError as e:
+            print(f"设置interop线程数失败（已开始并行计算）: {str(e)}")
+
+
+def load_batch_images(batch_files, dataset_path, image_cache, metrics=pipeline_metrics.NULL_METRICS,
+                      max_pixels=None):
+    """
+    加载一个批次的图像
+    :param batch_files: 当前批次的图像文件名（带扩展名）
+    :param image_cache: 预解码图像缓存，None表示直接读取图像文件
+    :param max_pixels: 超过该像素数的图像缩小解码，None表示不限制
+    :return: (图像列表, 成功加载的图像名称列表)
+    """
+    batch_images = []
+    valid_names = []  # 存储成功加载的图像名称
+
+    with metrics.timer('decode'):
+        for image_name in batch_files:
+            if image_cache is not None and image_name in image_cache:
+                batch_images.append(image_cache.get(image_name))  # 已缩放的uint8数组
+                valid_names.append(image_name)
+                continue
+            image_path = os.path.join(dataset_path, image_name)
+            try:
+                with Image.open(image_path) as raw:
+                    # 超大图像缩小解码，统一转为RGB格式，原文件句柄随即关闭
+                    image = memory_governor.limit_image_pixels(raw, max_pixels).convert('RGB')
+                batch_images.append(image)
+                valid_names.append(image_name)
+            except Exception as e:
+                print(f"加载图像 {image_name} 失败: {str(e)}")
+                metrics.inc('images_failed')
+                continue
+    return batch_images, valid_names
+
+
+def insert_features(batch_idx, client, collection_name, features, valid_names, metrics=pipeline_metrics.NULL_METRICS,
+                    store_writer=None, metadata_rows=None, recovery=batch_recovery.NO_RECOVERY):
+    """
+    把一个批次的特征插入Milvus（store_writer不为None时同时写入本地特征存储）
+    :param metadata_rows: 每张图像的标量字段（metadata.batch_metadata），None表示只写向量和图像名
+    :param recovery: BatchRecovery，暂时性错误退避重试，其余错误二分定位出错的行，失败的图像记入死信日志
+    :return: 插入成功的图像名
+    """
+    if store_writer is not None:
+        with metrics.timer('feature_store'):
+            store_writer.add(features, valid_names)
+    # 批量准备插入数据
+    insert_data = [
+        {"vector": feat.tolist(), "image_name": name}
+        for feat, name in zip(features, valid_names)
+    ]
+    if metadata_rows is not None:
+        for row, extra in zip(insert_data, metadata_rows):
+            row.update(extra)
+
+    # 批量插入Milvus
+    def insert(rows):
+        return recovery.retry(client.insert, collection_name=collection_name, data=rows)
+
+    with metrics.timer('insert'):
+        succeeded, failed = batch_recovery.bisect_call(
+            insert, insert_data, split_on=lambda e: not batch_recovery.is_transient_error(e))
+    for row, error in failed:
+        recovery.record([row["image_name"]], 'insert', error, collection_name, batch_idx)
+    if failed:
+        metrics.inc('images_failed', len(failed))
+    metrics.inc('images_inserted', sum(len(rows) for rows, _ in succeeded))
+    return [row["image_name"] for rows, _ in succeeded for row in rows]
+
+
+def whiten_features(features, whitening, target_dim, metrics=pipeline_metrics.NULL_METRICS):
+    """PCA白化降维（未启用时原样返回）"""
+    if whitening is None:
         return features
+    with metrics.timer('whitening'):
+        return whitening.apply(features, target_dim)
+
+
+def extract_with_bisect(processor, model, device, images, names, metrics=pipeline_metrics.NULL_METRICS,
+                        patch_top_n=None):
+    """
+    批量提取特征，失败时二分定位出错的图像，其余图像的特征照常返回（内存不足的异常继续抛出）
+    :return: (features, patches或None, 成功的图像名, 失败列表 [(图像名, 异常)])
+    """
+    def extract(indices):
+        return gen_batch_image_features(processor, model, device, [images[i] for i in indices], metrics,
+                                        patch_top_n)
+
+    succeeded, failed = batch_recovery.bisect_call(extract, list(range(len(images))),
+                                                   reraise=memory_governor.is_out_of_memory)
+    kept_names = [names[i] for indices, _ in succeeded for i in indices]
+    failed = [(names[i], error) for i, error in failed]
+    if not succeeded:
+        return None, None, kept_names, failed
+    results = [result for _, result in succeeded]
+    if patch_top_n is None:
+        return np.concatenate(results), None, kept_names, failed
+    return (np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results]), kept_names,
+            failed)
 
 
-def process_image_list(image_name_list):
+def process_batch(batch_idx, batch_files, dataset_path, image_cache, processor, model, device,
+                  client, collection_name, metrics=pipeline_metrics.NULL_METRICS, whitening=None, target_dim=None,
+                  patch_writer=None, store_writer=None, dataset_name=None, max_pixels=None,
+                  recovery=batch_recovery.NO_RECOVERY):
+    """
+    处理一个批次：加载图像 -> 提取特征 -> (PCA白化降维) -> 插入Milvus
+    :param batch_files: 当前批次的图像文件名（带扩展名）
+    :param image_cache: 预解码图像缓存，None表示直接读取图像文件
+    :param whitening: PCAWhitening，None表示直接存储原始特征
+    :param patch_writer: PatchStoreWriter，不为None时同一次前向中保存patch描述子
+    :param store_writer: FeatureStoreWriter，不为None时特征同时写入本地特征存储
+    :param dataset_name: 不为None时同时写入标量元数据字段（landmark、dataset、宽高、入库时间）
+    :param max_pixels: 超过该像素数的图像缩小解码
+    :param recovery: BatchRecovery，加载/提取/插入失败的图像记入死信日志
+    内存不足的异常会继续抛出，由调用方（内存调控）缩小batch size后重试
+    """
+    batch_images, valid_names = load_batch_images(batch_files, dataset_path, image_cache, metrics, max_pixels)
+    loaded = set(valid_names)
+    load_failed = [name for name in batch_files if name not in loaded]
+    if not batch_images:  # 跳过空批次
+        recovery.record(load_failed, 'load', "图像加载失败", collection_name, batch_idx)
+        return
+
+    # 批量提取特征（出错时二分定位出错的图像）
+    patch_top_n = patch_writer.meta['top_n'] if patch_writer is not None else None
+    try:
+        features, patches, valid_names, failed = extract_with_bisect(processor, model, device, batch_images,
+                                                                     valid_names, metrics, patch_top_n)
+    finally:
+        # 特征已提取（或失败），立即释放解码后的图像，不必等到插入完成
+        for image in batch_images:
+            if hasattr(image, 'close'):
+                image.close()
+        del batch_images
+    # 提取未因内存不足中断后才记录加载失败，内存调控重试同一批时不会重复记入死信日志
+    recovery.record(load_failed, 'load', "图像加载失败", collection_name, batch_idx)
+    for name, error in failed:
+        recovery.record([name], 'extract', error, collection_name, batch_idx)
+    if failed:
+        metrics.inc('images_failed', len(failed))
+    if features is None:
+        metrics.inc('batches_failed')
+        return
+    if patch_writer is not None:
+        patch_writer.add(valid_names, patches)
+    features = whiten_features(features, whitening, target_dim, metrics)
+
+    metadata_rows = metadata.batch_metadata(valid_names, dataset_path, dataset_name) \
+        if dataset_name is not None else None
+    insert_features(batch_idx, client, collection_name, features, valid_names, metrics, store_writer, metadata_rows,
+                    recovery)
+
+
+# 多进程提取时每个工作进程持有的模型等状态
+_WORKER = {}
+
+
+def _init_extract_worker(model_dir, num_threads, interop_threads, dataset_path, image_cache_dir,
+                         whitening_path=None, target_dim=None, patch_top_n=None, max_pixels=None):
+    """工作进程初始化：设置线程数并加载模型（每个进程一份）"""
+    apply_thread_config(num_threads, interop_threads)
+    _WORKER['processor'] = AutoImageProcessor.from_pretrained(model_dir)
+    _WORKER['model'] = token_reduction.wrap(AutoModel.from_pretrained(model_dir).eval(), get_config())
+    _WORKER['device'] = torch.device("cpu")
+    _WORKER['dataset_path'] = dataset_path
+    _WORKER['image_cache'] = image_shard_cache.ImageShardCache(image_cache_dir) if image_cache_dir else None
+    _WORKER['whitening'] = pca_whitening.PCAWhitening.load(whitening_path) if whitening_path else None
+    _WORKER['target_dim'] = target_dim
+    _WORKER['patch_top_n'] = patch_top_n
+    _WORKER['max_pixels'] = max_pixels
+
+
+def _extract_batch_in_worker(task):
+    """
+    在工作进程中加载图像并提取特征，插入由主进程按顺序完成
+    :return: (batch_idx, 成功的图像名, features, patches, 失败列表 [(图像名, 阶段, 错误信息)])
+    """
+    batch_idx, batch_files = task
+    batch_images, valid_names = load_batch_images(batch_files, _WORKER['dataset_path'], _WORKER['image_cache'],
+                                                  max_pixels=_WORKER['max_pixels'])
+    loaded = set(valid_names)
+    failures = [(name, 'load', "图像加载失败") for name in batch_files if name not in loaded]
+    if not batch_images:
+        return batch_idx, valid_names, None, None, failures
+    features, patches, valid_names, failed = extract_with_bisect(
+        _WORKER['processor'], _WORKER['model'], _WORKER['device'], batch_images, valid_names,
+        patch_top_n=_WORKER['patch_top_n'])
+    # 异常对象不一定能跨进程序列化，只传错误信息
+    failures += [(name, 'extract', str(error)) for name, error in failed]
+    if features is None:
+        return batch_idx, valid_names, None, None, failures
+    features = whiten_features(features, _WORKER['whitening'], _WORKER['target_dim'])
+    return batch_idx, valid_names, features, patches, failures
+
+
+def process_image_list(image_name_list, replay=False):
     """
     按照给定的图像名称列表顺序进行特征提取并持久化到Milvus
     :param image_name_list: 图像名称列表（不含扩展名），如['all_souls_000013', 'all_souls_000026']
+    :param replay: 重放死信日志时为True，只补插这几张图像：不重写本地特征存储（会被替换为只含这几张图像的文件），
+        也不重建DBA集合（源集合版本变化后检索自动退回源集合）
     """
-    host_ip = CONFIG["milvus"]["host_func"]()
+    config = get_config()
+    # 分阶段计时（config.yml中metrics.enabled为false时为空操作）
+    metrics = pipeline_metrics.from_config(config)
+    # CPU线程数与工作进程数（可由autotune.py自动调优后写入config.yml）
+    processing_config = config["processing"]
+    num_workers = int(processing_config.get("num_workers") or 1)
+    apply_thread_config(processing_config.get("num_threads"), processing_config.get("interop_threads"))
+    # PCA白化降维（config.yml中model.pca_whitening.enabled为false时存储原始特征）
+    whitening, target_dim = pca_whitening.from_config(config)
+    if whitening is not None:
+        print(f"启用PCA白化: {config['model']['feature_dim']} -> {target_dim} 维")
+
+    host_ip = config["milvus"]["host_func"]()
     # 创建Milvus客户端
-    client = MilvusClient(f"http://{host_ip}:{CONFIG['milvus']['port']}")
-    collection_name = CONFIG["milvus"]["collection"]
+    client = MilvusClient(f"http://{host_ip}:{config['milvus']['port']}")
+    collection_name = config["milvus"]["collection"]
+    # 标量元数据字段（config.yml中metadata.enabled为false时只存向量和图像名）
+    dataset_name, _ = metadata.from_config(config)
 
     # 检查并创建Milvus集合
     if not client.has_collection(collection_name=collection_name):
@@ -74,25 +336,35 @@ def process_image_list(image_name_list):
             schema={
                 "fields": [
                     {"name": "id", "type": DataType.INT64, "is_primary": True, "auto_id": True},
-                    {"name": "vector", "type": DataType.FLOAT_VECTOR, "dim": CONFIG["model"]["feature_dim"]},
+                    {"name": "vector", "type": DataType.FLOAT_VECTOR, "dim": target_dim},
                     {"name": "image_name", "type": DataType.VARCHAR, "max_length": 256}
-                ]
+                ] + (metadata.schema_fields() if dataset_name is not None else [])
             }
         )
+        if dataset_name is not None:
+            metadata.create_scalar_indexes(client, collection_name)
         print(f"已创建Milvus集合: {collection_name}")
     else:
         print(f"Milvus集合已存在: {collection_name}")
+        if dataset_name is not None and not metadata.has_metadata_fields(client, collection_name):
+            print("该集合没有标量元数据字段，只写入向量和图像名")
+            dataset_name = None
 
-    # 加载dinov3模型
-    processor = AutoImageProcessor.from_pretrained(CONFIG["model"]["dir"])
-    model = AutoModel.from_pretrained(CONFIG["model"]["dir"])
+    # 加载dinov3模型（多进程提取时由各工作进程分别加载）
     device = torch.device('cuda:0' if torch.cuda.is_available() else "cpu")
-    model.to(device)
-    model.eval()  # 设置为评估模式
-    print(f"使用设备: {device}")
+    if device.type == 'cuda':
+        num_workers = 1
+    if num_workers == 1:
+        processor = AutoImageProcessor.from_pretrained(config["model"]["dir"])
+        model = AutoModel.from_pretrained(config["model"]["dir"])
+        model.to(device)
+        model.eval()  # 设置为评估模式
+        # token剪枝/合并加速前向（config.yml中model.token_reduction.enabled为false时不变）
+        model = token_reduction.wrap(model, config)
+    print(f"使用设备: {device}，工作进程数: {num_workers}")
 
     # 读取数据集路径
-    dataset_path = CONFIG["data"]["dataset_path"]
+    dataset_path = config["data"]["dataset_path"]
     if not os.path.exists(dataset_path):
         print(f"数据集路径不存在: {dataset_path}")
         return
@@ -102,7 +374,7 @@ def process_image_list(image_name_list):
     for base_name in image_name_list:
         found = False
         # 尝试所有可能的图像扩展名
-        for ext in CONFIG["data"]["image_extensions"]:
+        for ext in config["data"]["image_extensions"]:
             full_name = f"{base_name}{ext}"
             full_path = os.path.join(dataset_path, full_name)
             if os.path.exists(full_path):
@@ -112,66 +384,167 @@ def process_image_list(image_name_list):
         if not found:
             print(f"警告: 未找到图像文件 {base_name}（尝试了所有扩展名）")
 
-    # 批量处理参数
-    batch_size = CONFIG["processing"]["batch_size"]
-    total_batches = (len(valid_image_files) + batch_size - 1) // batch_size
+    # 预解码图像缓存（可选），命中缓存的图像不再解码JPEG
+    image_cache = None
+    cache_config = config.get("image_cache", {})
+    if cache_config.get("enabled"):
+        image_cache = image_shard_cache.open_image_cache(
+            cache_config["dir"], dataset_path, cache_config["size"], cache_config["resample"])
+        if image_cache is None:
+            print("未找到预解码图像缓存，将直接读取图像文件")
+        else:
+            print(f"使用预解码图像缓存: {image_cache.cache_dir}")
 
-    # 批量处理图像并插入Milvus（严格按照列表顺序）
-    for batch_idx in tqdm(range(total_batches), desc="处理图像批次"):
-        start_idx = batch_idx * batch_size
-        end_idx = min((batch_idx + 1) * batch_size, len(valid_image_files))
-        batch_files = valid_image_files[start_idx:end_idx]
+    # patch描述子存储（可选），每个集合一个子目录，供检索时的patch匹配重排序使用
+    patch_writer = None
+    patch_config = config.get("patch_store") or {}
+    if patch_config.get("enabled"):
+        patch_writer = patch_store.PatchStoreWriter(os.path.join(patch_config["dir"], collection_name),
+                                                    int(patch_config["top_n"]), config["model"]["feature_dim"])
+        print(f"保存patch描述子: top {patch_writer.meta['top_n']} / 图像")
 
-        batch_images = []
-        valid_names = []  # 存储成功加载的图像名称
+    # 本地特征存储（可选），评估时直接内存映射，不再经过Milvus -> .mat
+    store_writer = None
+    store_config = config.get("feature_store") or {}
+    if store_config.get("enabled") and replay:
+        print(f"重放时不写入本地特征存储，需要时可运行 python ../utils/feature_store.py --collection {collection_name} "
+              f"--output ... 从集合重新导出")
+    elif store_config.get("enabled"):
+        store_writer = feature_store.FeatureStoreWriter(
+            os.path.join(store_config["dir"], f"{collection_name}.fstore"), target_dim,
+            store_config.get("dtype", "float32"), config["model"]["dir"])
+        print(f"特征同时写入: {store_writer.path}")
 
-        # 加载当前批次的图像
-        for image_name in batch_files:
-            image_path = os.path.join(dataset_path, image_name)
-            try:
-                image = Image.open(image_path).convert('RGB')  # 统一转为RGB格式
-                batch_images.append(image)
-                valid_names.append(image_name)
-            except Exception as e:
-                print(f"加载图像 {image_name} 失败: {str(e)}")
-                continue
+    # 内存调控（可选）：按RSS预算自适应调整batch size；超大图像缩小解码
+    governor, max_pixels = memory_governor.from_config(config)
+    if governor is not None and num_workers > 1:
+        print("多进程提取时不做batch size自适应，只限制超大图像")
+        governor = None
 
-        if not batch_images:  # 跳过空批次
-            continue
+    # 失败恢复：插入退避重试，失败的图像记入死信日志（可用 --replay 重放）
+    recovery = batch_recovery.from_config(config)
 
-        # 批量提取特征
-        try:
-            features = gen_batch_image_features(processor, model, device, batch_images)
-        except Exception as e:
-            print(f"批次 {batch_idx} 特征提取失败: {str(e)}")
-            continue
-
-        # 批量准备插入数据
-        insert_data = [
-            {"vector": feat.tolist(), "image_name": name}
-            for feat, name in zip(features, valid_names)
-        ]
-
-        # 批量插入Milvus
-        try:
-            client.insert(
-                collection_name=collection_name,
-                data=insert_data
-            )
-        except Exception as e:
-            print(f"批次 {batch_idx} 插入Milvus失败: {str(e)}")
-            continue
+    # 批量处理参数
+    batch_size = processing_config["batch_size"]
+    total_batches = (len(valid_image_files) + batch_size - 1) // batch_size
+    batches = [(batch_idx, valid_image_files[batch_idx * batch_size:(batch_idx + 1) * batch_size])
+               for batch_idx in range(total_batches)]
+
+    if num_workers > 1:
+        # 多进程提取特征，imap保证结果顺序，主进程按列表顺序插入Milvus
+        ctx = multiprocessing.get_context("spawn")
+        initargs = (config["model"]["dir"], processing_config.get("num_threads"),
+                    processing_config.get("interop_threads"), dataset_path,
+                    image_cache.cache_dir if image_cache is not None else None,
+                    config["model"]["pca_whitening"]["path"] if whitening is not None else None, target_dim,
+                    patch_writer.meta['top_n'] if patch_writer is not None else None, max_pixels)
+        with ctx.Pool(num_workers, initializer=_init_extract_worker, initargs=initargs) as pool:
+            results = pool.imap(_extract_batch_in_worker, batches)
+            for batch_idx, valid_names, features, patches, failures in tqdm(results, total=total_batches,
+                                                                            desc="处理图像批次"):
+                for name, stage, error in failures:
+                    recovery.record([name], stage, error, collection_name, batch_idx)
+                if features is None:
+                    metrics.inc('batches_failed')
+                    continue
+                if patch_writer is not None:
+                    patch_writer.add(valid_names, patches)
+                metadata_rows = metadata.batch_metadata(valid_names, dataset_path, dataset_name) \
+                    if dataset_name is not None else None
+                insert_features(batch_idx, client, collection_name, features, valid_names, metrics, store_writer,
+                                metadata_rows, recovery)
+    elif governor is not None:
+        # 按内存预算动态决定每批的图像数（严格按照列表顺序）
+        position, batch_idx = 0, 0
+        with tqdm(total=len(valid_image_files), desc="处理图像") as progress:
+            while position < len(valid_image_files):
+                batch_files = valid_image_files[position:position + governor.batch_size]
+                governor.begin()
+                try:
+                    with metrics.profile_batch(batch_idx), metrics.timer('batch'):
+                        process_batch(batch_idx, batch_files, dataset_path, image_cache, processor, model, device,
+                                      client, collection_name, metrics, whitening, target_dim, patch_writer,
+                                      store_writer, dataset_name, max_pixels, recovery)
+                except Exception as e:
+                    if not memory_governor.is_out_of_memory(e):
+                        raise
+                    if governor.on_out_of_memory():
+                        print(f"批次 {batch_idx} 内存不足，batch size 缩小到 {governor.batch_size} 后重试")
+                        continue
+                    recovery.record(batch_files[:1], 'extract', e, collection_name, batch_idx)
+                    metrics.inc('images_failed')
+                    batch_files = batch_files[:1]
+                else:
+                    governor.end(len(batch_files))
+                position += len(batch_files)
+                batch_idx += 1
+                progress.update(len(batch_files))
+        governor.report()
+    else:
+        # 批量处理图像并插入Milvus（严格按照列表顺序）
+        for batch_idx, batch_files in tqdm(batches, desc="处理图像批次"):
+            with metrics.profile_batch(batch_idx), metrics.timer('batch'):
+                process_batch(batch_idx, batch_files, dataset_path, image_cache, processor, model, device,
+                              client, collection_name, metrics, whitening, target_dim, patch_writer, store_writer,
+                              dataset_name, max_pixels, recovery)
 
+    if patch_writer is not None:
+        patch_writer.close()
+    if store_writer is not None:
+        store_writer.close()
     print("特征提取与存储完成")
+    if recovery.journal.recorded:
+        print(f"{recovery.journal.recorded} 张图像记入死信日志 {recovery.journal.path}，可用 --replay 重新处理")
+    # 集合内容变化，使该集合的查询结果缓存失效
+    query_cache.bump_collection_version(collection_name)
+    # 数据库端增强在入库完成后离线计算一次，检索时直接使用增强后的集合
+    _, _, dba_config = query_expansion.from_config(config)
+    if dba_config.get("enabled") and replay:
+        print(f"重放时不重建DBA集合，检索暂时使用源集合；可运行 python ../utils/query_expansion.py "
+              f"--collection {collection_name} 重新计算DBA")
+    elif dba_config.get("enabled"):
+        with metrics.timer('dba'):
+            query_expansion.build_dba_collection(
+                client, collection_name, query_expansion.dba_collection_name(config, collection_name),
+                int(dba_config.get("k", 2)), float(dba_config.get("alpha", 3.0)))
+        query_cache.bump_collection_version(query_expansion.dba_collection_name(config, collection_name))
+    metrics.close()
+
+
+def replay_dead_letters():
+    """重新处理死信日志中属于当前集合的图像，仍失败的会重新写入日志"""
+    config = get_config()
+    journal = batch_recovery.from_config(config).journal
+    if not journal.path:
+        print("未配置死信日志路径（recovery.journal_path）")
+        return
+    entries = journal.take()
+    collection_name = config["milvus"]["collection"]
+    names = list(dict.fromkeys(os.path.splitext(entry["image_name"])[0] for entry in entries
+                               if entry.get("collection") in (None, collection_name)))
+    others = [entry for entry in entries if entry.get("collection") not in (None, collection_name)]
+    print(f"重放死信日志中的 {len(names)} 张图像")
+    if names:
+        process_image_list(names, replay=True)
+    # 其他集合的条目原样写回日志
+    journal.append_entries(others)
+    journal.finish_replay()
 
 
 if __name__ == '__main__':
-    # 保证图片文件的读入顺序同gnd文件中一致
-    data = get_gnd_param.inspect_pkl('../data/datasets/roxford5k/gnd_roxford5k.pkl')
-    imlist = data.get('imlist')
-    qimlist = data.get('qimlist')
-    # 处理指定的图像列表
-    process_image_list(qimlist)
+    import argparse
+    parser = argparse.ArgumentParser(description="按gnd顺序提取特征并入库")
+    parser.add_argument('--replay', action='store_true', help="只重新处理死信日志中的图像")
+    args = parser.parse_args()
+    if args.replay:
+        replay_dead_letters()
+    else:
+        # 保证图片文件的读入顺序同gnd文件中一致
+        gnd = gnd_cache.load_gnd_cache('../data/datasets/roxford5k/gnd_roxford5k.pkl')
+        imlist = gnd.imlist.tolist()
+        qimlist = gnd.qimlist.tolist()
+        # 处理指定的图像列表
+        process_image_list(qimlist)
 
 
 
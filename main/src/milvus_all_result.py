@@ -1,11 +1,14 @@
 from transformers import AutoImageProcessor, AutoModel
-from pymilvus import MilvusClient
 import torch
 import os
-import json  # 导入json模块
-from main.utils import get_ipadress
+import yaml
+from main.utils import search_client
+from main.utils import metrics as pipeline_metrics
+from main.utils import query_expansion
+from main.utils import gnd_cache
+from main.utils import result_store
 '''
-从milvus查询集中 到raw集里面去进行召回特征 最后生成一个json文件 
+从milvus查询集中 到raw集里面去进行召回特征 最后把top-k的序号和距离写入二进制结果目录（可选JSONL）
 '''
 
 # 生成特征向量函数（保留但批量查询时不使用）
@@ -18,9 +21,12 @@ def gen_image_features(processor, model, device, images):
 
 
 def main():
-    # 获取当前IP并创建Milvus客户端
-    host_ip = get_ipadress.get_host_ip()
-    client = MilvusClient("http://" + host_ip + ":19530")
+    with open("../config/config.yml", 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    # 分阶段计时（config.yml中的metrics配置）
+    metrics = pipeline_metrics.from_config(config)
+    # 创建检索客户端（Milvus或本地索引，由config.yml中search.backend决定）
+    client = search_client.create_search_client(config)
 
     # 加载DINOv3模型（纯查询可注释）
     '''model_dir = "facebook/dinov3-vitb16-pretrain-lvd1689m"
@@ -31,50 +37,65 @@ def main():
 
     # 从Milvus查询集合批量读取所有特征
     query_collection = "oxford5k_query_dinov3"
-    query_entities = client.query(
-        collection_name=query_collection,
-        filter="",  # 查询所有实体
-        output_fields=["image_name", "vector"],  # 假设包含图像名和特征向量字段
-        limit=70
-    )
+    with metrics.timer('query'):
+        query_entities = client.query(
+            collection_name=query_collection,
+            filter="",  # 查询所有实体
+            output_fields=["image_name", "vector"],  # 假设包含图像名和特征向量字段
+            limit=70
+        )
 
     # 对每个查询特征进行召回并在控制台输出结果
-    limit_num = 10
-    target_collection = "oxford5k_raw_dinov3"
-    all_results = {}  # 存储所有查询结果
+    results_config = config.get("results") or {}
+    limit_num = int(results_config.get("k", 10))
+    # 启用DBA且DBA集合为最新时检索增强后的集合
+    target_collection = query_expansion.search_collection_name(config, "oxford5k_raw_dinov3")
+    # 结果按imlist序号流式写入（ids为int32，distances为float32）
+    gnd = gnd_cache.load_gnd_cache('../data/datasets/roxford5k/gnd_roxford5k.pkl')
+    result_dir = results_config.get("dir", "../data/results/oxford5k_dinov3")
+    writer = result_store.ResultWriter(result_dir, limit_num, gnd.imlist, bool(results_config.get("jsonl")))
+
+    # αQE：所有查询一次批量检索取回近邻并扩展
+    query_vectors = [entity["vector"] for entity in query_entities]
+    qe_k, alpha, _ = query_expansion.from_config(config)
+    if qe_k > 0 and query_vectors:
+        with metrics.timer('query_expansion'):
+            query_vectors = query_expansion.expand_with_client(
+                client, target_collection, query_vectors, qe_k, alpha).tolist()
 
-    for entity in query_entities:
+    for entity, query_vector in zip(query_entities, query_vectors):
         query_image_name = entity["image_name"]
-        query_vector = entity["vector"]
 
         # 执行特征召回
-        results = client.search(
-            collection_name=target_collection,
-            data=[query_vector],
-            limit=limit_num,
-            output_fields=["image_name"],
-            search_params={"metric_type": "L2", "params": {}}
-        )
+        with metrics.timer('search'):
+            results = client.search(
+                collection_name=target_collection,
+                data=[query_vector],
+                limit=limit_num,
+                output_fields=["image_name"],
+                search_params={"metric_type": "L2", "params": {}}
+            )
+        metrics.inc('queries')
 
         # 处理并输出当前查询结果
         result_image_names = []
+        result_distances = []
         print(f"\n===== 查询图像: {query_image_name} 的召回结果 =====")
         for i, res in enumerate(results[0], 1):
             image_name = res["entity"]["image_name"]
             distance = res["distance"]
             image_name_without_suffix = image_name.replace(".jpg", "")
             result_image_names.append(image_name_without_suffix)
+            result_distances.append(distance)
             print(f"{i}. {image_name} (距离: {distance:.4f})")
 
         print(f"\n排序结果文件名列表: {result_image_names}")
-        # 关键修改：用去除.jpg的查询图像名作为键
-        query_key = query_image_name.replace(".jpg", "")
-        all_results[query_key] = result_image_names
+        with metrics.timer('write_results'):
+            writer.add(query_image_name, result_image_names, result_distances)
 
-    # 保存到JSON文件
-    with open("retrieval_results.json", "w", encoding="utf-8") as f:
-        json.dump(all_results, f, ensure_ascii=False, indent=2)
-    print("\n结果已保存到 retrieval_results.json 文件")
+    writer.close()
+    print(f"\n结果已保存到 {result_dir}")
+    metrics.close()
 
 
 if __name__ == '__main__':
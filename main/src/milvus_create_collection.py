@@ -1,32 +1,64 @@
 from pymilvus import MilvusClient, DataType
 from main.utils import get_ipadress
+from main.utils import metadata
 
-host_ip = get_ipadress.get_host_ip()
-print("ip = " + host_ip)
-client = MilvusClient("http://" + host_ip + ":19530")
-
-schema = MilvusClient.create_schema(
-    auto_id=True,
-    enable_dynamic_field=False,
-)
-schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
-schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=768)
-schema.add_field(field_name="image_name", datatype=DataType.VARCHAR, max_length=256)
-schema.verify()
-index_params = client.prepare_index_params()
-index_params.add_index(
-    field_name="id",
-    index_type="STL_SORT"
-)
-index_params.add_index(
-    field_name="vector",
-    index_type="IVF_FLAT",
-    metric_type="L2",
-    params={"nlist": 1024}
-)
-# 创建 collection
-client.create_collection(
-    collection_name="oxford5k_query_dinov3",
-    schema=schema,
-    index_params=index_params
-)
+'''
+创建带索引的Milvus集合。
+build_schema / build_index_params / create_collection 也供 milvus_snapshot.py 恢复快照时使用。
+'''
+
+# 向量索引参数，快照中会记录一份，恢复时按快照中的参数重建索引
+VECTOR_INDEX = {"index_type": "IVF_FLAT", "metric_type": "L2", "params": {"nlist": 1024}}
+
+
+def build_schema(dim=768, auto_id=True, scalar_fields=False):
+    schema = MilvusClient.create_schema(
+        auto_id=auto_id,
+        enable_dynamic_field=False,
+    )
+    schema.add_field(field_name="id", datatype=DataType.INT64, is_primary=True)
+    schema.add_field(field_name="vector", datatype=DataType.FLOAT_VECTOR, dim=dim)
+    schema.add_field(field_name="image_name", datatype=DataType.VARCHAR, max_length=256)
+    if scalar_fields:
+        metadata.add_schema_fields(schema)
+    schema.verify()
+    return schema
+
+
+def build_index_params(client, vector_index=None, scalar_fields=False):
+    vector_index = vector_index or VECTOR_INDEX
+    index_params = client.prepare_index_params()
+    index_params.add_index(
+        field_name="id",
+        index_type="STL_SORT"
+    )
+    index_params.add_index(
+        field_name="vector",
+        index_type=vector_index["index_type"],
+        metric_type=vector_index["metric_type"],
+        params=vector_index.get("params") or {}
+    )
+    if scalar_fields:
+        metadata.add_scalar_indexes(index_params)
+    return index_params
+
+
+def create_collection(client, collection_name, dim=768, auto_id=True, vector_index=None, with_index=True,
+                      scalar_fields=False):
+    """
+    :param with_index: False时只建集合不建索引，批量导入完成后再调用 client.create_index 一次性建索引
+    :param scalar_fields: 是否包含标量元数据字段（landmark、dataset、width、height、ingested_at）及其索引
+    """
+    client.create_collection(
+        collection_name=collection_name,
+        schema=build_schema(dim, auto_id, scalar_fields),
+        index_params=build_index_params(client, vector_index, scalar_fields) if with_index else None
+    )
+
+
+if __name__ == '__main__':
+    host_ip = get_ipadress.get_host_ip()
+    print("ip = " + host_ip)
+    client = MilvusClient("http://" + host_ip + ":19530")
+    # 创建 collection
+    create_collection(client, "oxford5k_query_dinov3")
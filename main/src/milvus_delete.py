@@ -1,76 +1,92 @@
 from pymilvus import connections, Collection, utility
 import os
 from main.utils import get_ipadress
-from pymilvus import MilvusClient
+from main.utils import query_cache
 
 '''
 根据图片文件名image_name
 删除milvus中的数据
 '''
 
-# 1. 连接到Milvus服务（根据实际情况修改参数）
 
-host_ip = get_ipadress.get_host_ip()
-print("ip = " + host_ip)
-client = MilvusClient("http://" + host_ip + ":19530")
+def connect(host_ip=None, port="19530"):
+    """连接到Milvus服务（根据实际情况修改参数）"""
+    host_ip = host_ip or get_ipadress.get_host_ip()
+    print("ip = " + host_ip)
+    connections.connect(
+        alias="default",
+        host=host_ip,  # Milvus服务地址
+        port=port       # Milvus服务端口
+    )
 
-# 1. 连接到Milvus服务（根据实际情况修改参数）
-connections.connect(
-    alias="default",
-    host=host_ip,  # Milvus服务地址
-    port="19530"       # Milvus服务端口
-)
 
-# 2. 定义参数
-collection_name = "oxford5k_raw_dinov3"
-query_dir = "../data/oxford5k_query"
-primary_key_field = "id"  # 请替换为你的collection实际的主键字段名（通常是"id"）
+def delete_images(collection_name, image_names, primary_key_field="id", batch_size=1000):
+    """
+    按图像名删除集合中的实体（需先connect）
+    :param image_names: 图像文件名列表（与入库时的image_name一致）
+    :param primary_key_field: collection实际的主键字段名（通常是"id"）
+    :return: 实际删除行数
+    """
+    # 检查collection是否存在
+    if not utility.has_collection(collection_name):
+        raise ValueError(f"Collection {collection_name} 不存在")
 
-# 3. 检查collection是否存在
-if not utility.has_collection(collection_name):
-    raise ValueError(f"Collection {collection_name} 不存在")
+    # 加载collection并获取对象
+    collection = Collection(collection_name)
+    collection.load()
 
-# 4. 加载collection并获取对象
-collection = Collection(collection_name)
-collection.load()
+    deleted = 0
+    image_names = list(image_names)
+    # 分批查询文件名对应的主键并删除，避免过滤表达式过长
+    for start in range(0, len(image_names), batch_size):
+        batch = image_names[start:start + batch_size]
+        # 查询时只返回主键字段，减少数据传输
+        result = collection.query(
+            expr=f"image_name in {batch}",
+            output_fields=[primary_key_field]  # 仅获取主键
+        )
+        if not result:
+            continue
+        # 提取主键列表（结果是字典列表，需转换为纯主键值列表）
+        primary_keys = [item[primary_key_field] for item in result]
+        # 通过主键删除（主键需是列表格式）
+        delete_result = collection.delete(expr=f"{primary_key_field} in {primary_keys}")
+        deleted += delete_result.delete_count
 
-# 5. 获取目标目录下的所有文件名（不含路径）
-try:
-    filenames = [f for f in os.listdir(query_dir) if os.path.isfile(os.path.join(query_dir, f))]
-    if not filenames:
-        print(f"目录 {query_dir} 中没有文件，无需删除")
-        exit()
-    print(f"共获取到 {len(filenames)} 个文件名，准备查询对应主键")
-except FileNotFoundError:
-    raise FileNotFoundError(f"目录 {query_dir} 不存在")
+    # 不release：集合可能正被检索、监听入库等使用，卸载后检索会失败
+    if deleted:
+        # 集合内容变化，使该集合的查询结果缓存失效
+        query_cache.bump_collection_version(collection_name)
+    return deleted
 
-# 6. 查询文件名对应的主键（仅返回主键字段）
-# 构建查询条件：image_name在文件名列表中
-query_expr = f"image_name in {filenames}"
-try:
-    # 查询时只返回主键字段，减少数据传输
-    result = collection.query(
-        expr=query_expr,
-        output_fields=[primary_key_field]  # 仅获取主键
-    )
-    if not result:
-        print("未查询到匹配的主键，无需删除")
-        exit()
-    # 提取主键列表（结果是字典列表，需转换为纯主键值列表）
-    primary_keys = [item[primary_key_field] for item in result]
-    print(f"查询到 {len(primary_keys)} 个匹配的主键，准备删除")
-except Exception as e:
-    print(f"查询主键失败：{str(e)}")
-    exit()
 
-# 7. 根据主键批量删除数据
-try:
-    # 通过主键删除（主键需是列表格式）
-    delete_result = collection.delete(expr=f"{primary_key_field} in {primary_keys}")
-    print(f"删除成功，实际删除行数：{delete_result.delete_count}")
-except Exception as e:
-    print(f"删除数据失败：{str(e)}")
+if __name__ == '__main__':
+    # 1. 连接到Milvus服务
+    connect()
+
+    # 2. 定义参数
+    collection_name = "oxford5k_raw_dinov3"
+    query_dir = "../data/oxford5k_query"
+
+    # 3. 获取目标目录下的所有文件名（不含路径）
+    try:
+        filenames = [f for f in os.listdir(query_dir) if os.path.isfile(os.path.join(query_dir, f))]
+        if not filenames:
+            print(f"目录 {query_dir} 中没有文件，无需删除")
+            exit()
+        print(f"共获取到 {len(filenames)} 个文件名，准备查询对应主键")
+    except FileNotFoundError:
+        raise FileNotFoundError(f"目录 {query_dir} 不存在")
+
+    # 4. 根据文件名查询主键并批量删除
+    try:
+        deleted = delete_images(collection_name, filenames)
+        if deleted:
+            print(f"删除成功，实际删除行数：{deleted}")
+        else:
+            print("未查询到匹配的主键，无需删除")
+    except Exception as e:
+        print(f"删除数据失败：{str(e)}")
 
-# 8. 释放资源并断开连接
-collection.release()
-connections.disconnect("default")
\ No newline at end of file
+    # 5. 断开连接
+    connections.disconnect("default")
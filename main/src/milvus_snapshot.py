@@ -0,0 +1,220 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import time
+
+import numpy as np
+
+from main.src import milvus_create_collection
+from main.utils import metadata
+from main.utils import query_cache
+
+'''
+2025年10月19日
+集合快照的导出与恢复（迁移到新的Milvus实例时无需重新用模型提取特征）：
+1.export：先只取主键把集合按主键范围切成若干分片，各分片由线程并行用query_iterator读出，
+  每个分片按列存为 id.npy / vector.npy / image_name.npy（有标量元数据字段时还有 landmark.npy 等，
+  即Milvus numpy批量导入的格式），最后写 meta.json（集合名、维度、行数、auto_id、milvus_create_collection中的向量索引参数、分片列表）。
+2.restore：按快照建集合（先不建索引），写入全部数据后一次性建索引再加载：
+  insert模式：线程池并行从磁盘读取分片，按分片顺序批量插入（不保留主键时新主键仍按原顺序递增）；
+  bulk模式：每个分片提交一个do_bulk_insert任务，需先把快照目录同步到Milvus的对象存储（如 mc cp -r），
+  --remote-prefix 为快照在存储桶中的路径。
+用法（在main/src目录下运行）:
+    python milvus_snapshot.py export --collection oxford5k_raw_dinov3 --output ../data/snapshots/oxford5k_raw_dinov3
+    python milvus_snapshot.py restore --input ../data/snapshots/oxford5k_raw_dinov3 [--mode bulk --remote-prefix ...]
+'''
+
+SNAPSHOT_VERSION = 1
+FIELDS = ("id", "vector", "image_name")
+
+
+def _shard_ranges(client, collection_name, num_shards, batch_size):
+    """只读主键，按主键排序后等分为num_shards段，返回 [(最小主键, 最大主键, 行数)]"""
+    iterator = client.query_iterator(collection_name=collection_name, batch_size=batch_size, filter="",
+                                     output_fields=["id"])
+    ids = []
+    while True:
+        batch = iterator.next()
+        if not batch:
+            iterator.close()
+            break
+        ids.extend(item["id"] for item in batch)
+    ids = np.sort(np.asarray(ids, dtype=np.int64))
+    return [(int(part[0]), int(part[-1]), len(part)) for part in np.array_split(ids, num_shards) if len(part)]
+
+
+def _export_shard(client, collection_name, shard_dir, lo, hi, batch_size, scalar_fields=()):
+    iterator = client.query_iterator(collection_name=collection_name, batch_size=batch_size,
+                                     filter=f"id >= {lo} and id <= {hi}",
+                                     output_fields=["vector", "image_name", *scalar_fields])
+    rows = []
+    while True:
+        batch = iterator.next()
+        if not batch:
+            iterator.close()
+            break
+        rows.extend(batch)
+    rows.sort(key=lambda item: item["id"])
+    os.makedirs(shard_dir, exist_ok=True)
+    np.save(os.path.join(shard_dir, "id.npy"), np.asarray([item["id"] for item in rows], dtype=np.int64))
+    np.save(os.path.join(shard_dir, "vector.npy"),
+            np.asarray([item["vector"] for item in rows], dtype=np.float32).reshape(len(rows), -1))
+    for field in ("image_name", *scalar_fields):
+        np.save(os.path.join(shard_dir, f"{field}.npy"), np.asarray([item[field] for item in rows]))
+    return len(rows)
+
+
+def export_snapshot(client, collection_name, snapshot_dir, num_shards=8, num_workers=8, batch_size=1000):
+    """
+    并行导出集合快照
+    :return: meta字典
+    """
+    description = client.describe_collection(collection_name=collection_name)
+    scalar_fields = metadata.FIELD_NAMES if metadata.has_metadata_fields(client, collection_name) else ()
+    ranges = _shard_ranges(client, collection_name, num_shards, batch_size)
+    shard_names = [f"shard_{i:05d}" for i in range(len(ranges))]
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+        counts = list(executor.map(
+            lambda args: _export_shard(client, collection_name, os.path.join(snapshot_dir, args[0]), args[1][0],
+                                       args[1][1], batch_size, scalar_fields),
+            zip(shard_names, ranges)))
+    dim = 0
+    if shard_names:
+        dim = int(np.load(os.path.join(snapshot_dir, shard_names[0], "vector.npy"), mmap_mode='r').shape[1])
+    meta = {
+        "version": SNAPSHOT_VERSION,
+        "collection": collection_name,
+        "dim": dim,
+        "count": int(sum(counts)),
+        "auto_id": bool(description.get("auto_id", True)),
+        "fields": list(FIELDS + scalar_fields),
+        "vector_index": milvus_create_collection.VECTOR_INDEX,
+        "shards": [{"dir": name, "count": count} for name, count in zip(shard_names, counts)],
+    }
+    # meta.json最后写，存在即表示快照完整
+    with open(os.path.join(snapshot_dir, "meta.json"), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def load_meta(snapshot_dir):
+    with open(os.path.join(snapshot_dir, "meta.json"), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"快照版本不匹配: {snapshot_dir}")
+    return meta
+
+
+def _snapshot_fields(meta, keep_ids):
+    """恢复时写入的字段：不保留主键时去掉id"""
+    fields = tuple(meta.get("fields") or FIELDS)
+    return fields if keep_ids else tuple(field for field in fields if field != "id")
+
+
+def _read_shard(shard_dir, fields):
+    return {field: np.load(os.path.join(shard_dir, f"{field}.npy")) for field in ("id", *fields)}
+
+
+def _insert_shards(client, collection_name, snapshot_dir, meta, keep_ids, num_workers, batch_size):
+    fields = _snapshot_fields(meta, keep_ids)
+    shard_dirs = [os.path.join(snapshot_dir, shard["dir"]) for shard in meta["shards"]]
+    with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+        # map按提交顺序返回：读盘在后台并行，插入按分片顺序进行
+        for columns in executor.map(lambda shard_dir: _read_shard(shard_dir, fields), shard_dirs):
+            for start in range(0, len(columns["id"]), batch_size):
+                stop = start + batch_size
+                rows = zip(*(columns[field][start:stop].tolist() for field in fields))
+                client.insert(collection_name=collection_name, data=[dict(zip(fields, row)) for row in rows])
+
+
+def _bulk_import(collection_name, meta, keep_ids, remote_prefix, host, port, poll_interval=2.0):
+    from pymilvus import BulkInsertState, connections, utility
+    connections.connect(alias="default", host=host, port=port)
+    fields = _snapshot_fields(meta, keep_ids)
+    tasks = [utility.do_bulk_insert(collection_name=collection_name,
+                                    files=[f"{remote_prefix}/{shard['dir']}/{field}.npy" for field in fields])
+             for shard in meta["shards"]]
+    pending = set(tasks)
+    while pending:
+        time.sleep(poll_interval)
+        for task_id in list(pending):
+            state = utility.get_bulk_insert_state(task_id=task_id)
+            if state.state == BulkInsertState.ImportCompleted:
+                pending.discard(task_id)
+            elif state.state in (BulkInsertState.ImportFailed, BulkInsertState.ImportFailedAndCleaned):
+                raise RuntimeError(f"批量导入任务 {task_id} 失败: {state.failed_reason}")
+
+
+def restore_snapshot(client, snapshot_dir, collection_name=None, mode="insert", keep_ids=False, num_workers=8,
+                     batch_size=5000, remote_prefix=None, host=None, port="19530"):
+    """
+    从快照恢复集合，数据全部写入后一次性建索引
+    :param keep_ids: 保留原主键（集合auto_id关闭），否则由Milvus重新分配
+    :param mode: insert | bulk
+    """
+    meta = load_meta(snapshot_dir)
+    collection_name = collection_name or meta["collection"]
+    if client.has_collection(collection_name=collection_name):
+        raise ValueError(f"集合 {collection_name} 已存在")
+    scalar_fields = set(metadata.FIELD_NAMES) <= set(meta.get("fields") or FIELDS)
+    milvus_create_collection.create_collection(client, collection_name, meta["dim"], auto_id=not keep_ids,
+                                               vector_index=meta["vector_index"], with_index=False,
+                                               scalar_fields=scalar_fields)
+    start = time.perf_counter()
+    if mode == "bulk":
+        if not remote_prefix:
+            raise ValueError("bulk模式需要指定快照在对象存储中的路径 remote_prefix")
+        from main.utils import get_ipadress
+        _bulk_import(collection_name, meta, keep_ids, remote_prefix.rstrip('/'), host or get_ipadress.get_host_ip(),
+                     port)
+    else:
+        _insert_shards(client, collection_name, snapshot_dir, meta, keep_ids, num_workers, batch_size)
+    loaded = time.perf_counter()
+    client.create_index(collection_name=collection_name,
+                        index_params=milvus_create_collection.build_index_params(client, meta["vector_index"],
+                                                                                 scalar_fields))
+    client.load_collection(collection_name=collection_name)
+    # 同名集合被删除后恢复时主键可能已变化，使该集合的查询结果缓存失效
+    query_cache.bump_collection_version(collection_name)
+    print(f"已恢复 {meta['count']} 行到 {collection_name}：写入 {loaded - start:.1f}s，"
+          f"建索引与加载 {time.perf_counter() - loaded:.1f}s")
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Milvus集合快照导出与恢复")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export")
+    export_parser.add_argument('--collection', required=True)
+    export_parser.add_argument('--output', required=True, help="快照目录")
+    export_parser.add_argument('--shards', type=int, default=8)
+    export_parser.add_argument('--workers', type=int, default=8)
+    restore_parser = subparsers.add_parser("restore")
+    restore_parser.add_argument('--input', required=True, help="快照目录")
+    restore_parser.add_argument('--collection', default=None, help="恢复后的集合名，默认与快照相同")
+    restore_parser.add_argument('--mode', choices=("insert", "bulk"), default="insert")
+    restore_parser.add_argument('--remote-prefix', default=None, help="bulk模式下快照在对象存储桶中的路径")
+    restore_parser.add_argument('--keep-ids', action='store_true', help="保留原主键")
+    restore_parser.add_argument('--workers', type=int, default=8)
+    for sub in (export_parser, restore_parser):
+        sub.add_argument('--host', default=None, help="Milvus地址，默认本机IP")
+        sub.add_argument('--port', default="19530")
+    args = parser.parse_args()
+
+    from pymilvus import MilvusClient
+    from main.utils import get_ipadress
+    host = args.host or get_ipadress.get_host_ip()
+    client = MilvusClient(f"http://{host}:{args.port}")
+    if args.command == "export":
+        start = time.perf_counter()
+        meta = export_snapshot(client, args.collection, args.output, args.shards, args.workers)
+        print(f"已导出 {meta['count']} 行（{len(meta['shards'])} 个分片）到 {args.output}，"
+              f"耗时 {time.perf_counter() - start:.1f}s")
+    else:
+        restore_snapshot(client, args.input, args.collection, args.mode, args.keep_ids, args.workers,
+                         remote_prefix=args.remote_prefix, host=host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
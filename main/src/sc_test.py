@@ -2,6 +2,7 @@ from transformers import AutoImageProcessor, AutoModel
 from PIL import Image
 import matplotlib.pyplot as plt
 import torch
+from main.utils import similarity
 plt.rcParams['font.sans-serif'] = ['SimHei']
 # 生成图像特征
 def gen_image_features(processor, model, device, image):
@@ -12,13 +13,17 @@ def gen_image_features(processor, model, device, image):
         image_features = image_features.mean(dim=1)
         return image_features[0]
 
-# 计算两个图像的相似度
-def similarity_image(processor, model, device, image1, image2):
-    features1 = gen_image_features(processor, model, device, image1)
-    features2 = gen_image_features(processor, model, device, image2)
-    cos_sim = torch.cosine_similarity(features1, features2, dim=0)
+# 计算两个图像的相似度（两张图像一次批量前向）
+def similarity_image(processor, model, device, image1, image2, pooling="mean"):
+    features = similarity.embed_images(processor, model, device, [image1, image2], pooling=pooling)
+    cos_sim = float(features[0] @ features[1])
     cos_sim = (cos_sim + 1) / 2
-    return cos_sim.item()
+    return cos_sim
+
+# 批量计算一组图像两两之间的相似度矩阵（图像路径可使用嵌入缓存）
+def similarity_images(processor, model, device, images, pooling="mean", cache_path=None):
+    features = similarity.embed_images(processor, model, device, images, pooling=pooling, cache_path=cache_path)
+    return (similarity.similarity_matrix(features) + 1) / 2
 
 def main():
     model_dir = "facebook/dinov2-base"
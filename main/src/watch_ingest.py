@@ -0,0 +1,365 @@
+import argparse
+import collections
+import json
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+from transformers import AutoImageProcessor, AutoModel
+
+from main.src import dinov3_images_persistence_003 as persistence
+from main.utils import metrics as pipeline_metrics
+from main.utils import batch_recovery
+from main.utils import memory_governor
+from main.utils import metadata
+from main.utils import pca_whitening
+from main.utils import query_cache
+from main.utils import search_client
+from main.utils import token_reduction
+from main.utils import vector_io
+
+'''
+2025年10月19日
+目录监听模式的持续增量入库（在main/src目录下运行）：
+1.监听数据集目录中新增/修改/删除的图像：安装了watchdog时用inotify事件，否则按间隔轮询(mtime, size)快照。
+2.新增和修改的图像进入待处理队列，攒够 batch_count 张或最早一张等待超过 batch_deadline 秒就提取特征并插入；
+  修改的图像先删除旧记录再插入，删除的图像通过 milvus_delete 删除对应记录。
+  批次内存不足时对半拆分重试；加载/提取/插入失败的图像记入死信日志，不更新状态，retry_interval 秒后（或文件再次变化时）重试。
+3.已入库文件的(mtime, size)保存在状态文件中，重启后不会重复入库；
+  首次启动（没有状态文件）时把集合中已有image_name对应的文件直接记为已入库，只有加 --full 才把目录中全部图像重新入库；
+  定期打印新鲜度延迟（检测到文件 -> 插入完成）的p50/p95与吞吐。
+用法:
+    python watch_ingest.py [--mode auto|inotify|poll] [--full]
+'''
+
+
+def scan_directory(dataset_path, extensions):
+    """目录快照 {文件名: [mtime, size]}"""
+    snapshot = {}
+    with os.scandir(dataset_path) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(extensions):
+                stat = entry.stat()
+                snapshot[entry.name] = [stat.st_mtime, stat.st_size]
+    return snapshot
+
+
+def diff_snapshots(old, new):
+    """
+    :return: (新增或修改的文件名列表, 其中修改的文件名集合, 删除的文件名列表)
+    """
+    changed = [name for name, sig in new.items() if old.get(name) != sig]
+    modified = {name for name in changed if name in old}
+    removed = [name for name in old if name not in new]
+    return changed, modified, removed
+
+
+class InotifyWatcher:
+    """watchdog（Linux下为inotify）事件源，事件发生时唤醒主循环重新扫描目录"""
+
+    def __init__(self, dataset_path):
+        from watchdog.events import FileSystemEventHandler
+        from watchdog.observers import Observer
+        self.events = queue.Queue()
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(handler_self, event):
+                if not event.is_directory:
+                    self.events.put(event)
+
+        self.observer = Observer()
+        self.observer.schedule(Handler(), dataset_path, recursive=False)
+        self.observer.start()
+
+    def wait(self, timeout):
+        """等待事件或超时，返回是否有事件"""
+        try:
+            self.events.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        # 合并同一时间段内的事件
+        while not self.events.empty():
+            self.events.get_nowait()
+        return True
+
+    def stop(self):
+        self.observer.stop()
+        self.observer.join()
+
+
+class PollingWatcher:
+    """轮询回退：每次等待一个间隔后重新扫描"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def wait(self, timeout):
+        self._stop.wait(min(timeout, self.interval))
+        return True
+
+    def stop(self):
+        self._stop.set()
+
+
+def create_watcher(mode, dataset_path, poll_interval):
+    if mode in ('auto', 'inotify'):
+        try:
+            return InotifyWatcher(dataset_path), 'inotify'
+        except ImportError:
+            if mode == 'inotify':
+                raise
+            print("未安装watchdog，使用轮询模式")
+    return PollingWatcher(poll_interval), 'poll'
+
+
+class IncrementalIngester:
+    """
+    把变化的图像分批提取特征并写入集合
+    :param batch_count: 攒够多少张就处理一批
+    :param batch_deadline: 最早一张等待超过多少秒就处理一批（控制新鲜度）
+    :param retry_interval: 入库失败的文件在多少秒后重试（文件再次变化时立即重试）
+    """
+
+    def __init__(self, config, client, collection_name, batch_count=32, batch_deadline=5.0, state_path=None,
+                 metrics=pipeline_metrics.NULL_METRICS, retry_interval=300.0):
+        self.config = config
+        self.client = client
+        self.collection_name = collection_name
+        self.dataset_path = config["data"]["dataset_path"]
+        self.batch_count = batch_count
+        self.batch_deadline = batch_deadline
+        self.state_path = state_path
+        self.metrics = metrics
+        self.retry_interval = retry_interval
+        self.state = self._load_state()
+        self.has_state = self.state is not None  # 是否已有状态文件（首次启动时为False）
+        self.state = self.state or {}
+        self.pending = collections.OrderedDict()  # 文件名 -> 检测到的时间
+        self.replace = set()  # 需要先删除旧记录的文件
+        self.failed = {}  # 入库失败的文件 -> (失败时的[mtime, size], 重试时间)
+        self._snapshot = {}
+        self.latencies = collections.deque(maxlen=10000)
+        self.ingested = 0
+        self.started = time.time()
+
+        device = torch.device('cuda:0' if torch.cuda.is_available() else "cpu")
+        self.device = device
+        self.processor = AutoImageProcessor.from_pretrained(config["model"]["dir"])
+        model = AutoModel.from_pretrained(config["model"]["dir"]).to(device).eval()
+        self.model = token_reduction.wrap(model, config)
+        self.whitening, self.target_dim = pca_whitening.from_config(config)
+        self.dataset_name, _ = metadata.from_config(config)
+        _, self.max_pixels = memory_governor.from_config(config)
+        self.recovery = batch_recovery.from_config(config)
+        if self.dataset_name is not None and not metadata.has_metadata_fields(client, collection_name):
+            self.dataset_name = None
+
+    def _load_state(self):
+        """:return: 状态字典，没有状态文件时为None"""
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return None
+
+    def seed_state(self, snapshot):
+        """首次启动时把集合中已有image_name对应的文件记为已入库，避免把整个数据集重复插入已有集合"""
+        existing = set(vector_io.export_fields(self.client, self.collection_name, ["image_name"])["image_name"])
+        seeded = 0
+        for name, signature in snapshot.items():
+            if name in existing:
+                self.state[name] = signature
+                seeded += 1
+        self.has_state = True
+        self._save_state()
+        print(f"首次启动：集合中已有 {seeded} 个文件，记为已入库，其余 {len(snapshot) - seeded} 个文件将入库")
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        if os.path.dirname(self.state_path):
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        with open(self.state_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(self.state_path + '.tmp', self.state_path)
+
+    def _delete(self, names):
+        from main.src import milvus_delete
+        with self.metrics.timer('delete'):
+            return milvus_delete.delete_images(self.collection_name, names)
+
+    def sync(self, snapshot):
+        """对比快照，登记变化的文件，立即处理删除"""
+        changed, modified, removed = diff_snapshots(self.state, snapshot)
+        now = time.time()
+        for name in changed:
+            failure = self.failed.get(name)
+            if failure is not None:
+                # 失败后文件未变化且未到重试时间，暂不重试
+                if failure[0] == snapshot[name] and now < failure[1]:
+                    continue
+                del self.failed[name]
+            self.pending.setdefault(name, now)
+        self.replace |= {name for name in modified if name in self.pending}
+        if removed:
+            deleted = self._delete(removed)
+            for name in removed:
+                self.state.pop(name, None)
+                self.pending.pop(name, None)
+                self.failed.pop(name, None)
+            self._save_state()
+            print(f"删除 {len(removed)} 个文件的记录（{deleted} 行）")
+        self._snapshot = snapshot
+
+    def due(self):
+        """是否需要处理一批"""
+        if not self.pending:
+            return False
+        oldest = next(iter(self.pending.values()))
+        return len(self.pending) >= self.batch_count or time.time() - oldest >= self.batch_deadline
+
+    def time_to_deadline(self):
+        if not self.pending:
+            return self.batch_deadline
+        return max(0.0, self.batch_deadline - (time.time() - next(iter(self.pending.values()))))
+
+    def _extract(self, images, names):
+        """
+        提取特征，内存不足时对半拆分重试，单张仍不足时记为失败（不让一张超大图像中断监听）
+        :return: (特征块列表, 成功的图像名, 失败列表 [(图像名, 异常)])
+        """
+        try:
+            features, _, kept_names, failed = persistence.extract_with_bisect(
+                self.processor, self.model, self.device, images, names, self.metrics)
+        except Exception as e:
+            if not memory_governor.is_out_of_memory(e):
+                raise
+            memory_governor.release_memory()
+            if len(images) == 1:
+                return [], [], [(names[0], e)]
+            mid = len(images) // 2
+            left = self._extract(images[:mid], names[:mid])
+            right = self._extract(images[mid:], names[mid:])
+            return left[0] + right[0], left[1] + right[1], left[2] + right[2]
+        return ([features] if features is not None else []), kept_names, failed
+
+    def flush(self):
+        """处理待处理队列中最早的一批"""
+        batch = list(self.pending.items())[:self.batch_count]
+        names = [name for name, _ in batch]
+        stale = [name for name in names if name in self.replace]
+        if stale:
+            self._delete(stale)
+
+        images, valid_names = persistence.load_batch_images(names, self.dataset_path, None, self.metrics,
+                                                             self.max_pixels)
+        loaded = set(valid_names)
+        self.recovery.record([name for name in names if name not in loaded], 'load', "图像加载失败",
+                             self.collection_name)
+        inserted = []
+        if images:
+            # 出错时二分定位出错的图像，失败的图像记入死信日志
+            try:
+                parts, valid_names, failed = self._extract(images, valid_names)
+            finally:
+                for image in images:
+                    if hasattr(image, 'close'):
+                        image.close()
+                del images
+            for name, error in failed:
+                self.recovery.record([name], 'extract', error, self.collection_name)
+            if parts:
+                features = persistence.whiten_features(np.concatenate(parts), self.whitening, self.target_dim,
+                                                       self.metrics)
+                metadata_rows = metadata.batch_metadata(valid_names, self.dataset_path, self.dataset_name) \
+                    if self.dataset_name is not None else None
+                inserted = persistence.insert_features(0, self.client, self.collection_name, features, valid_names,
+                                                       self.metrics, metadata_rows=metadata_rows,
+                                                       recovery=self.recovery)
+                query_cache.bump_collection_version(self.collection_name)
+
+        done = time.time()
+        detected = dict(batch)
+        inserted_set = set(inserted)
+        for name in names:
+            self.pending.pop(name, None)
+            self.replace.discard(name)
+            if name in inserted_set:
+                if name in self._snapshot:
+                    self.state[name] = self._snapshot[name]
+            else:
+                # 只有入库成功的文件才更新状态，失败的文件稍后重试（修改的文件旧记录已删除，重试时不会重复）
+                self.failed[name] = (self._snapshot.get(name), done + self.retry_interval)
+        for name in inserted:
+            latency = done - detected[name]
+            self.latencies.append(latency)
+            self.metrics.observe('freshness', latency)
+        self.ingested += len(inserted)
+        self._save_state()
+
+    def report(self):
+        if not self.latencies:
+            return
+        latencies = np.asarray(self.latencies)
+        rate = self.ingested / max(time.time() - self.started, 1e-9)
+        print(f"已入库 {self.ingested} 张，吞吐 {rate:.2f} 张/s，新鲜度延迟 p50 {np.percentile(latencies, 50):.2f}s "
+              f"p95 {np.percentile(latencies, 95):.2f}s，待处理 {len(self.pending)}，待重试 {len(self.failed)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="监听数据集目录并持续增量入库")
+    parser.add_argument('--mode', choices=('auto', 'inotify', 'poll'), default=None)
+    parser.add_argument('--full', action='store_true', help="没有状态文件时把目录中全部图像重新入库（默认跳过集合中已有的图像）")
+    args = parser.parse_args()
+
+    config = persistence.get_config()
+    watch_config = config.get("watch") or {}
+    metrics = pipeline_metrics.from_config(config)
+    client = search_client.create_search_client({**config, "search": {"backend": "milvus"}})
+    collection_name = config["milvus"]["collection"]
+    if not client.has_collection(collection_name=collection_name):
+        raise ValueError(f"集合 {collection_name} 不存在，请先运行 dinov3_images_persistence_003.py")
+    from main.src import milvus_delete
+    milvus_delete.connect(port=config["milvus"]["port"])
+
+    ingester = IncrementalIngester(config, client, collection_name,
+                                   int(watch_config.get("batch_count", 32)),
+                                   float(watch_config.get("batch_deadline", 5.0)),
+                                   watch_config.get("state_path"), metrics,
+                                   float(watch_config.get("retry_interval", 300.0)))
+    dataset_path = ingester.dataset_path
+    extensions = tuple(config["data"]["image_extensions"])
+    poll_interval = float(watch_config.get("poll_interval", 2.0))
+    watcher, mode = create_watcher(args.mode or watch_config.get("mode", "auto"), dataset_path, poll_interval)
+    report_interval = float(watch_config.get("report_interval", 30.0))
+    print(f"监听 {dataset_path}（{mode}），每批 {ingester.batch_count} 张或等待 {ingester.batch_deadline}s")
+
+    last_report = time.time()
+    try:
+        snapshot = scan_directory(dataset_path, extensions)
+        if not ingester.has_state and not args.full:
+            ingester.seed_state(snapshot)
+        ingester.sync(snapshot)
+        while True:
+            while ingester.due():
+                ingester.flush()
+            # 有事件或到了批次截止时间时重新扫描；轮询模式按间隔扫描
+            watcher.wait(ingester.time_to_deadline() if ingester.pending else poll_interval)
+            ingester.sync(scan_directory(dataset_path, extensions))
+            if time.time() - last_report >= report_interval:
+                ingester.report()
+                last_report = time.time()
+    except KeyboardInterrupt:
+        while ingester.pending:
+            ingester.flush()
+        ingester.report()
+    finally:
+        watcher.stop()
+        metrics.close()
+
+
+if __name__ == '__main__':
+    main()
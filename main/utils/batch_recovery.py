@@ -0,0 +1,153 @@
+import json
+import os
+import random
+import time
+
+'''
+2025年10月19日
+入库批次的失败恢复：
+1.二分定位：批次特征提取失败时把批次对半拆开分别重试，直到定位出单张出错的图像，其余图像照常入库。
+2.退避重试：插入Milvus遇到连接中断、超时、限流等暂时性错误时按指数退避（带随机抖动）重试；
+  非暂时性错误（如某一行数据不合法）则二分定位出错的行。
+3.死信日志：仍无法入库的图像逐行追加到JSONL（图像名、集合、阶段、错误、时间），不会被静默丢弃；
+  之后运行 dinov3_images_persistence_003.py --replay 重新处理日志中的图像，重放时仍失败的会写回日志。
+'''
+
+# 视为暂时性错误（值得重试）的异常信息关键字
+TRANSIENT_KEYWORDS = ('unavailable', 'timeout', 'timed out', 'deadline', 'connection', 'rate limit',
+                      'too many requests', 'temporarily', 'try again')
+
+
+def is_transient_error(error):
+    """连接中断、超时、限流等暂时性错误"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    message = str(error).lower()
+    return any(keyword in message for keyword in TRANSIENT_KEYWORDS)
+
+
+def bisect_call(fn, items, split_on=None, reraise=None):
+    """
+    调用fn(items)，失败时对半拆分递归重试，定位出错的单个元素
+    :param split_on: 判断某个错误是否值得拆分，None表示总是拆分；不拆分时该段全部记为失败
+    :param reraise: 判断某个错误是否直接抛出（如内存不足交给内存调控处理）
+    :return: (成功列表 [(子列表, fn结果)]（保持原顺序）, 失败列表 [(元素, 异常)])
+    """
+    try:
+        return [(items, fn(items))], []
+    except Exception as e:
+        if reraise is not None and reraise(e):
+            raise
+        if len(items) == 1 or (split_on is not None and not split_on(e)):
+            return [], [(item, e) for item in items]
+        mid = len(items) // 2
+        left_ok, left_failed = bisect_call(fn, items[:mid], split_on, reraise)
+        right_ok, right_failed = bisect_call(fn, items[mid:], split_on, reraise)
+        return left_ok + right_ok, left_failed + right_failed
+
+
+class DeadLetterJournal:
+    """
+    死信日志（JSONL，追加写）
+    :param path: 日志文件，None表示只打印不落盘
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.recorded = 0
+
+    def record(self, image_names, stage, error, collection_name=None, batch_idx=None):
+        """
+        :param stage: load | extract | insert
+        """
+        image_names = list(image_names)
+        if not image_names:
+            return
+        self.recorded += len(image_names)
+        print(f"批次 {batch_idx} 中 {len(image_names)} 张图像{stage}失败"
+              f"{'，记入死信日志' if self.path else ''}: {error}")
+        if not self.path:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        now = time.time()
+        with open(self.path, 'a', encoding='utf-8') as f:
+            for name in image_names:
+                f.write(json.dumps({'image_name': name, 'collection': collection_name, 'stage': stage,
+                                    'error': str(error)[:500], 'batch_idx': batch_idx, 'time': now},
+                                   ensure_ascii=False) + '\n')
+
+    def append_entries(self, entries):
+        """原样追加已有条目（重放时写回不属于本次处理的条目）"""
+        if not self.path or not entries:
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries)
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return []
+        with open(path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def take(self):
+        """
+        取出全部待重放条目：日志改名为 .replay 后再读取，重放期间的新失败写入新日志；
+        上次重放中断时遗留的 .replay 条目一并返回
+        """
+        replay_path = self.path + '.replay'
+        if os.path.exists(self.path):
+            entries = self._read(replay_path) + self._read(self.path)
+            with open(replay_path + '.tmp', 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries)
+            os.replace(replay_path + '.tmp', replay_path)
+            os.remove(self.path)
+        return self._read(replay_path)
+
+    def finish_replay(self):
+        """重放完成后删除 .replay 文件"""
+        replay_path = self.path + '.replay'
+        if os.path.exists(replay_path):
+            os.remove(replay_path)
+
+
+class BatchRecovery:
+    """
+    :param journal: DeadLetterJournal
+    :param attempts: 暂时性错误的最多尝试次数（含第一次）
+    :param backoff / max_backoff: 第一次重试前的等待秒数 / 最长等待秒数，每次翻倍
+    """
+
+    def __init__(self, journal=None, attempts=4, backoff=0.5, max_backoff=8.0):
+        self.journal = journal or DeadLetterJournal()
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = 0
+
+    def retry(self, fn, *args, **kwargs):
+        """暂时性错误按指数退避重试，其余错误直接抛出"""
+        for attempt in range(self.attempts):
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.attempts - 1 or not is_transient_error(e):
+                    raise
+                self.retries += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def record(self, image_names, stage, error, collection_name=None, batch_idx=None):
+        self.journal.record(image_names, stage, error, collection_name, batch_idx)
+
+
+# 不重试、不落盘（只打印失败的图像名）
+NO_RECOVERY = BatchRecovery(attempts=1)
+
+
+def from_config(config):
+    """按config.yml中recovery创建"""
+    recovery_config = config.get('recovery') or {}
+    return BatchRecovery(DeadLetterJournal(recovery_config.get('journal_path')),
+                         int(recovery_config.get('attempts', 4)), float(recovery_config.get('backoff', 0.5)),
+                         float(recovery_config.get('max_backoff', 8.0)))
@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import inspect
+import time
+
+import numpy as np
+
+'''
+2025年10月19日
+多集合/多分区的并发检索：
+1.每个检索目标（集合，可选分区列表）作为一个协程并发发出：pymilvus提供AsyncMilvusClient时直接await，
+  否则（同步MilvusClient或LocalSearchClient）放到线程池中执行，总耗时约等于最慢的单次检索。
+2.每个目标单独超时；超时或出错的目标记录在errors中并跳过，只有全部失败时才抛出异常。
+3.各目标的结果按距离合并为全局top-k，每条结果额外带上来源集合（collection）和分区（partition）。
+用法:
+    python fanout_search.py --vectors ../data/query.npy --targets oxford5k_raw_dinov3 oxford5k_query_dinov3
+'''
+
+# 距离越大越相似的度量，其余（L2）越小越相似
+SIMILARITY_METRICS = ('IP', 'COSINE')
+
+
+def parse_target(target):
+    """
+    'collection' 或 'collection:partition_a,partition_b' -> (collection, [partitions] | None)
+    """
+    if isinstance(target, (tuple, list)):
+        collection_name, partitions = target
+        return collection_name, list(partitions) if partitions else None
+    collection_name, _, partitions = target.partition(':')
+    return collection_name, [p for p in partitions.split(',') if p] or None
+
+
+def merge_topk(target_results, limit, metric_type="L2"):
+    """
+    合并各目标的检索结果
+    :param target_results: [(collection, partitions, results)]，results为client.search的返回
+    :return: 每个查询一个按距离排序的top-limit列表
+    """
+    reverse = metric_type.upper() in SIMILARITY_METRICS
+    merged = None
+    for collection_name, partitions, results in target_results:
+        if merged is None:
+            merged = [[] for _ in results]
+        for hits, query_hits in zip(merged, results):
+            for hit in query_hits:
+                hit = dict(hit)
+                hit['collection'] = collection_name
+                hit['partition'] = partitions
+                hits.append(hit)
+    return [sorted(hits, key=lambda h: h['distance'], reverse=reverse)[:limit] for hits in merged or []]
+
+
+async def _search_target(client, target, data, limit, output_fields, search_params, timeout, semaphore, executor,
+                         filter=""):
+    collection_name, partitions = target
+    kwargs = dict(collection_name=collection_name, data=data, limit=limit, output_fields=output_fields,
+                  search_params=search_params)
+    if partitions:
+        kwargs['partition_names'] = partitions
+    if filter:
+        kwargs['filter'] = filter
+    async with semaphore:
+        if inspect.iscoroutinefunction(client.search):
+            call = client.search(timeout=timeout, **kwargs)
+        else:
+            # 同步客户端在线程中执行；超时后线程里的调用无法取消，但结果会被丢弃
+            call = asyncio.get_running_loop().run_in_executor(executor, functools.partial(client.search, **kwargs))
+        return await asyncio.wait_for(call, timeout)
+
+
+async def fan_out_search(client, targets, data, limit=10, output_fields=None, search_params=None, timeout=5.0,
+                         max_concurrency=8, filter=""):
+    """
+    并发检索多个集合/分区并合并为全局top-k
+    :param client: AsyncMilvusClient、MilvusClient 或 LocalSearchClient
+    :param targets: 检索目标列表，元素为 'collection[:p1,p2]' 或 (collection, [partitions])
+    :param timeout: 每个目标的超时秒数
+    :param filter: 标量过滤表达式，随向量检索一起下推到每个目标
+    :return: (合并后的结果, {目标: 异常})
+    """
+    targets = [parse_target(target) for target in targets]
+    data = np.asarray(data, dtype=np.float32).tolist()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    # 独立线程池，返回时不等待超时目标的线程结束（默认线程池在asyncio.run退出时会被等待）
+    executor = concurrent.futures.ThreadPoolExecutor(max_concurrency)
+    try:
+        outcomes = await asyncio.gather(
+            *(_search_target(client, target, data, limit, output_fields, search_params, timeout, semaphore, executor,
+                             filter)
+              for target in targets),
+            return_exceptions=True)
+    finally:
+        executor.shutdown(wait=False)
+
+    succeeded, errors = [], {}
+    for (collection_name, partitions), outcome in zip(targets, outcomes):
+        if isinstance(outcome, BaseException):
+            key = collection_name + (':' + ','.join(partitions) if partitions else '')
+            errors[key] = asyncio.TimeoutError(f"检索超时（{timeout}s）") \
+                if isinstance(outcome, asyncio.TimeoutError) else outcome
+        else:
+            succeeded.append((collection_name, partitions, outcome))
+    if not succeeded:
+        raise RuntimeError(f"所有检索目标都失败: {errors}")
+    metric_type = (search_params or {}).get('metric_type', 'L2')
+    return merge_topk(succeeded, limit, metric_type), errors
+
+
+def fan_out_search_sync(client, targets, data, limit=10, output_fields=None, search_params=None, timeout=5.0,
+                        max_concurrency=8, filter=""):
+    """供同步脚本调用的fan_out_search"""
+    return asyncio.run(fan_out_search(client, targets, data, limit, output_fields, search_params, timeout,
+                                      max_concurrency, filter))
+
+
+def create_async_client(config):
+    """
+    需在事件循环内调用（gRPC异步通道绑定当前循环）：milvus后端且pymilvus提供AsyncMilvusClient时返回异步客户端，
+    否则返回search_client.create_search_client的同步客户端（由线程池并发）
+    """
+    from main.utils import search_client
+    if (config.get('search') or {}).get('backend', 'milvus') == 'milvus':
+        try:
+            from pymilvus import AsyncMilvusClient
+        except ImportError:
+            pass
+        else:
+            from main.utils import get_ipadress
+            return AsyncMilvusClient(f"http://{get_ipadress.get_host_ip()}:{config['milvus']['port']}")
+    return search_client.create_search_client(config)
+
+
+async def fan_out_search_with_config(config, targets, data, limit=10, output_fields=None, search_params=None,
+                                     timeout=5.0, max_concurrency=8):
+    """在当前事件循环内创建客户端、并发检索后关闭异步客户端"""
+    client = create_async_client(config)
+    try:
+        return await fan_out_search(client, targets, data, limit, output_fields, search_params, timeout,
+                                    max_concurrency)
+    finally:
+        if inspect.iscoroutinefunction(getattr(client, 'close', None)):
+            await client.close()
+
+
+def from_config(config):
+    """
+    按config.yml中fanout读取检索目标
+    :return: (targets, timeout, max_concurrency)，未配置目标时targets为空列表
+    """
+    fanout_config = config.get('fanout') or {}
+    return (list(fanout_config.get('targets') or []), float(fanout_config.get('timeout', 5.0)),
+            int(fanout_config.get('max_concurrency', 8)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多集合并发检索，对比逐个串行检索的耗时")
+    parser.add_argument('--vectors', required=True, help="查询特征.npy（vector_io格式）或.fstore")
+    parser.add_argument('--targets', nargs='+', required=True, help="collection 或 collection:p1,p2")
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--max-concurrency', type=int, default=8)
+    parser.add_argument('--config', default='../config/config.yml')
+    args = parser.parse_args()
+
+    import yaml
+    from main.utils import search_client, vector_io
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    client = search_client.create_search_client(config)
+    queries, _ = vector_io.load_vectors(args.vectors)
+    queries = np.asarray(queries, dtype=np.float32)
+    search_params = {"metric_type": "L2", "params": {}}
+
+    start = time.perf_counter()
+    for target in map(parse_target, args.targets):
+        client.search(collection_name=target[0], data=queries.tolist(), limit=args.limit, output_fields=["image_name"],
+                      search_params=search_params, **({'partition_names': target[1]} if target[1] else {}))
+    sequential = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results, errors = asyncio.run(fan_out_search_with_config(config, args.targets, queries, args.limit,
+                                                             ["image_name"], search_params, args.timeout,
+                                                             args.max_concurrency))
+    concurrent = time.perf_counter() - start
+    print(f"{len(args.targets)} 个目标，{len(queries)} 个查询：串行 {sequential * 1000:.1f} ms，"
+          f"并发 {concurrent * 1000:.1f} ms")
+    for target, error in errors.items():
+        print(f"  {target} 失败: {error}")
+    for hit in results[0] if results else []:
+        print(f"  {hit['collection']} {hit['entity'].get('image_name')} (距离: {hit['distance']:.4f})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+'''
+2025年10月19日
+原生特征存储格式（替代 Milvus -> .mat -> loadmat 的往返）：
+  [0, 4096)         文件头：魔数 b'DFST' + uint32版本 + uint32头长度 + JSON头
+                    （model、dim、dtype、normalized、count、names_offset），不足部分补0
+  [4096, ...)       原始向量 [count, dim]，float32或float16，小端
+  [names_offset, )  图像名，UTF-8，每行一个
+特征提取时由 FeatureStoreWriter 直接流式写入，评估时 open_feature_store 内存映射向量（零拷贝），
+没有.mat v5的大小限制，1M行也只按需读入页面。vector_io.load_vectors 可直接读取 .fstore 文件。
+'''
+
+MAGIC = b'DFST'
+VERSION = 1
+HEADER_SIZE = 4096
+DTYPES = ('float32', 'float16')
+
+
+class FeatureStoreWriter:
+    """
+    :param path: 输出文件（.fstore）
+    :param dim: 向量维度
+    :param dtype: float32 | float16
+    :param model: 提取特征的模型标识
+    :param normalized: 向量是否已L2归一化
+    """
+
+    def __init__(self, path, dim, dtype='float32', model=None, normalized=True):
+        if dtype not in DTYPES:
+            raise ValueError(f"不支持的dtype: {dtype}")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.meta = {'model': model, 'dim': int(dim), 'dtype': dtype, 'normalized': bool(normalized), 'count': 0}
+        self.names = []
+        self._f = open(path + '.tmp', 'wb')
+        self._f.write(b'\0' * HEADER_SIZE)
+
+    def add(self, vectors, names):
+        vectors = np.ascontiguousarray(vectors, dtype=self.meta['dtype'])
+        if vectors.ndim != 2 or vectors.shape[1] != self.meta['dim']:
+            raise ValueError(f"向量形状 {vectors.shape} 与维度 {self.meta['dim']} 不一致")
+        if len(vectors) != len(names):
+            raise ValueError("向量数与图像名数不一致")
+        self._f.write(vectors.astype(vectors.dtype.newbyteorder('<'), copy=False).tobytes())
+        self.names.extend(names)
+        self.meta['count'] += len(names)
+
+    def close(self):
+        self.meta['names_offset'] = self._f.tell()
+        self._f.write('\n'.join(self.names).encode('utf-8'))
+        header = json.dumps(self.meta, ensure_ascii=False).encode('utf-8')
+        if len(header) + 12 > HEADER_SIZE:
+            raise ValueError("特征存储文件头过长")
+        self._f.seek(0)
+        self._f.write(MAGIC + struct.pack('<II', VERSION, len(header)) + header)
+        self._f.close()
+        # 写完整后再改名，中断时不会留下半个文件
+        os.replace(self.path + '.tmp', self.path)
+
+
+class FeatureStore:
+    """
+    :ivar vectors: [count, dim] 内存映射数组
+    :ivar names: 图像名列表
+    :ivar meta: 文件头
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            head = f.read(HEADER_SIZE)
+            if head[:4] != MAGIC:
+                raise ValueError(f"不是特征存储文件: {path}")
+            version, header_len = struct.unpack('<II', head[4:12])
+            if version != VERSION:
+                raise ValueError(f"特征存储版本不匹配: {path}")
+            self.meta = json.loads(head[12:12 + header_len].decode('utf-8'))
+            f.seek(self.meta['names_offset'])
+            names = f.read().decode('utf-8')
+        self.path = path
+        self.names = names.split('\n') if names else []
+        count, dim = self.meta['count'], self.meta['dim']
+        dtype = np.dtype(self.meta['dtype']).newbyteorder('<')
+        self.vectors = np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(count, dim)) \
+            if count else np.empty((0, dim), dtype=dtype)
+
+    def __len__(self):
+        return self.meta['count']
+
+
+def open_feature_store(path):
+    return FeatureStore(path)
+
+
+def write_feature_store(path, vectors, names, dtype='float32', model=None, normalized=True):
+    """一次性写入全部向量"""
+    writer = FeatureStoreWriter(path, vectors.shape[1], dtype, model, normalized)
+    writer.add(vectors, names)
+    writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把Milvus集合导出为特征存储文件（替代milvus_to_mat）")
+    parser.add_argument('--collection', required=True)
+    parser.add_argument('--output', required=True, help="输出.fstore文件")
+    parser.add_argument('--dtype', default='float32', choices=DTYPES)
+    parser.add_argument('--model', default="facebook/dinov3-vitb16-pretrain-lvd1689m")
+    args = parser.parse_args()
+
+    from pymilvus import MilvusClient
+    from main.utils import get_ipadress, vector_io
+    client = MilvusClient("http://" + get_ipadress.get_host_ip() + ":19530")
+    _, vectors, names = vector_io.export_collection(client, args.collection)
+    write_feature_store(args.output, vectors, names, args.dtype, args.model)
+    print(f"已导出 {len(names)} 个向量到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
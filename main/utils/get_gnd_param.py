@@ -1,7 +1,6 @@
 import pickle
 
 import numpy as np
-from sympy.codegen.cnodes import sizeof
 
 '''
 从gnd文件中获取roxford固定给出的文件名排序信息
@@ -26,12 +25,13 @@ def inspect_pkl(file_path):
 
     return data
 
-# 使用
-data = inspect_pkl('../data/datasets/roxford5k/gnd_roxford5k.pkl')
-imlist = data.get('imlist')
-qimlist = data.get('qimlist')
-print(qimlist)
-print('-'*50)
+# 使用（只在直接运行时检查，import时不再读取pkl；程序中获取imlist/qimlist请用gnd_cache.load_gnd_cache）
+if __name__ == '__main__':
+    data = inspect_pkl('../data/datasets/roxford5k/gnd_roxford5k.pkl')
+    imlist = data.get('imlist')
+    qimlist = data.get('qimlist')
+    print(qimlist)
+    print('-'*50)
 
 '''
 print(qimlist[0])
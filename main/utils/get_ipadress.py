@@ -1,6 +1,6 @@
 import socket
-import torch
-import torchvision
+
+
 def get_host_ip():
     """
     查询本机ip地址
@@ -16,6 +16,9 @@ def get_host_ip():
     return ip
 
 if __name__ == '__main__':
+    # torch只在直接运行时用于打印版本，import本模块获取IP时不再加载
+    import torch
+    import torchvision
     print(get_host_ip())
 
     print("PyTorch版本:", torch.__version__)
@@ -0,0 +1,250 @@
+import json
+import os
+import pickle
+
+import numpy as np
+
+'''
+2025年10月19日
+gnd文件的紧凑缓存：
+1.第一次加载时把gnd_*.pkl（或revisitop1m.txt）转换成一组.npy文件：
+  图像名定长字节数组 + 排序索引（名字->序号），easy/hard/junk以及E/M/H三种协议下的ok/junk
+  都存成"扁平索引数组 + 偏移量"的形式。
+2.之后的加载直接对这些.npy做内存映射（mmap_mode='r'），不再反序列化pkl、也不再用np.concatenate逐个拼接。
+源文件的大小或修改时间变化后会自动重建缓存。
+'''
+
+CACHE_VERSION = 1
+
+# 评估协议: 协议名 -> (ok包含的字段, junk包含的字段)，与example_evaluate.py中的拼接方式一致
+PROTOCOLS = {
+    'easy': (('easy',), ('junk', 'hard')),
+    'medium': (('easy', 'hard'), ('junk',)),
+    'hard': (('hard',), ('junk', 'easy')),
+}
+
+GND_FIELDS = ('easy', 'hard', 'junk')
+
+
+class NameList:
+    """
+    内存映射的图像名列表，行为类似只读list
+    :param names: 定长字节数组（np.bytes_）
+    :param order: names的字典序排序索引，用于二分查找名字对应的序号
+    """
+
+    def __init__(self, names, order):
+        self._names = names
+        self._order = order
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        return self._names[i].decode('utf-8')
+
+    def __iter__(self):
+        for name in self._names:
+            yield name.decode('utf-8')
+
+    def __contains__(self, name):
+        return self.indices([name])[0] >= 0
+
+    def index(self, name):
+        """返回名字在列表中的序号，不存在时与list.index一样抛出ValueError"""
+        idx = self.indices([name])[0]
+        if idx < 0:
+            raise ValueError(f"{name} 不在列表中")
+        return int(idx)
+
+    def indices(self, names):
+        """
+        批量把名字转换成序号
+        :param names: 名字列表
+        :return: int64数组，找不到的名字为-1
+        """
+        if len(self._names) == 0:
+            return np.full(len(names), -1, dtype=np.int64)
+        keys = np.array([n.encode('utf-8') for n in names], dtype=self._names.dtype)
+        pos = np.searchsorted(self._names, keys, sorter=self._order)
+        pos = np.minimum(pos, len(self._names) - 1)
+        idx = np.asarray(self._order[pos], dtype=np.int64)
+        idx[self._names[idx] != keys] = -1
+        return idx
+
+    def tolist(self):
+        return list(self)
+
+
+class GndCache:
+    """
+    已加载（内存映射）的gnd缓存
+    :param cache_dir: 缓存目录
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.imlist = NameList(self._load('imlist'), self._load('imlist_order'))
+        self.qimlist = NameList(self._load('qimlist'), self._load('qimlist_order'))
+        self.n = len(self.imlist)
+        self.nq = len(self.qimlist)
+        self._protocols = {}
+        self._gnd = None
+
+    def _load(self, key):
+        return np.load(os.path.join(self.cache_dir, key + '.npy'), mmap_mode='r')
+
+    def _ragged(self, key):
+        """把 扁平数组+偏移量 还原成每个查询一个视图（不复制数据）"""
+        values = self._load(key + '_idx')
+        offsets = self._load(key + '_off')
+        return [values[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+    def protocol(self, name):
+        """
+        获取某个评估协议下的gnd，可直接传给evaluate.compute_map
+        :param name: easy | medium | hard
+        :return: [{'ok': ndarray, 'junk': ndarray}, ...]
+        """
+        if name not in PROTOCOLS:
+            raise ValueError('Unknown protocol: {}!'.format(name))
+        if name not in self._protocols:
+            ok = self._ragged(f'{name}_ok')
+            junk = self._ragged(f'{name}_junk')
+            self._protocols[name] = [{'ok': o, 'junk': j} for o, j in zip(ok, junk)]
+        return self._protocols[name]
+
+    @property
+    def gnd(self):
+        """与原始pkl中cfg['gnd']结构一致的列表（数组为内存映射视图）"""
+        if self._gnd is None:
+            parts = {field: self._ragged(field) for field in GND_FIELDS}
+            bbx = self._load('bbx')
+            self._gnd = []
+            for i in range(self.nq):
+                g = {field: parts[field][i] for field in GND_FIELDS}
+                if not np.isnan(bbx[i]).any():
+                    g['bbx'] = bbx[i]
+                self._gnd.append(g)
+        return self._gnd
+
+
+def default_cache_dir(src_path):
+    """gnd_roxford5k.pkl -> gnd_roxford5k_cache/"""
+    return os.path.splitext(src_path)[0] + '_cache'
+
+
+def _source_signature(src_path):
+    st = os.stat(src_path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _save_names(cache_dir, key, names):
+    encoded = [n.encode('utf-8') for n in names]
+    width = max([len(n) for n in encoded] + [1])
+    arr = np.array(encoded, dtype=f'S{width}')
+    np.save(os.path.join(cache_dir, key + '.npy'), arr)
+    np.save(os.path.join(cache_dir, key + '_order.npy'), np.argsort(arr, kind='stable').astype(np.int64))
+
+
+def _save_ragged(cache_dir, key, lists):
+    lengths = [len(x) for x in lists]
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate([np.asarray(x, dtype=np.int32) for x in lists]) if lists else np.empty(0, np.int32)
+    np.save(os.path.join(cache_dir, key + '_idx.npy'), values.astype(np.int32))
+    np.save(os.path.join(cache_dir, key + '_off.npy'), offsets)
+
+
+def build_gnd_cache(src_path, cache_dir=None):
+    """
+    把gnd pkl文件或图像列表txt文件转换成缓存目录
+    :param src_path: gnd_*.pkl 或 revisitop1m.txt
+    :param cache_dir: 缓存目录，默认与源文件同级的 *_cache 目录
+    :return: 缓存目录
+    """
+    cache_dir = cache_dir or default_cache_dir(src_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # 先删除meta.json，保证中途失败时不会留下"看起来有效"的缓存
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    if src_path.endswith('.pkl'):
+        with open(src_path, 'rb') as f:
+            data = pickle.load(f)
+        imlist, qimlist, gnd = data['imlist'], data.get('qimlist', []), data.get('gnd', [])
+    else:
+        with open(src_path, 'r') as f:
+            imlist = f.read().splitlines()
+        qimlist, gnd = [], []
+
+    _save_names(cache_dir, 'imlist', imlist)
+    _save_names(cache_dir, 'qimlist', qimlist)
+
+    for field in GND_FIELDS:
+        _save_ragged(cache_dir, field, [g.get(field, []) for g in gnd])
+
+    # 三种协议下的ok/junk只在这里拼接一次，排序后存储
+    for name, (ok_fields, junk_fields) in PROTOCOLS.items():
+        ok = [np.sort(np.concatenate([np.asarray(g.get(k, []), dtype=np.int32) for k in ok_fields])) for g in gnd]
+        junk = [np.sort(np.concatenate([np.asarray(g.get(k, []), dtype=np.int32) for k in junk_fields])) for g in gnd]
+        _save_ragged(cache_dir, f'{name}_ok', ok)
+        _save_ragged(cache_dir, f'{name}_junk', junk)
+
+    bbx = np.full((len(gnd), 4), np.nan, dtype=np.float64)
+    for i, g in enumerate(gnd):
+        if g.get('bbx') is not None:
+            bbx[i] = g['bbx']
+    np.save(os.path.join(cache_dir, 'bbx.npy'), bbx)
+
+    meta = {
+        'version': CACHE_VERSION,
+        'source': os.path.abspath(src_path),
+        'source_signature': _source_signature(src_path),
+        'n': len(imlist),
+        'nq': len(qimlist),
+    }
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return cache_dir
+
+
+def _is_fresh(src_path, cache_dir):
+    meta_path = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('version') != CACHE_VERSION:
+        return False
+    # 源文件不存在时（例如只拷贝了缓存）直接使用缓存
+    if not os.path.exists(src_path):
+        return True
+    return meta.get('source_signature') == _source_signature(src_path)
+
+
+def load_gnd_cache(src_path, cache_dir=None, rebuild=False):
+    """
+    加载gnd缓存，缓存不存在或已过期时先构建
+    :param src_path: gnd_*.pkl 或 revisitop1m.txt
+    :param cache_dir: 缓存目录，默认与源文件同级的 *_cache 目录
+    :param rebuild: 是否强制重建
+    :return: GndCache
+    """
+    cache_dir = cache_dir or default_cache_dir(src_path)
+    if rebuild or not _is_fresh(src_path, cache_dir):
+        build_gnd_cache(src_path, cache_dir)
+    return GndCache(cache_dir)
+
+
+if __name__ == '__main__':
+    cache = load_gnd_cache('../data/datasets/roxford5k/gnd_roxford5k.pkl', rebuild=True)
+    print(f"缓存目录: {cache.cache_dir}")
+    print(f"imlist: {cache.n} 张, qimlist: {cache.nq} 张")
+    for protocol in PROTOCOLS:
+        print(f"  {protocol}: ok总数 {sum(len(g['ok']) for g in cache.protocol(protocol))}")
@@ -0,0 +1,202 @@
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+import yaml
+from PIL import Image
+from tqdm import tqdm
+
+'''
+2025年10月19日
+预解码图像分片缓存：
+1.按预处理配置（缩放尺寸、插值方式）把数据集中的JPEG解码、转RGB、缩放后，以uint8按顺序写入若干个大分片文件。
+2.index.json记录配置、图像名和分片信息，读取时对分片做内存映射，直接得到HxWx3的数组交给处理器，
+  省去每次换模型/换池化方式重新提取特征时的JPEG解码开销。
+3.index.json同时记录每张图像构建时源文件的(mtime_ns, 大小)，查找时源文件已变化（被替换或删除）视为未命中，
+  调用方回退到直接读取图像文件，不会继续使用旧像素。
+'''
+
+INDEX_FILE = 'index.json'
+
+RESAMPLE = {
+    'bilinear': Image.BILINEAR,
+    'bicubic': Image.BICUBIC,
+    'nearest': Image.NEAREST,
+}
+
+
+def cache_key(size, resample='bilinear'):
+    """预处理配置对应的缓存子目录名，如 224x224_bilinear"""
+    return f"{size[0]}x{size[1]}_{resample}"
+
+
+def cache_dir_for(cache_root, dataset_path, size, resample='bilinear'):
+    """缓存目录: <cache_root>/<数据集目录名>/<预处理配置>"""
+    dataset_name = os.path.basename(os.path.normpath(dataset_path))
+    return os.path.join(cache_root, dataset_name, cache_key(size, resample))
+
+
+def source_signature(image_path):
+    """源文件的 [mtime_ns, 大小]，文件不存在时为None"""
+    try:
+        stat = os.stat(image_path)
+    except OSError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _decode_resize(args):
+    """解码并缩放一张图像（在进程池中执行），返回 (像素, 错误信息, 解码前的源文件签名)"""
+    image_path, size, resample = args
+    # 解码前取签名，解码期间文件被替换时签名不一致，之后查找会视为未命中
+    signature = source_signature(image_path)
+    try:
+        with Image.open(image_path) as image:
+            image = image.convert('RGB').resize((size[1], size[0]), RESAMPLE[resample])
+            return np.asarray(image, dtype=np.uint8), None, signature
+    except Exception as e:
+        return None, str(e), signature
+
+
+def build_image_cache(dataset_path, image_files, cache_dir, size=(224, 224), resample='bilinear',
+                      shard_images=2048, num_workers=None):
+    """
+    构建预解码图像缓存
+    :param dataset_path: 图像目录
+    :param image_files: 图像文件名列表（带扩展名），按此顺序写入分片
+    :param cache_dir: 缓存目录（一般由cache_dir_for生成）
+    :param size: 预缩放尺寸 (高, 宽)
+    :param resample: 插值方式 bilinear | bicubic | nearest
+    :param shard_images: 每个分片的图像数
+    :param num_workers: 解码进程数，默认CPU核数
+    :return: ImageShardCache
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+    h, w = size
+    names, sources, shards, failed = [], [], [], []
+    shard_file = None
+    tasks = [(os.path.join(dataset_path, name), (h, w), resample) for name in image_files]
+    with Pool(num_workers) as pool:
+        results = pool.imap(_decode_resize, tasks, chunksize=16)
+        for image_name, (pixels, error, signature) in tqdm(zip(image_files, results), total=len(tasks), desc="构建图像缓存"):
+            if pixels is None:
+                print(f"加载图像 {image_name} 失败: {error}")
+                failed.append(image_name)
+                continue
+            # 当前分片写满后新开一个分片，分片内按顺序追加
+            if shard_file is None or shards[-1]['count'] == shard_images:
+                if shard_file is not None:
+                    shard_file.close()
+                shards.append({'file': f"shard_{len(shards):05d}.u8", 'count': 0})
+                shard_file = open(os.path.join(cache_dir, shards[-1]['file']), 'wb')
+            shard_file.write(pixels.tobytes())
+            shards[-1]['count'] += 1
+            names.append(image_name)
+            sources.append(signature)
+    if shard_file is not None:
+        shard_file.close()
+
+    index = {
+        'dataset_path': os.path.abspath(dataset_path),
+        'size': [h, w],
+        'resample': resample,
+        'shard_images': shard_images,
+        'names': names,
+        'sources': sources,
+        'shards': shards,
+        'failed': failed,
+    }
+    # index.json最后写入，作为缓存构建完成的标志
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    return ImageShardCache(cache_dir)
+
+
+class ImageShardCache:
+    """
+    只读的预解码图像缓存
+    :param cache_dir: 缓存目录
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, INDEX_FILE), 'r', encoding='utf-8') as f:
+            self.index = json.load(f)
+        self.size = tuple(self.index['size'])
+        self.shard_images = self.index['shard_images']
+        self._positions = {name: i for i, name in enumerate(self.index['names'])}
+        self._sources = self.index.get('sources')
+        self.dataset_path = self.index['dataset_path']
+        self._shards = [None] * len(self.index['shards'])
+        if self._sources is None:
+            print(f"图像缓存 {cache_dir} 没有记录源文件信息，无法判断是否过期，全部视为未命中，请重新构建")
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, image_name):
+        return self.is_fresh(image_name)
+
+    def is_fresh(self, image_name, image_path=None):
+        """
+        缓存中有该图像，且源文件的mtime和大小与构建缓存时一致
+        :param image_path: 源文件路径，默认为构建时的数据集目录下的同名文件
+        """
+        pos = self._positions.get(image_name)
+        if pos is None or self._sources is None:
+            return False
+        signature = source_signature(image_path or os.path.join(self.dataset_path, image_name))
+        return signature is not None and signature == self._sources[pos]
+
+    def _shard(self, shard_idx):
+        if self._shards[shard_idx] is None:
+            info = self.index['shards'][shard_idx]
+            h, w = self.size
+            self._shards[shard_idx] = np.memmap(os.path.join(self.cache_dir, info['file']), dtype=np.uint8,
+                                                mode='r', shape=(info['count'], h, w, 3))
+        return self._shards[shard_idx]
+
+    def get(self, image_name):
+        """
+        取一张图像
+        :param image_name: 图像文件名（带扩展名）
+        :return: HxWx3 uint8数组（内存映射视图）
+        """
+        pos = self._positions[image_name]
+        return self._shard(pos // self.shard_images)[pos % self.shard_images]
+
+    def get_batch(self, image_names):
+        """批量取图像，返回数组列表，可直接传给processor(images=...)"""
+        return [self.get(name) for name in image_names]
+
+
+def open_image_cache(cache_root, dataset_path, size, resample='bilinear'):
+    """
+    打开某个数据集在给定预处理配置下的缓存
+    :return: ImageShardCache，缓存不存在时返回None
+    """
+    cache_dir = cache_dir_for(cache_root, dataset_path, size, resample)
+    if not os.path.exists(os.path.join(cache_dir, INDEX_FILE)):
+        return None
+    return ImageShardCache(cache_dir)
+
+
+if __name__ == '__main__':
+    # 按config.yml中的数据集和缓存配置构建缓存（在main/src或main/utils目录下运行）
+    with open('../config/config.yml', 'r', encoding='utf-8') as f:
+        config = yaml.safe_load(f)
+    cache_config = config['image_cache']
+    dataset_path = config['data']['dataset_path']
+    extensions = tuple(config['data']['image_extensions'])
+    image_files = sorted(name for name in os.listdir(dataset_path) if name.lower().endswith(extensions))
+    cache_dir = cache_dir_for(cache_config['dir'], dataset_path, cache_config['size'], cache_config['resample'])
+    cache = build_image_cache(dataset_path, image_files, cache_dir,
+                              size=cache_config['size'],
+                              resample=cache_config['resample'],
+                              shard_images=cache_config['shard_images'])
+    print(f"缓存已写入 {cache_dir}，共 {len(cache)} 张图像")
@@ -0,0 +1,255 @@
+import argparse
+import json
+import os
+
+import numpy as np
+from tqdm import tqdm
+
+'''
+2025年10月19日
+本地IVF-PQ压缩索引：
+1.粗量化：k-means把数据库特征分成nlist个倒排列表；细量化：残差按m个子空间分别做256类k-means（乘积量化），
+  每张图像只存m个字节的编码（加上4字节行号），768维float32的3072字节压缩到几十字节。
+2.检索：选nprobe个最近的倒排列表，用查询残差与码本预先算好的距离表做非对称距离(ADC)打分。
+3.可选精排：对ADC得到的前rerank个候选，从内存映射的全精度向量文件中取出原始特征计算精确距离后重排。
+检索接口与HNSWIndex一致，可通过search_client.LocalSearchClient以MilvusClient.search的方式调用。
+'''
+
+INDEX_TYPE = 'ivfpq'
+
+
+def _encode_names(names):
+    encoded = [n.encode('utf-8') for n in names]
+    width = max([len(n) for n in encoded] + [1])
+    return np.array(encoded, dtype=f'S{width}')
+
+
+def _sq_dists(x, centroids, c_sq_norms=None):
+    """x[n, d]与centroids[k, d]两两平方L2距离"""
+    if c_sq_norms is None:
+        c_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    return np.einsum('ij,ij->i', x, x)[:, None] - 2.0 * (x @ centroids.T) + c_sq_norms[None, :]
+
+
+def _assign(x, centroids, chunk=8192):
+    """分块计算每个向量最近的中心，避免一次性生成n×k距离矩阵"""
+    c_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+    labels = np.empty(len(x), dtype=np.int64)
+    for i in range(0, len(x), chunk):
+        labels[i:i + chunk] = np.argmin(_sq_dists(np.asarray(x[i:i + chunk]), centroids, c_sq_norms), axis=1)
+    return labels
+
+
+def kmeans(x, k, niter=20, seed=0):
+    """
+    简单的Lloyd k-means
+    :param x: [n, d] float32
+    :return: centroids [k, d]
+    """
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=len(x) < k)].astype(np.float32)
+    for _ in range(niter):
+        labels = _assign(x, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, x)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # 空簇重新随机初始化
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), size=int(empty.sum()))]
+    return centroids
+
+
+class IVFPQIndex:
+    """
+    :param dim: 向量维度
+    :param nlist: 倒排列表数
+    :param m: 子空间数（每个向量的编码字节数），需整除dim
+    :param nprobe: 默认检索的倒排列表数
+    """
+
+    def __init__(self, dim, nlist=256, m=32, nprobe=16):
+        if dim % m != 0:
+            raise ValueError(f"子空间数m={m}必须整除维度dim={dim}")
+        self.dim = dim
+        self.nlist = nlist
+        self.m = m
+        self.dsub = dim // m
+        self.ksub = 256
+        self.nprobe = nprobe
+        self.centroids = None  # [nlist, dim]
+        self.codebooks = None  # [m, 256, dsub]
+        self.codes = None  # [n, m] uint8，按倒排列表顺序存放
+        self.list_offsets = None  # [nlist+1]
+        self.list_rows = None  # [n] 编码对应的原始行号
+        self.ids = None
+        self.names = None
+        self.vectors = None  # 全精度向量（可选，用于精排）
+
+    def __len__(self):
+        return 0 if self.codes is None else len(self.codes)
+
+    def train(self, vectors, max_train=100000, niter=20, seed=0):
+        """在数据库特征（或其采样）上训练粗量化中心和PQ码本"""
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(vectors, dtype=np.float32)
+        if len(sample) > max_train:
+            sample = sample[np.sort(rng.choice(len(sample), size=max_train, replace=False))]
+        print(f"训练粗量化中心: {self.nlist} 类，训练样本 {len(sample)}")
+        self.centroids = kmeans(sample, self.nlist, niter=niter, seed=seed)
+        residuals = sample - self.centroids[_assign(sample, self.centroids)]
+        self.codebooks = np.empty((self.m, self.ksub, self.dsub), dtype=np.float32)
+        for j in tqdm(range(self.m), desc="训练PQ码本"):
+            sub = np.ascontiguousarray(residuals[:, j * self.dsub:(j + 1) * self.dsub])
+            self.codebooks[j] = kmeans(sub, self.ksub, niter=niter, seed=seed + j)
+        return self
+
+    def _encode(self, residuals):
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = _assign(residuals[:, j * self.dsub:(j + 1) * self.dsub], self.codebooks[j])
+        return codes
+
+    def add(self, vectors, ids=None, names=None, keep_vectors=True, chunk=65536):
+        """
+        编码全部数据库向量并建立倒排列表
+        :param keep_vectors: 是否保留全精度向量用于精排
+        """
+        n = len(vectors)
+        labels = np.empty(n, dtype=np.int64)
+        codes = np.empty((n, self.m), dtype=np.uint8)
+        for i in tqdm(range(0, n, chunk), desc="PQ编码"):
+            x = np.asarray(vectors[i:i + chunk], dtype=np.float32)
+            labels[i:i + chunk] = _assign(x, self.centroids)
+            codes[i:i + chunk] = self._encode(x - self.centroids[labels[i:i + chunk]])
+        order = np.argsort(labels, kind='stable')
+        self.codes = codes[order]
+        self.list_rows = order.astype(np.int32)
+        self.list_offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=self.nlist), out=self.list_offsets[1:])
+        self.ids = np.arange(n, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64)
+        self.names = _encode_names(names if names is not None else [str(i) for i in range(n)])
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32) if keep_vectors else None
+        return self
+
+    def bytes_per_vector(self):
+        """内存中常驻的每向量字节数（PQ编码 + 行号），不含可选的全精度精排文件"""
+        return self.m * self.codes.itemsize + self.list_rows.itemsize
+
+    def search(self, queries, k=10, nprobe=None, rerank=None):
+        """
+        :param queries: [nq, dim]
+        :param nprobe: 检索的倒排列表数
+        :param rerank: ADC候选数，>0且存有全精度向量时用精确距离重排
+        :return: (distances [nq, k] 平方L2, indices [nq, k] 行号，不足k个时为-1)
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        shortlist = max(k, rerank or 0)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        coarse = _sq_dists(queries, self.centroids)
+        probes = np.argsort(coarse, axis=1)[:, :nprobe]
+        sub_index = np.arange(self.m)
+
+        for qi, q in enumerate(queries):
+            cand_rows, cand_dists = [], []
+            for lst in probes[qi].tolist():
+                start, end = self.list_offsets[lst], self.list_offsets[lst + 1]
+                if start == end:
+                    continue
+                # 距离表: table[j, c] = ||残差第j段 - 码本j的第c个中心||^2
+                residual = (q - self.centroids[lst]).reshape(self.m, 1, self.dsub)
+                table = ((self.codebooks - residual) ** 2).sum(axis=2)
+                codes = np.asarray(self.codes[start:end])
+                cand_dists.append(table[sub_index, codes].sum(axis=1))
+                cand_rows.append(np.asarray(self.list_rows[start:end]))
+            if not cand_rows:
+                continue
+            cand_dists = np.concatenate(cand_dists)
+            cand_rows = np.concatenate(cand_rows)
+            top = np.argsort(cand_dists)[:shortlist] if len(cand_dists) <= shortlist \
+                else np.argpartition(cand_dists, shortlist - 1)[:shortlist]
+            cand_dists, cand_rows = cand_dists[top], cand_rows[top]
+
+            if rerank and self.vectors is not None:
+                rows_sorted = np.sort(cand_rows)  # 按行号顺序读取内存映射文件
+                exact = np.asarray(self.vectors[rows_sorted]) - q
+                cand_dists, cand_rows = np.einsum('ij,ij->i', exact, exact), rows_sorted
+
+            order = np.argsort(cand_dists)[:k]
+            distances[qi, :len(order)] = cand_dists[order]
+            indices[qi, :len(order)] = cand_rows[order]
+        return distances, indices
+
+    def save(self, index_dir):
+        os.makedirs(index_dir, exist_ok=True)
+        keys = ['centroids', 'codebooks', 'codes', 'list_offsets', 'list_rows', 'ids', 'names']
+        if self.vectors is not None:
+            keys.append('vectors')
+        for key in keys:
+            np.save(os.path.join(index_dir, key + '.npy'), getattr(self, key))
+        meta = {
+            'index_type': INDEX_TYPE,
+            'metric_type': 'L2',
+            'dim': self.dim,
+            'count': len(self),
+            'nlist': self.nlist,
+            'm': self.m,
+            'nprobe': self.nprobe,
+            'bytes_per_vector': self.bytes_per_vector(),
+            'has_vectors': self.vectors is not None,
+        }
+        with open(os.path.join(index_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, index_dir, mmap=True):
+        with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        index = cls(meta['dim'], nlist=meta['nlist'], m=meta['m'], nprobe=meta['nprobe'])
+        mode = 'r' if mmap else None
+        # 码本和中心很小，直接读入内存；编码和全精度向量做内存映射
+        index.centroids = np.load(os.path.join(index_dir, 'centroids.npy'))
+        index.codebooks = np.load(os.path.join(index_dir, 'codebooks.npy'))
+        index.list_offsets = np.load(os.path.join(index_dir, 'list_offsets.npy'))
+        for key in ('codes', 'list_rows', 'ids', 'names'):
+            setattr(index, key, np.load(os.path.join(index_dir, key + '.npy'), mmap_mode=mode))
+        if meta.get('has_vectors'):
+            index.vectors = np.load(os.path.join(index_dir, 'vectors.npy'), mmap_mode=mode)
+        return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从Milvus集合或.npy特征构建本地IVF-PQ索引")
+    parser.add_argument('--collection', required=True, help="集合名，同时作为本地索引目录名")
+    parser.add_argument('--vectors', default=None, help=".npy特征文件（配套_names.txt），不指定时从Milvus导出")
+    parser.add_argument('--index-root', default='../data/local_index')
+    parser.add_argument('--nlist', type=int, default=1024)
+    parser.add_argument('--m', type=int, default=32, help="每个向量的PQ编码字节数")
+    parser.add_argument('--nprobe', type=int, default=16)
+    parser.add_argument('--no-rerank-vectors', action='store_true', help="不保存全精度向量（无法精排）")
+    args = parser.parse_args()
+
+    from main.utils import vector_io
+    if args.vectors:
+        vectors, names = vector_io.load_vectors(args.vectors)
+        ids = None
+    else:
+        from pymilvus import MilvusClient
+        from main.utils import get_ipadress
+        client = MilvusClient("http://" + get_ipadress.get_host_ip() + ":19530")
+        ids, vectors, names = vector_io.export_collection(client, args.collection)
+    print(f"共 {len(vectors)} 个向量，维度 {vectors.shape[1]}")
+
+    index = IVFPQIndex(vectors.shape[1], nlist=min(args.nlist, len(vectors)), m=args.m, nprobe=args.nprobe)
+    index.train(vectors)
+    index.add(vectors, ids=ids, names=names, keep_vectors=not args.no_rerank_vectors)
+    index_dir = os.path.join(args.index_root, args.collection)
+    index.save(index_dir)
+    print(f"索引已保存到 {index_dir}，每向量 {index.bytes_per_vector()} 字节（全精度为 {4 * index.dim} 字节）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import ctypes
+import gc
+import os
+import threading
+
+'''
+2025年10月19日
+特征提取的内存调控：
+1.每个批次期间后台线程按固定间隔采样进程RSS，得到批次峰值；按 (峰值 - 批次前RSS) / 图像数 估计单张图像的内存开销（指数平均）。
+2.下一批的batch size取 预算内能容纳的图像数，缩小立即生效，增大每批最多翻倍，限制在[min_batch_size, max_batch_size]；
+  rss_budget_mb为空时取 cgroup内存上限（没有则为物理内存）的80%。
+3.批次内内存不足（MemoryError / CUDA out of memory）时batch size减半后重试同一批，已是1张时跳过该图像。
+4.批次结束后立即释放PIL图像和中间张量，gc后调用glibc的malloc_trim把空闲内存还给系统，避免RSS只涨不降。
+5.像素数超过max_image_pixels的图像在解码前用JPEG draft按1/2、1/4、1/8缩小解码，仍超出时再缩放，
+  处理器本来就会缩放到224，对特征几乎没有影响，单张超大图像也不会撑爆内存。
+'''
+
+MB = 1024 * 1024
+
+# glibc的malloc_trim，非glibc时为None
+try:
+    _MALLOC_TRIM = ctypes.CDLL('libc.so.6').malloc_trim
+except (OSError, AttributeError):
+    _MALLOC_TRIM = None
+
+
+def current_rss():
+    """当前进程RSS（字节），无法获取时为None"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+def memory_limit():
+    """cgroup内存上限，没有限制时为物理内存（字节）"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path, 'r') as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        # cgroup v1 未限制时是一个接近2^63的大数
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value)
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+
+
+def is_out_of_memory(error):
+    """MemoryError或CUDA显存不足"""
+    return isinstance(error, MemoryError) or 'out of memory' in str(error).lower()
+
+
+def release_memory():
+    """回收循环引用并把空闲堆内存还给系统（非glibc时只做gc）"""
+    gc.collect()
+    if _MALLOC_TRIM is not None:
+        _MALLOC_TRIM(0)
+
+
+def limit_image_pixels(image, max_pixels):
+    """
+    限制图像像素数，需在图像数据加载（convert等）之前调用
+    :param image: Image.open得到的（尚未解码的）图像
+    """
+    if not max_pixels or image.size[0] * image.size[1] <= max_pixels:
+        return image
+    scale = (max_pixels / float(image.size[0] * image.size[1])) ** 0.5
+    target = (max(1, int(image.size[0] * scale)), max(1, int(image.size[1] * scale)))
+    # JPEG可直接按DCT缩放解码，内存和时间都只需原图的一部分
+    image.draft('RGB', target)
+    if image.size[0] * image.size[1] > max_pixels:
+        image.thumbnail(target)
+    return image
+
+
+class _PeakSampler:
+    """后台线程按间隔采样RSS，记录峰值"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.peak = current_rss() or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss() or 0)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss() or 0)
+        return self.peak
+
+
+class MemoryGovernor:
+    """
+    :param budget: RSS预算（字节）
+    :param initial_batch_size: 第一批的batch size（通常为config中的processing.batch_size）
+    :param sample_interval: 批次内RSS采样间隔（秒）
+    """
+
+    def __init__(self, budget, initial_batch_size=32, min_batch_size=1, max_batch_size=64, sample_interval=0.02,
+                 smoothing=0.5):
+        self.budget = budget
+        self.min_batch_size = max(1, min_batch_size)
+        self.max_batch_size = max(self.min_batch_size, max_batch_size)
+        self.batch_size = min(max(initial_batch_size, self.min_batch_size), self.max_batch_size)
+        self.sample_interval = sample_interval
+        self.smoothing = smoothing
+        self.per_image = None  # 单张图像的内存开销估计（字节）
+        self.peak_rss = 0
+        self.history = []  # [(batch size, 批次峰值RSS)]
+        self._sampler = None
+        self._baseline = 0
+
+    def begin(self):
+        """批次开始"""
+        self._baseline = current_rss() or 0
+        self._sampler = _PeakSampler(self.sample_interval)
+
+    def end(self, num_images):
+        """批次结束：释放内存、更新单张开销估计并调整下一批的batch size"""
+        peak = self._sampler.stop()
+        self._sampler = None
+        release_memory()
+        self.peak_rss = max(self.peak_rss, peak)
+        self.history.append((num_images, peak))
+        if num_images > 0 and peak > self._baseline:
+            estimate = (peak - self._baseline) / num_images
+            self.per_image = estimate if self.per_image is None else \
+                self.smoothing * estimate + (1 - self.smoothing) * self.per_image
+        self._adjust()
+
+    def _adjust(self):
+        if self.per_image is None:
+            return
+        # 留10%余量，采样间隔内的短时峰值可能没有采到
+        available = 0.9 * self.budget - (current_rss() or 0)
+        fits = int(available // self.per_image) if available > 0 else self.min_batch_size
+        # 缩小立即生效，增大每批最多翻倍，避免一次估计偏小导致越界
+        size = min(fits, self.batch_size * 2)
+        self.batch_size = min(max(size, self.min_batch_size), self.max_batch_size)
+
+    def on_out_of_memory(self):
+        """
+        批次内存不足
+        :return: 是否可以用更小的batch size重试
+        """
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler = None
+        release_memory()
+        if self.batch_size <= self.min_batch_size:
+            return False
+        self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+        return True
+
+    def report(self):
+        sizes = [size for size, _ in self.history]
+        if not sizes:
+            return
+        print(f"内存调控: 预算 {self.budget / MB:.0f} MB，峰值RSS {self.peak_rss / MB:.0f} MB，"
+              f"batch size {min(sizes)}~{max(sizes)}（当前 {self.batch_size}），"
+              f"单张约 {(self.per_image or 0) / MB:.1f} MB")
+
+
+def from_config(config):
+    """
+    按config.yml中memory创建调控器
+    :return: (MemoryGovernor或None, max_image_pixels或None)
+    """
+    memory_config = config.get('memory') or {}
+    max_pixels = memory_config.get('max_image_pixels')
+    if not memory_config.get('enabled'):
+        return None, max_pixels
+    budget_mb = memory_config.get('rss_budget_mb')
+    budget = int(budget_mb * MB) if budget_mb else int(memory_limit() * 0.8)
+    governor = MemoryGovernor(budget, int(config['processing']['batch_size']),
+                              int(memory_config.get('min_batch_size', 1)),
+                              int(memory_config.get('max_batch_size', 64)),
+                              float(memory_config.get('sample_interval', 0.02)))
+    return governor, max_pixels
@@ -0,0 +1,116 @@
+import json
+import os
+import re
+import time
+
+from PIL import Image
+
+'''
+2025年10月19日
+集合的标量元数据字段与过滤检索：
+1.入库时每张图像额外写入 landmark（从图像名解析，如 all_souls_000013 -> all_souls）、dataset、
+  原图宽高 width/height（只读文件头）、入库时间 ingested_at（Unix秒）。
+2.字符串字段建Trie索引，数值字段建STL_SORT索引（requirements中的Milvus 2.3即支持，INVERTED需要2.4），
+  过滤表达式通过 client.search(filter=...) 与向量检索一起下推到Milvus，不需要多取结果再在Python里过滤。
+3.build_filter 把常用条件拼成Milvus过滤表达式。
+'''
+
+# (字段名, DataType名, 字段参数, 标量索引类型)
+SCALAR_FIELDS = (
+    ("landmark", "VARCHAR", {"max_length": 64}, "Trie"),
+    ("dataset", "VARCHAR", {"max_length": 32}, "Trie"),
+    ("width", "INT32", {}, "STL_SORT"),
+    ("height", "INT32", {}, "STL_SORT"),
+    ("ingested_at", "INT64", {}, "STL_SORT"),
+)
+FIELD_NAMES = tuple(field[0] for field in SCALAR_FIELDS)
+
+
+def parse_landmark(image_name):
+    """all_souls_000013.jpg -> all_souls；paris_louvre_000123.jpg -> louvre"""
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    landmark = re.sub(r'_\d+$', '', stem)
+    if landmark.startswith('paris_'):
+        landmark = landmark[len('paris_'):]
+    return landmark[:64]
+
+
+def read_image_size(image_path):
+    """只解析文件头得到原图 (width, height)，读取失败时为 (0, 0)"""
+    try:
+        with Image.open(image_path) as image:
+            return image.size
+    except Exception:
+        return 0, 0
+
+
+def batch_metadata(image_names, dataset_path, dataset, ingested_at=None):
+    """一个批次的标量字段，顺序与image_names一致"""
+    ingested_at = int(ingested_at if ingested_at is not None else time.time())
+    rows = []
+    for name in image_names:
+        width, height = read_image_size(os.path.join(dataset_path, name))
+        rows.append({"landmark": parse_landmark(name), "dataset": dataset, "width": int(width),
+                     "height": int(height), "ingested_at": ingested_at})
+    return rows
+
+
+def schema_fields():
+    """dict形式的字段定义，与dinov3_images_persistence_003.py建集合时的写法一致"""
+    from pymilvus import DataType
+    return [{"name": name, "type": getattr(DataType, dtype), **params} for name, dtype, params, _ in SCALAR_FIELDS]
+
+
+def add_schema_fields(schema):
+    """给MilvusClient.create_schema创建的schema加上标量字段"""
+    from pymilvus import DataType
+    for name, dtype, params, _ in SCALAR_FIELDS:
+        schema.add_field(field_name=name, datatype=getattr(DataType, dtype), **params)
+    return schema
+
+
+def add_scalar_indexes(index_params):
+    for name, _, _, index_type in SCALAR_FIELDS:
+        index_params.add_index(field_name=name, index_type=index_type)
+    return index_params
+
+
+def create_scalar_indexes(client, collection_name):
+    client.create_index(collection_name=collection_name,
+                        index_params=add_scalar_indexes(client.prepare_index_params()))
+
+
+def has_metadata_fields(client, collection_name):
+    """集合是否包含全部标量字段（旧集合没有时入库只写向量和图像名）"""
+    fields = {field["name"] for field in client.describe_collection(collection_name=collection_name)["fields"]}
+    return set(FIELD_NAMES) <= fields
+
+
+def build_filter(landmark=None, dataset=None, min_width=None, min_height=None, ingested_after=None,
+                 ingested_before=None):
+    """
+    拼接Milvus过滤表达式，未指定的条件忽略
+    :param landmark / dataset: 字符串或字符串列表
+    :param ingested_after / ingested_before: Unix秒
+    """
+    clauses = []
+    for field, value in (("landmark", landmark), ("dataset", dataset)):
+        if isinstance(value, str):
+            clauses.append(f"{field} == {json.dumps(value, ensure_ascii=False)}")
+        elif value:
+            clauses.append(f"{field} in {json.dumps(list(value), ensure_ascii=False)}")
+    for field, op, value in (("width", ">=", min_width), ("height", ">=", min_height),
+                             ("ingested_at", ">=", ingested_after), ("ingested_at", "<", ingested_before)):
+        if value is not None:
+            clauses.append(f"{field} {op} {int(value)}")
+    return " and ".join(clauses)
+
+
+def from_config(config):
+    """
+    按config.yml中metadata读取设置
+    :return: (数据集名，未启用时为None, 检索时的过滤表达式)
+    """
+    metadata_config = config.get('metadata') or {}
+    dataset = metadata_config.get('dataset') if metadata_config.get('enabled') else None
+    return dataset, metadata_config.get('filter') or ""
@@ -0,0 +1,229 @@
+import bisect
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+'''
+2025年10月19日
+轻量的分阶段计时与指标统计：
+1.timer(name) 上下文管理器记录各阶段耗时（解码、processor、前向、.cpu().numpy()、client.insert等），
+  counter/observe 记录计数与直方图。
+2.导出为JSON文件或Prometheus文本格式（可选开启本地HTTP端点 /metrics）。
+3.profile_batch(batch_idx) 对指定批次做一次 torch.profiler 或 cProfile 采集。
+未启用时 timer/profile_batch 直接返回共享的空上下文，几乎没有开销。
+'''
+
+# 直方图默认分桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_NULL_CONTEXT = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # 最后一个为+Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'max': self.max,
+            'buckets': {str(b): c for b, c in zip(self.buckets + ('+Inf',), self.counts)},
+        }
+
+
+class Metrics:
+    """
+    指标注册表
+    :param enabled: 是否启用，未启用时所有记录操作为空操作
+    :param profile_batch: 需要采集性能剖析的批次序号，None表示不采集
+    :param profiler: torch | cprofile
+    :param profile_dir: 剖析结果输出目录
+    :param json_path: close()时写出的JSON文件路径
+    """
+
+    def __init__(self, enabled=False, profile_batch=None, profiler='cprofile', profile_dir='.', json_path=None):
+        self.enabled = enabled
+        self.json_path = json_path
+        self.profile_batch_idx = profile_batch
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    def inc(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    def timer(self, name):
+        """
+        阶段计时，耗时记录到名为 name 的直方图（单位秒）
+        用法: with metrics.timer('forward'): ...
+        """
+        if not self.enabled:
+            return _NULL_CONTEXT
+        return self._timer(name)
+
+    @contextmanager
+    def _timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def profile_batch(self, batch_idx):
+        """批次序号等于配置的profile_batch时，对该批次做一次性能剖析"""
+        if self.profile_batch_idx is None or batch_idx != self.profile_batch_idx:
+            return _NULL_CONTEXT
+        return self._profile(batch_idx)
+
+    @contextmanager
+    def _profile(self, batch_idx):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        if self.profiler == 'torch':
+            import torch
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            output_path = os.path.join(self.profile_dir, f"batch_{batch_idx}_trace.json")
+            with torch.profiler.profile(activities=activities, record_shapes=True) as prof:
+                yield
+            prof.export_chrome_trace(output_path)
+        else:
+            output_path = os.path.join(self.profile_dir, f"batch_{batch_idx}.prof")
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                profiler.dump_stats(output_path)
+        print(f"批次 {batch_idx} 的性能剖析已保存到 {output_path}")
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': dict(self.counters),
+                'histograms': {name: h.to_dict() for name, h in self.histograms.items()},
+            }
+
+    def dump_json(self, path):
+        if not self.enabled:
+            return
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+        print(f"指标已保存到 {path}")
+
+    def prometheus_text(self, prefix='dino'):
+        """Prometheus文本格式"""
+        lines = []
+        snapshot = self.snapshot()
+        for name, value in sorted(snapshot['counters'].items()):
+            metric = f"{prefix}_{name}_total".replace('.', '_')
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, h in sorted(snapshot['histograms'].items()):
+            metric = f"{prefix}_{name}_seconds".replace('.', '_')
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bucket, count in h['buckets'].items():
+                cumulative += count
+                lines.append(f'{metric}_bucket{{le="{bucket}"}} {cumulative}')
+            lines.append(f"{metric}_sum {h['sum']}")
+            lines.append(f"{metric}_count {h['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def start_http_server(self, port, host='127.0.0.1'):
+        """在后台线程开启 http://host:port/metrics（Prometheus文本格式）"""
+        if not self.enabled or self._server is not None:
+            return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = HTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(f"指标端点: http://{host}:{port}/metrics")
+
+    def close(self):
+        """写出JSON（如果配置了路径）并关闭HTTP端点"""
+        if self.json_path:
+            self.dump_json(self.json_path)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+# 未启用的共享实例，作为各函数metrics参数的默认值
+NULL_METRICS = Metrics()
+
+
+def from_config(config):
+    """
+    按config.yml中的metrics配置创建Metrics，并按需开启HTTP端点
+    :param config: 完整配置字典（没有metrics段时返回未启用的Metrics）
+    """
+    metrics_config = (config or {}).get('metrics') or {}
+    metrics = Metrics(
+        enabled=bool(metrics_config.get('enabled')),
+        profile_batch=metrics_config.get('profile_batch'),
+        profiler=metrics_config.get('profiler', 'cprofile'),
+        profile_dir=metrics_config.get('profile_dir', '.'),
+        json_path=metrics_config.get('json_path'),
+    )
+    if metrics.enabled and metrics_config.get('http_port'):
+        metrics.start_http_server(int(metrics_config['http_port']))
+    return metrics
+
+
+def from_config_file(config_path='../config/config.yml'):
+    """给不读取config.yml的脚本（检索、milvus_all_result）使用"""
+    import yaml
+    if not os.path.exists(config_path):
+        return Metrics()
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return from_config(yaml.safe_load(f))
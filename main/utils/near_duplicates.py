@@ -0,0 +1,160 @@
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+
+import numpy as np
+
+'''
+2025年10月19日
+全库近重复图像检测：
+1.分块自相似连接：数据库特征以内存映射方式共享给各工作进程，每个进程处理一段行，
+  只与其后的列块做矩阵乘（上三角），保留余弦相似度不低于阈值的图像对；
+  每个进程的内存只有 block x db_block，1M向量也能在有限内存内用满所有核。
+2.并查集把图像对合并成簇，每簇保留入库顺序最早的一张，其余可通过 src/milvus_delete.py 的删除路径清理。
+'''
+
+# 工作进程持有的内存映射特征
+_JOIN = {}
+
+
+def _init_join_worker(vectors_path, threshold, db_block):
+    from main.utils import vector_io
+    _JOIN['vectors'], _ = vector_io.load_vectors(vectors_path)
+    _JOIN['threshold'] = threshold
+    _JOIN['db_block'] = db_block
+
+
+def _join_rows(row_range):
+    """行 [start, end) 与其后所有列的相似度连接，返回 (i, j, sim) 且 i < j"""
+    start, end = row_range
+    vectors, threshold, db_block = _JOIN['vectors'], _JOIN['threshold'], _JOIN['db_block']
+    rows = np.asarray(vectors[start:end], dtype=np.float32)
+    found_i, found_j, found_s = [], [], []
+    for col in range(start, len(vectors), db_block):
+        sim = rows @ np.asarray(vectors[col:col + db_block], dtype=np.float32).T
+        ii, jj = np.nonzero(sim >= threshold)
+        ii, jj = ii + start, jj + col
+        upper = jj > ii
+        found_i.append(ii[upper])
+        found_j.append(jj[upper])
+        found_s.append(sim[ii[upper] - start, jj[upper] - col])
+    return np.concatenate(found_i), np.concatenate(found_j), np.concatenate(found_s).astype(np.float32)
+
+
+def find_duplicate_pairs(vectors_path, threshold=0.95, block=1024, db_block=16384, num_workers=None):
+    """
+    分块并行自相似连接
+    :param vectors_path: L2归一化特征.npy（vector_io格式）
+    :return: (i [m], j [m], sim [m])
+    """
+    from main.utils import vector_io
+    vectors, _ = vector_io.load_vectors(vectors_path)
+    n = len(vectors)
+    tasks = [(start, min(start + block, n)) for start in range(0, n, block)]
+    num_workers = num_workers or os.cpu_count() or 1
+
+    # 每个进程单线程BLAS，避免与进程数叠加后超订CPU
+    saved_env = {key: os.environ.get(key) for key in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')}
+    os.environ.update({key: '1' for key in saved_env})
+    try:
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(num_workers, initializer=_init_join_worker, initargs=(vectors_path, threshold, db_block)) as pool:
+            results = list(pool.imap_unordered(_join_rows, tasks))
+    finally:
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    return (np.concatenate([r[0] for r in results]), np.concatenate([r[1] for r in results]),
+            np.concatenate([r[2] for r in results]))
+
+
+def cluster_pairs(n, i, j):
+    """
+    并查集合并图像对
+    :return: 簇列表，每个簇为升序的行号数组（只包含大小>=2的簇）
+    """
+    parent = np.arange(n, dtype=np.int64)
+
+    def find(x):
+        root = x
+        while parent[root] != root:
+            root = parent[root]
+        while parent[x] != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    for a, b in zip(i.tolist(), j.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            # 以行号小的为根，簇内第一张即入库最早的图像
+            parent[max(ra, rb)] = min(ra, rb)
+
+    members = np.unique(np.concatenate([i, j])) if len(i) else np.empty(0, dtype=np.int64)
+    roots = np.array([find(x) for x in members.tolist()], dtype=np.int64)
+    order = np.lexsort((members, roots))
+    members, roots = members[order], roots[order]
+    splits = np.flatnonzero(np.diff(roots)) + 1
+    return [cluster for cluster in np.split(members, splits) if len(cluster) > 1]
+
+
+def duplicates_to_purge(clusters, names):
+    """每簇保留第一张，返回其余图像名"""
+    return [names[row] for cluster in clusters for row in cluster[1:]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全库近重复图像检测")
+    parser.add_argument('--vectors', default=None, help="特征.npy（配套_names.txt），不指定时从Milvus集合导出")
+    parser.add_argument('--collection', default="oxford5k_raw_dinov3")
+    parser.add_argument('--threshold', type=float, default=0.95, help="余弦相似度阈值")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认全部CPU核")
+    parser.add_argument('--block', type=int, default=1024)
+    parser.add_argument('--db-block', type=int, default=16384)
+    parser.add_argument('--output', default='../data/near_duplicates.json')
+    parser.add_argument('--purge', action='store_true', help="通过milvus_delete删除每簇除第一张外的图像")
+    args = parser.parse_args()
+
+    from main.utils import vector_io
+    vectors_path = args.vectors
+    tmp_dir = None
+    if vectors_path is None:
+        # 从Milvus导出到临时.npy，供各工作进程内存映射
+        from pymilvus import MilvusClient
+        from main.utils import get_ipadress
+        client = MilvusClient("http://" + get_ipadress.get_host_ip() + ":19530")
+        _, vectors, names = vector_io.export_collection(client, args.collection)
+        tmp_dir = tempfile.mkdtemp()
+        vectors_path = os.path.join(tmp_dir, 'vectors.npy')
+        vector_io.save_vectors(vectors_path, vectors, names)
+    vectors, names = vector_io.load_vectors(vectors_path)
+
+    i, j, sims = find_duplicate_pairs(vectors_path, args.threshold, args.block, args.db_block, args.workers)
+    clusters = cluster_pairs(len(vectors), i, j)
+    purge = duplicates_to_purge(clusters, names)
+    print(f"{len(vectors)} 个向量中找到 {len(i)} 对近重复，{len(clusters)} 个簇，可删除 {len(purge)} 张")
+
+    if os.path.dirname(args.output):
+        os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'threshold': args.threshold,
+                   'clusters': [[names[row] for row in cluster] for cluster in clusters]},
+                  f, ensure_ascii=False, indent=2)
+    print(f"簇列表已保存到 {args.output}")
+
+    if args.purge and purge:
+        from main.src import milvus_delete
+        milvus_delete.connect()
+        print(f"已删除 {milvus_delete.delete_images(args.collection, purge)} 行")
+    if tmp_dir is not None:
+        del vectors
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
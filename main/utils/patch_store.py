@@ -0,0 +1,178 @@
+import json
+import os
+
+import numpy as np
+
+'''
+2025年10月19日
+patch token存储与基于patch匹配的短名单重排序：
+1.PatchStoreWriter：特征提取时在同一次前向中取出每张图像范数最大的top-N个patch token（L2归一化，float16），
+  追加写入 <dir>/patches.f16，图像名写入 names.txt，meta.json记录 top_n / dim / count。
+2.PatchStore：以内存映射方式读取 [count, top_n, dim] 的patch描述子，按图像名定位。
+3.PatchReranker：对查询的top-100结果批量计算 patch 相似度矩阵，统计相似度超过阈值的互为最近邻(MNN)匹配，
+  按匹配得分重排；短名单大小固定，延迟可预期。
+'''
+
+STORE_VERSION = 1
+
+
+def select_patches(last_hidden_state, top_n, num_register_tokens=0):
+    """
+    去掉CLS和register token，取范数最大的top_n个patch token并L2归一化
+    :param last_hidden_state: [B, 1 + num_register_tokens + P, D] 模型输出（numpy）
+    :return: [B, top_n, D] float16
+    """
+    tokens = np.asarray(last_hidden_state[:, 1 + num_register_tokens:, :], dtype=np.float32)
+    norms = np.linalg.norm(tokens, axis=2)
+    top = np.argsort(-norms, axis=1)[:, :top_n]
+    selected = np.take_along_axis(tokens, top[:, :, None], axis=1)
+    selected /= np.maximum(np.linalg.norm(selected, axis=2, keepdims=True), 1e-12)
+    return selected.astype(np.float16)
+
+
+class PatchStoreWriter:
+    """
+    追加写入patch描述子，可多次打开续写（同一目录的top_n和dim必须一致）
+    """
+
+    def __init__(self, store_dir, top_n, dim):
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.meta_path = os.path.join(store_dir, 'meta.json')
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+            if (self.meta['top_n'], self.meta['dim']) != (top_n, dim):
+                raise ValueError(f"patch存储 {store_dir} 的top_n/dim与当前配置不一致")
+        else:
+            self.meta = {'version': STORE_VERSION, 'top_n': top_n, 'dim': dim, 'count': 0}
+        self._truncate(os.path.join(store_dir, 'patches.f16'), os.path.join(store_dir, 'names.txt'))
+        self._data = open(os.path.join(store_dir, 'patches.f16'), 'ab')
+        self._names = open(os.path.join(store_dir, 'names.txt'), 'a', encoding='utf-8')
+
+    def _truncate(self, data_path, names_path):
+        """
+        meta.json只在close时更新，上次写入中途中断时两个文件末尾会多出未记录的行，
+        续写前截断到meta中的count，保证图像名与patch描述子一一对应
+        """
+        count = self.meta['count']
+        if os.path.exists(data_path):
+            size = count * self.meta['top_n'] * self.meta['dim'] * np.dtype(np.float16).itemsize
+            if os.path.getsize(data_path) > size:
+                os.truncate(data_path, size)
+        if os.path.exists(names_path):
+            with open(names_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+            if len(lines) > count:
+                with open(names_path, 'w', encoding='utf-8') as f:
+                    f.writelines(lines[:count])
+
+    def add(self, names, patches):
+        """
+        :param names: 图像名列表
+        :param patches: [B, top_n, dim] float16
+        """
+        patches = np.ascontiguousarray(patches, dtype=np.float16)
+        if patches.shape[1:] != (self.meta['top_n'], self.meta['dim']):
+            raise ValueError(f"patch形状 {patches.shape[1:]} 与存储不一致")
+        self._data.write(patches.tobytes())
+        self._names.write(''.join(f"{name}\n" for name in names))
+        self.meta['count'] += len(names)
+
+    def close(self):
+        self._data.close()
+        self._names.close()
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, indent=2)
+
+
+class PatchStore:
+    """内存映射读取patch描述子"""
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != STORE_VERSION:
+            raise ValueError(f"patch存储版本不匹配: {store_dir}")
+        self.store_dir = store_dir
+        self.top_n = self.meta['top_n']
+        self.dim = self.meta['dim']
+        count = self.meta['count']
+        self.patches = np.memmap(os.path.join(store_dir, 'patches.f16'), dtype=np.float16, mode='r',
+                                 shape=(count, self.top_n, self.dim)) if count else \
+            np.empty((0, self.top_n, self.dim), dtype=np.float16)
+        with open(os.path.join(store_dir, 'names.txt'), 'r', encoding='utf-8') as f:
+            self.names = [line.rstrip('\n') for line in f][:count]
+        # 同名图像重复写入时以最后一次为准
+        self._rows = {name: row for row, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def rows(self, names):
+        """图像名 -> 行号，不存在的为-1"""
+        return np.array([self._rows.get(name, -1) for name in names], dtype=np.int64)
+
+    def get(self, names):
+        """
+        :return: [len(names), top_n, dim]
+        :raises KeyError: 有图像名不在存储中
+        """
+        rows = self.rows(names)
+        if (rows < 0).any():
+            missing = [name for name, row in zip(names, rows) if row < 0]
+            raise KeyError(f"patch存储中没有图像: {missing[:5]}{' ...' if len(missing) > 5 else ''}")
+        return self.patches[rows]
+
+
+class PatchReranker:
+    """
+    :param store: 数据库图像的PatchStore
+    :param shortlist: 参与重排的结果数
+    :param threshold: 计入匹配的patch相似度下限
+    """
+
+    def __init__(self, store, shortlist=100, threshold=0.5):
+        self.store = store
+        self.shortlist = shortlist
+        self.threshold = threshold
+
+    def scores(self, query_patches, candidate_rows):
+        """
+        批量计算查询与候选图像的MNN匹配得分
+        :param query_patches: [top_n, dim]
+        :param candidate_rows: [c] 候选在存储中的行号（-1表示缺失，得分为0）
+        :return: [c] float32
+        """
+        candidate_rows = np.asarray(candidate_rows)
+        valid = candidate_rows >= 0
+        result = np.zeros(len(candidate_rows), dtype=np.float32)
+        if not valid.any():
+            return result
+        q = np.asarray(query_patches, dtype=np.float32)
+        c = np.asarray(self.store.patches[np.sort(candidate_rows[valid])], dtype=np.float32)
+        # 按行号顺序读取内存映射（顺序访问磁盘），再还原为候选顺序
+        order = np.argsort(np.argsort(candidate_rows[valid]))
+        c = c[order]
+        sim = np.einsum('qd,cnd->cqn', q, c)  # [c, Nq, Nc]
+        best_for_q = sim.argmax(axis=2)  # 每个查询patch在候选中的最近邻
+        best_for_c = sim.argmax(axis=1)  # 每个候选patch在查询中的最近邻
+        back = np.take_along_axis(best_for_c, best_for_q, axis=1)
+        mutual = back == np.arange(sim.shape[1])[None, :]
+        best_sim = np.take_along_axis(sim, best_for_q[:, :, None], axis=2)[:, :, 0]
+        result[valid] = np.where(mutual & (best_sim >= self.threshold), best_sim, 0.0).sum(axis=1)
+        return result
+
+    def rerank(self, query_patches, names):
+        """
+        对一个查询的结果按patch匹配得分重排（只重排前shortlist个，其余保持原顺序）
+        :param names: 初次检索结果的图像名（按距离从小到大）
+        :return: (重排后的序号（names中的下标）, 前shortlist个的匹配得分)
+        """
+        head = min(self.shortlist, len(names))
+        scores = self.scores(query_patches, self.store.rows(names[:head]))
+        order = np.argsort(-scores, kind='stable')
+        return np.concatenate([order, np.arange(head, len(names))]), scores[order]
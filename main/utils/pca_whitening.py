@@ -0,0 +1,109 @@
+import argparse
+import os
+
+import numpy as np
+
+'''
+2025年10月19日
+PCA白化降维：
+1.learn：在留出的图像特征上（例如revisitop1m干扰项，不与评估集重叠）学习均值、主成分方向和特征值。
+2.apply：对 gen_batch_image_features 的输出批量做 (x - mean) @ P[:, :d] / sqrt(eigval[:d]) 并重新L2归一化，
+  得到128/256/512维向量后再存入Milvus或本地索引，内存、插入带宽和检索开销按维度成比例下降。
+参数保存为.npz（mean, projection, eigvals），config.yml中 model.pca_whitening 指定文件和目标维度。
+'''
+
+
+class PCAWhitening:
+    """
+    :param mean: [D] 均值
+    :param projection: [D, D] 主成分方向（按特征值从大到小排列的列向量）
+    :param eigvals: [D] 特征值（从大到小）
+    """
+
+    def __init__(self, mean, projection, eigvals, eps=1e-6):
+        self.mean = mean.astype(np.float32)
+        self.projection = projection.astype(np.float32)
+        self.eigvals = eigvals.astype(np.float32)
+        self.eps = eps
+        self._cache = {}
+
+    @classmethod
+    def learn(cls, features, chunk=65536):
+        """
+        :param features: [n, D] 留出集特征（可为内存映射数组，分块累加协方差）
+        """
+        n, dim = features.shape
+        total = np.zeros(dim, dtype=np.float64)
+        for i in range(0, n, chunk):
+            total += np.asarray(features[i:i + chunk], dtype=np.float64).sum(axis=0)
+        mean = total / n
+        cov = np.zeros((dim, dim), dtype=np.float64)
+        for i in range(0, n, chunk):
+            x = np.asarray(features[i:i + chunk], dtype=np.float64) - mean
+            cov += x.T @ x
+        cov /= max(n - 1, 1)
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        order = np.argsort(eigvals)[::-1]
+        return cls(mean, eigvecs[:, order], np.maximum(eigvals[order], 0.0))
+
+    def _matrix(self, dim):
+        """dim维的白化投影矩阵 P[:, :dim] / sqrt(eigval)，按维度缓存"""
+        if dim not in self._cache:
+            if dim > self.projection.shape[1]:
+                raise ValueError(f"目标维度 {dim} 超过原始维度 {self.projection.shape[1]}")
+            scale = 1.0 / np.sqrt(self.eigvals[:dim] + self.eps)
+            self._cache[dim] = np.ascontiguousarray(self.projection[:, :dim] * scale[None, :], dtype=np.float32)
+        return self._cache[dim]
+
+    def apply(self, features, dim):
+        """
+        批量降维白化并重新L2归一化
+        :param features: [n, D] float32
+        :param dim: 目标维度
+        :return: [n, dim] float32
+        """
+        reduced = (np.asarray(features, dtype=np.float32) - self.mean) @ self._matrix(dim)
+        norms = np.linalg.norm(reduced, axis=1, keepdims=True)
+        return (reduced / np.maximum(norms, 1e-12)).astype(np.float32)
+
+    def save(self, path):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, mean=self.mean, projection=self.projection, eigvals=self.eigvals)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['mean'], data['projection'], data['eigvals'])
+
+
+def from_config(config):
+    """
+    按config.yml中model.pca_whitening创建白化器
+    :return: (PCAWhitening, 目标维度)，未启用时返回 (None, 原始特征维度)
+    """
+    pca_config = config['model'].get('pca_whitening') or {}
+    if not pca_config.get('enabled'):
+        return None, config['model']['feature_dim']
+    return PCAWhitening.load(pca_config['path']), int(pca_config['dim'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在留出集特征上学习PCA白化")
+    parser.add_argument('--features', required=True, help="留出集特征.npy（如revisitop1m干扰项）")
+    parser.add_argument('--output', default='../data/pca/pca_whitening.npz')
+    args = parser.parse_args()
+
+    features = np.load(args.features, mmap_mode='r')
+    print(f"留出集特征: {features.shape}")
+    pca = PCAWhitening.learn(features)
+    pca.save(args.output)
+    explained = np.cumsum(pca.eigvals) / pca.eigvals.sum()
+    for dim in (128, 256, 512):
+        if dim <= len(explained):
+            print(f"  {dim}维保留方差: {explained[dim - 1] * 100:.1f}%")
+    print(f"PCA白化参数已保存到 {args.output}")
+
+
+if __name__ == '__main__':
+    main()
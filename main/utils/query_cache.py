@@ -0,0 +1,151 @@
+import collections
+import hashlib
+import json
+import os
+import pickle
+import time
+
+import numpy as np
+
+'''
+2025年10月19日
+重复查询的两级缓存：
+1.特征缓存：图像内容哈希 -> 特征向量，命中时跳过解码和前向。
+2.结果缓存：(特征哈希, 集合名, 集合版本, limit, 检索参数, 输出字段, 过滤表达式) -> top-k结果，命中时跳过检索。
+两级都按条目数做LRU淘汰，可选在进程退出时持久化到磁盘，下次启动继续使用。
+集合版本号保存在 main/data/collection_versions/<集合名>.version 中，入库、监听入库、milvus_delete删除时更新，
+版本变化后旧的结果缓存自然不再命中（随后被LRU淘汰）。
+'''
+
+VERSION_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'data',
+                           'collection_versions')
+
+
+def collection_version(collection_name, version_dir=VERSION_DIR):
+    """读取集合当前版本号，从未修改过时为'0'"""
+    path = os.path.join(version_dir, f"{collection_name}.version")
+    if not os.path.exists(path):
+        return '0'
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip() or '0'
+
+
+def bump_collection_version(collection_name, version_dir=VERSION_DIR):
+    """集合内容发生变化（插入/删除）后调用，使该集合的结果缓存失效"""
+    os.makedirs(version_dir, exist_ok=True)
+    path = os.path.join(version_dir, f"{collection_name}.version")
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(str(time.time_ns()))
+    os.replace(path + '.tmp', path)
+
+
+class LRUCache:
+    """按条目数限制大小的LRU缓存，同时统计命中率与节省的耗时"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()  # key -> (value, 计算该值的耗时)
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key):
+        item = self.entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.saved_seconds += item[1]
+        return item[0]
+
+    def put(self, key, value, cost=0.0):
+        self.entries[key] = (value, cost)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0, 'saved_seconds': self.saved_seconds}
+
+
+def _hash_bytes(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+class QueryCache:
+    """
+    :param feature_entries / result_entries: 两级缓存的最大条目数
+    :param path: 持久化文件，None表示只在内存中
+    :param model_key: 模型与预处理设置的标识，设置变化时特征缓存不再命中
+    """
+
+    def __init__(self, feature_entries=10000, result_entries=10000, path=None, model_key=''):
+        self.features = LRUCache(feature_entries)
+        self.results = LRUCache(result_entries)
+        self.path = path
+        self.model_key = model_key
+        if path and os.path.exists(path):
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+            for cache, name in ((self.features, 'features'), (self.results, 'results')):
+                for key, item in saved.get(name, []):
+                    cache.put(key, *item)
+
+    def image_features(self, image_bytes, embed_fn):
+        """
+        :param image_bytes: 查询图像文件的原始字节
+        :param embed_fn: 缓存未命中时调用，输入图像字节，返回特征[1, d]
+        """
+        key = (self.model_key, _hash_bytes(image_bytes))
+        features = self.features.get(key)
+        if features is None:
+            start = time.perf_counter()
+            features = np.asarray(embed_fn(image_bytes), dtype=np.float32)
+            self.features.put(key, features, time.perf_counter() - start)
+        return features
+
+    def search(self, client, collection_name, data, limit=10, output_fields=None, search_params=None, filter=""):
+        """与client.search相同的调用方式，命中时直接返回缓存的结果"""
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        key = (_hash_bytes(data.tobytes()), collection_name, collection_version(collection_name), limit,
+               json.dumps(search_params or {}, sort_keys=True), tuple(output_fields or ()), filter)
+        results = self.results.get(key)
+        if results is None:
+            start = time.perf_counter()
+            results = client.search(collection_name=collection_name, data=data.tolist(), limit=limit,
+                                    output_fields=output_fields, search_params=search_params,
+                                    **({'filter': filter} if filter else {}))
+            results = [[dict(hit) for hit in hits] for hits in results]
+            self.results.put(key, results, time.perf_counter() - start)
+        return results
+
+    def report(self):
+        for name, cache in (('特征缓存', self.features), ('结果缓存', self.results)):
+            stats = cache.stats()
+            print(f"{name}: 命中率 {stats['hit_rate'] * 100:.1f}%（{stats['hits']}/{stats['hits'] + stats['misses']}），"
+                  f"节省 {stats['saved_seconds'] * 1000:.1f} ms，条目 {stats['entries']}")
+
+    def save(self):
+        if not self.path:
+            return
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'wb') as f:
+            pickle.dump({'features': list(self.features.entries.items()),
+                         'results': list(self.results.entries.items())}, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+def from_config(config):
+    """按config.yml中query_cache创建缓存，未启用时返回None"""
+    cache_config = config.get('query_cache') or {}
+    if not cache_config.get('enabled'):
+        return None
+    model_config = config['model']
+    model_key = json.dumps({key: model_config.get(key) for key in ('dir', 'pca_whitening', 'token_reduction')},
+                           sort_keys=True)
+    return QueryCache(int(cache_config.get('feature_entries', 10000)), int(cache_config.get('result_entries', 10000)),
+                      cache_config.get('path'), model_key)
@@ -0,0 +1,286 @@
+import argparse
+import os
+
+import numpy as np
+
+from main.utils import query_cache
+
+'''
+2025年10月19日
+α加权查询扩展(αQE)与数据库端增强(DBA)，全部用批量矩阵运算实现：
+1.αQE：查询向量与其top-k近邻按 max(sim, 0)^α 加权求和后重新L2归一化，再检索一次。
+2.DBA：每个数据库向量与其top-k近邻（含自身）同样加权求和，入库后离线计算一次并存为新集合
+  （Milvus集合或本地索引用的.npy），在线只多一次批量检索。
+  写入Milvus集合时按批遍历源集合，用源集合的向量索引检索近邻，不把整个集合读入内存，也不做O(n²)的精确近邻；
+  .npy特征按块读取（可为内存映射），结果直接写入磁盘上的.npy。
+  构建时记录源集合的版本号，之后源集合又有增删（监听入库、milvus_delete）时检索退回源集合并提示重新计算DBA，
+  避免漏掉新入库的图像。
+特征都是L2归一化的，Milvus返回的平方L2距离d与余弦相似度满足 sim = 1 - d / 2。
+'''
+
+
+def l2_to_similarity(distances):
+    """平方L2距离 -> 余弦相似度（仅对L2归一化特征成立）"""
+    return 1.0 - np.asarray(distances, dtype=np.float32) / 2.0
+
+
+def alpha_weights(sims, alpha):
+    """αQE权重 max(sim, 0)^α"""
+    return np.power(np.maximum(sims, 0.0), alpha).astype(np.float32)
+
+
+def _normalize(x):
+    return (x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)).astype(np.float32)
+
+
+def aggregate(vectors, neighbor_vectors, neighbor_sims, alpha=3.0, self_weight=1.0):
+    """
+    批量加权聚合
+    :param vectors: [n, d] 原向量（权重为self_weight，0表示不包含自身）
+    :param neighbor_vectors: [n, k, d] 近邻向量
+    :param neighbor_sims: [n, k] 与近邻的相似度
+    :return: [n, d] 重新L2归一化后的向量
+    """
+    weights = alpha_weights(neighbor_sims, alpha)
+    merged = self_weight * np.asarray(vectors, dtype=np.float32) + np.einsum('nk,nkd->nd', weights, neighbor_vectors)
+    return _normalize(merged)
+
+
+def knn(queries, database, k, block=4096, db_block=65536):
+    """
+    分块内积top-k（特征已归一化，内积即余弦相似度）
+    查询和数据库两个方向都分块，数据库为revisitop1m规模（可为内存映射数组）时内存也只有 block x db_block
+    :return: (sims [nq, k], indices [nq, k])，按相似度从大到小
+    """
+    k = min(k, len(database))
+    sims = np.empty((len(queries), k), dtype=np.float32)
+    indices = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), block):
+        q = np.asarray(queries[start:start + block], dtype=np.float32)
+        best_s = np.empty((len(q), 0), dtype=np.float32)
+        best_i = np.empty((len(q), 0), dtype=np.int64)
+        for db_start in range(0, len(database), db_block):
+            s = q @ np.asarray(database[db_start:db_start + db_block], dtype=np.float32).T
+            cand_s = np.concatenate([best_s, s], axis=1)
+            cand_i = np.concatenate([best_i, np.broadcast_to(np.arange(db_start, db_start + s.shape[1]), s.shape)],
+                                    axis=1)
+            if cand_s.shape[1] > k:
+                top = np.argpartition(-cand_s, k - 1, axis=1)[:, :k]
+                cand_s = np.take_along_axis(cand_s, top, axis=1)
+                cand_i = np.take_along_axis(cand_i, top, axis=1)
+            best_s, best_i = cand_s, cand_i
+        order = np.argsort(-best_s, axis=1)
+        sims[start:start + len(q)] = np.take_along_axis(best_s, order, axis=1)
+        indices[start:start + len(q)] = np.take_along_axis(best_i, order, axis=1)
+    return sims, indices
+
+
+def alpha_query_expansion(queries, database, k=2, alpha=3.0, sims=None, indices=None):
+    """
+    αQE：对查询批量做一次加权扩展
+    :param sims / indices: 已有的初次检索结果（[nq, >=k]），不提供时在database上精确计算
+    """
+    if k <= 0:
+        return np.asarray(queries, dtype=np.float32)
+    if sims is None or indices is None:
+        sims, indices = knn(queries, database, k)
+    sims, indices = sims[:, :k], indices[:, :k]
+    return aggregate(queries, np.asarray(database)[indices], sims, alpha)
+
+
+def database_side_augmentation(database, k=2, alpha=3.0, block=4096, out_path=None):
+    """
+    DBA：每个数据库向量与其top-k近邻（近邻包含自身）加权求和
+    :param database: [n, d]，可为内存映射数组，按块读取并转换为float32，不整体载入内存
+    :param out_path: 不为None时结果直接写入该.npy（内存映射），否则在内存中返回
+    :return: [n, d] 增强后的数据库向量
+    """
+    if not isinstance(database, np.ndarray):
+        database = np.asarray(database, dtype=np.float32)
+    shape = (len(database), database.shape[1])
+    if out_path:
+        if os.path.dirname(out_path):
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        augmented = np.lib.format.open_memmap(out_path, mode='w+', dtype=np.float32, shape=shape)
+    else:
+        augmented = np.empty(shape, dtype=np.float32)
+    for start in range(0, len(database), block):
+        chunk = np.asarray(database[start:start + block], dtype=np.float32)
+        sims, indices = knn(chunk, database, k)
+        # 近邻按行号排序后读取（内存映射时顺序访问磁盘），再还原为[块大小, k, d]
+        rows, inverse = np.unique(indices, return_inverse=True)
+        neighbours = np.asarray(database[rows], dtype=np.float32)[inverse.reshape(indices.shape)]
+        augmented[start:start + len(chunk)] = aggregate(chunk, neighbours, sims, alpha, self_weight=0.0)
+    if out_path:
+        augmented.flush()
+    return augmented
+
+
+def expand_with_client(client, collection_name, queries, k=2, alpha=3.0, search_params=None, self_weight=1.0):
+    """
+    通过Milvus或LocalSearchClient做αQE：一次批量检索取回近邻向量，再批量聚合
+    :param queries: [nq, d] 查询特征
+    :param self_weight: 查询自身的权重（DBA时为0，近邻中已包含自身）
+    :return: [nq, d] 扩展后的查询特征
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    if k <= 0:
+        return queries
+    results = client.search(
+        collection_name=collection_name,
+        data=queries.tolist(),
+        limit=k,
+        output_fields=["vector"],
+        search_params=search_params or {"metric_type": "L2", "params": {}}
+    )
+    neighbor_vectors = np.zeros((len(queries), k, queries.shape[1]), dtype=np.float32)
+    neighbor_sims = np.zeros((len(queries), k), dtype=np.float32)
+    for qi, hits in enumerate(results):
+        for j, hit in enumerate(hits[:k]):
+            neighbor_vectors[qi, j] = hit["entity"]["vector"]
+            neighbor_sims[qi, j] = l2_to_similarity(hit["distance"])
+    return aggregate(queries, neighbor_vectors, neighbor_sims, alpha, self_weight)
+
+
+def _dba_source_path(target_collection):
+    return os.path.join(query_cache.VERSION_DIR, f"{target_collection}.source_version")
+
+
+def record_dba_source(target_collection, source_version):
+    """记录DBA集合构建时源集合的版本号"""
+    os.makedirs(query_cache.VERSION_DIR, exist_ok=True)
+    with open(_dba_source_path(target_collection), 'w', encoding='utf-8') as f:
+        f.write(source_version)
+
+
+def clear_dba_source(target_collection):
+    """删除DBA构建记录（DBA集合重建期间视为过期）"""
+    path = _dba_source_path(target_collection)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def dba_is_current(source_collection, target_collection):
+    """DBA集合构建后源集合是否没有再变化（没有构建记录时视为过期）"""
+    path = _dba_source_path(target_collection)
+    if not os.path.exists(path):
+        return False
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip() == query_cache.collection_version(source_collection)
+
+
+def build_dba_collection(client, source_collection, target_collection, k=2, alpha=3.0, batch_size=1000,
+                         search_params=None):
+    """
+    入库完成后离线计算DBA，写入新的Milvus集合（字段与源集合相同，id自增；源集合有标量元数据字段时一并复制）
+    按批遍历源集合，每批在源集合上检索top-k近邻（含自身）后聚合写入，内存只有一个批次；
+    与 milvus_snapshot 恢复时相同，先建不带索引的集合，全部写入后一次性建索引再加载
+    :return: 写入的向量数
+    """
+    from main.src import milvus_create_collection
+    from main.utils import metadata
+
+    # 构建开始前的版本号，构建期间源集合又有变化时DBA视为过期
+    source_version = query_cache.collection_version(source_collection)
+    scalar_fields = metadata.FIELD_NAMES if metadata.has_metadata_fields(client, source_collection) else ()
+    # 先删除构建记录，重建期间检索退回源集合，不会检索到正在重建的集合
+    clear_dba_source(target_collection)
+    if client.has_collection(collection_name=target_collection):
+        client.drop_collection(collection_name=target_collection)
+    iterator = client.query_iterator(collection_name=source_collection, batch_size=batch_size, filter="",
+                                     output_fields=["vector", "image_name", *scalar_fields])
+    count = 0
+    while True:
+        batch = iterator.next()
+        if not batch:
+            iterator.close()
+            break
+        vectors = np.asarray([item["vector"] for item in batch], dtype=np.float32)
+        augmented = expand_with_client(client, source_collection, vectors, k, alpha, search_params, self_weight=0.0)
+        if count == 0:
+            milvus_create_collection.create_collection(client, target_collection, augmented.shape[1],
+                                                       with_index=False, scalar_fields=bool(scalar_fields))
+        rows = [{"vector": vec.tolist(), "image_name": item["image_name"],
+                 **{field: item[field] for field in scalar_fields}}
+                for vec, item in zip(augmented, batch)]
+        client.insert(collection_name=target_collection, data=rows)
+        count += len(rows)
+    if count == 0:
+        print(f"源集合 {source_collection} 为空，未生成DBA集合")
+        return 0
+    client.create_index(collection_name=target_collection,
+                        index_params=milvus_create_collection.build_index_params(
+                            client, scalar_fields=bool(scalar_fields)))
+    client.load_collection(collection_name=target_collection)
+    record_dba_source(target_collection, source_version)
+    print(f"DBA集合已写入: {target_collection}（{count} 个向量，k={k}，α={alpha}）")
+    return count
+
+
+def from_config(config):
+    """
+    读取config.yml中的query_expansion配置
+    :return: (qe_k, alpha, dba_config)，qe_k为0表示不做αQE
+    """
+    qe_config = config.get('query_expansion') or {}
+    return int(qe_config.get('qe_k') or 0), float(qe_config.get('alpha', 3.0)), qe_config.get('dba') or {}
+
+
+def dba_collection_name(config, collection_name):
+    """启用DBA时检索增强后的集合"""
+    _, _, dba_config = from_config(config)
+    return collection_name + dba_config.get('suffix', '_dba') if dba_config.get('enabled') else collection_name
+
+
+def search_collection_name(config, collection_name):
+    """
+    检索时使用的集合：启用DBA且DBA集合是最新的时为DBA集合，
+    源集合在DBA构建后又有增删时提示并退回源集合（否则会漏掉新入库的图像）
+    """
+    target = dba_collection_name(config, collection_name)
+    if target != collection_name and not dba_is_current(collection_name, target):
+        print(f"DBA集合 {target} 构建后源集合 {collection_name} 已有变化，本次检索源集合；"
+              f"可运行 python ../utils/query_expansion.py --collection {collection_name} 重新计算DBA")
+        return collection_name
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线计算数据库端增强(DBA)")
+    parser.add_argument('--collection', required=True, help="源集合名")
+    parser.add_argument('--vectors', default=None, help="源特征.npy，不指定时从Milvus导出")
+    parser.add_argument('--output', default=None, help="写出增强后的.npy（供本地索引构建），不指定时写入Milvus集合")
+    parser.add_argument('--suffix', default='_dba')
+    parser.add_argument('--k', type=int, default=2)
+    parser.add_argument('--alpha', type=float, default=3.0)
+    args = parser.parse_args()
+
+    from main.utils import vector_io
+    if args.vectors and not args.output:
+        parser.error("使用 --vectors 时需要指定 --output")
+    client = None
+    if not args.vectors:
+        from pymilvus import MilvusClient
+        from main.utils import get_ipadress
+        client = MilvusClient("http://" + get_ipadress.get_host_ip() + ":19530")
+    if not args.output:
+        build_dba_collection(client, args.collection, args.collection + args.suffix, args.k, args.alpha)
+        query_cache.bump_collection_version(args.collection + args.suffix)
+        return
+
+    source_version = query_cache.collection_version(args.collection)
+    if args.vectors:
+        vectors, names = vector_io.load_vectors(args.vectors)
+    else:
+        _, vectors, names = vector_io.export_collection(client, args.collection)
+    # 结果直接写入磁盘上的.npy，不在内存中保留整个增强后的数据库
+    database_side_augmentation(vectors, args.k, args.alpha, out_path=args.output)
+    if names is not None:
+        with open(vector_io.names_path_for(args.output), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(names))
+    record_dba_source(args.collection + args.suffix, source_version)
+    print(f"DBA特征已保存到 {args.output}，可用 hnsw_index.py --vectors 构建本地索引")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import json
+import os
+
+import numpy as np
+
+'''
+2025年10月19日
+紧凑的二进制top-k检索结果存储（替代带缩进的retrieval_results.json）：
+目录中包含
+  ids.i32        [nq, k] int32，数据库图像在gnd的imlist中的序号（不足k个或不在imlist中为-1）
+  distances.f32  [nq, k] float32，对应距离（缺失为inf）
+  queries.txt    每行一个查询图像名
+  meta.json      版本、k、查询数
+  results.jsonl  可选，每行一个查询的可读结果
+ResultWriter逐条查询流式写入，ResultStore内存映射读取，评估时按qimlist顺序直接取序号，无需再解析图像名。
+'''
+
+STORE_VERSION = 1
+
+
+def strip_extension(name):
+    """gnd的imlist/qimlist中的名字不带扩展名"""
+    return os.path.splitext(name)[0]
+
+
+class ResultWriter:
+    """
+    :param result_dir: 输出目录
+    :param k: 每个查询保存的结果数
+    :param imlist: gnd的数据库图像列表（NameList），用于把图像名转换为序号
+    :param jsonl: 是否同时写一份可读的JSONL
+    """
+
+    def __init__(self, result_dir, k, imlist, jsonl=False):
+        os.makedirs(result_dir, exist_ok=True)
+        self.result_dir = result_dir
+        self.k = k
+        self.imlist = imlist
+        self.count = 0
+        self._ids = open(os.path.join(result_dir, 'ids.i32'), 'wb')
+        self._distances = open(os.path.join(result_dir, 'distances.f32'), 'wb')
+        self._queries = open(os.path.join(result_dir, 'queries.txt'), 'w', encoding='utf-8')
+        self._jsonl = open(os.path.join(result_dir, 'results.jsonl'), 'w', encoding='utf-8') if jsonl else None
+
+    def add(self, query_name, names, distances):
+        """
+        写入一个查询的结果
+        :param names: 结果图像名（可带扩展名），按距离从小到大
+        :param distances: 对应距离
+        """
+        names = list(names)[:self.k]
+        ids = np.full(self.k, -1, dtype=np.int32)
+        dists = np.full(self.k, np.inf, dtype=np.float32)
+        if names:
+            ids[:len(names)] = self.imlist.indices([strip_extension(name) for name in names])
+            dists[:len(names)] = np.asarray(distances, dtype=np.float32)[:len(names)]
+        self._ids.write(ids.tobytes())
+        self._distances.write(dists.tobytes())
+        self._queries.write(strip_extension(query_name) + '\n')
+        if self._jsonl is not None:
+            self._jsonl.write(json.dumps({'query': strip_extension(query_name),
+                                          'results': [strip_extension(name) for name in names],
+                                          'distances': [round(float(d), 6) for d in dists[:len(names)]]},
+                                         ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self):
+        for f in (self._ids, self._distances, self._queries, self._jsonl):
+            if f is not None:
+                f.close()
+        with open(os.path.join(self.result_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'version': STORE_VERSION, 'k': self.k, 'nq': self.count}, f, indent=2)
+
+
+class ResultStore:
+    """内存映射读取检索结果"""
+
+    def __init__(self, result_dir):
+        with open(os.path.join(result_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('version') != STORE_VERSION:
+            raise ValueError(f"结果文件版本不匹配: {result_dir}")
+        self.k, self.nq = meta['k'], meta['nq']
+        shape = (self.nq, self.k)
+        self.ids = np.memmap(os.path.join(result_dir, 'ids.i32'), dtype=np.int32, mode='r', shape=shape) \
+            if self.nq else np.empty(shape, dtype=np.int32)
+        self.distances = np.memmap(os.path.join(result_dir, 'distances.f32'), dtype=np.float32, mode='r',
+                                   shape=shape) if self.nq else np.empty(shape, dtype=np.float32)
+        with open(os.path.join(result_dir, 'queries.txt'), 'r', encoding='utf-8') as f:
+            self.queries = f.read().splitlines()[:self.nq]
+
+    def ordered_ids(self, qimlist):
+        """
+        按gnd的qimlist顺序取结果
+        :return: [len(qimlist), k] int32，没有结果的查询整行为-1
+        """
+        rows = {name: row for row, name in enumerate(self.queries)}
+        result = np.full((len(qimlist), self.k), -1, dtype=np.int32)
+        for qi, name in enumerate(qimlist):
+            if name in rows:
+                result[qi] = self.ids[rows[name]]
+        return result
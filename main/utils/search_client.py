@@ -0,0 +1,127 @@
+import ast
+import json
+import os
+import re
+
+import numpy as np
+
+'''
+2025年10月19日
+检索后端选择：
+1.LocalSearchClient：加载本地索引目录（<index_root>/<集合名>/），提供与MilvusClient相同调用方式的
+  search / query / has_collection，检索结果同样是 [[{"id", "distance", "entity": {...}}, ...], ...]。
+2.create_search_client：按config.yml中search.backend返回MilvusClient或LocalSearchClient，
+  检索脚本无需关心实际后端。
+'''
+
+
+def _load_index(index_dir):
+    """按meta.json中的index_type加载对应的本地索引"""
+    with open(os.path.join(index_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+        index_type = json.load(f)['index_type']
+    if index_type == 'hnsw':
+        from main.utils.hnsw_index import HNSWIndex
+        return HNSWIndex.load(index_dir)
+    if index_type == 'ivfpq':
+        from main.utils.ivfpq_index import IVFPQIndex
+        return IVFPQIndex.load(index_dir)
+    raise ValueError(f"未知的本地索引类型: {index_type}")
+
+
+class LocalSearchClient:
+    """
+    本地索引检索客户端
+    :param index_root: 本地索引根目录，每个集合一个子目录
+    """
+
+    def __init__(self, index_root):
+        self.index_root = index_root
+        self._indexes = {}
+
+    def _index(self, collection_name):
+        if collection_name not in self._indexes:
+            index_dir = os.path.join(self.index_root, collection_name)
+            if not os.path.exists(os.path.join(index_dir, 'meta.json')):
+                raise ValueError(f"本地索引不存在: {index_dir}")
+            self._indexes[collection_name] = _load_index(index_dir)
+        return self._indexes[collection_name]
+
+    def has_collection(self, collection_name):
+        return os.path.exists(os.path.join(self.index_root, collection_name, 'meta.json'))
+
+    def _entity(self, index, row, output_fields):
+        entity = {}
+        for field in output_fields or []:
+            if field == 'image_name':
+                entity['image_name'] = index.names[row].decode('utf-8')
+            elif field == 'vector':
+                if index.vectors is None:
+                    raise ValueError("该本地索引没有保存全精度向量")
+                entity['vector'] = np.asarray(index.vectors[row]).tolist()
+            elif field != 'id':
+                raise ValueError(f"本地索引不支持输出字段: {field}")
+        return entity
+
+    def search(self, collection_name, data, limit=10, output_fields=None, search_params=None, **kwargs):
+        """
+        与MilvusClient.search相同的调用方式
+        :param search_params: {"metric_type": "L2", "params": {...}}，params按索引类型解释:
+                              hnsw为{"ef": 64}，ivfpq为{"nprobe": 16, "rerank": 100}
+        """
+        if kwargs.get('filter'):
+            raise ValueError("本地索引不支持标量过滤，请使用milvus后端")
+        index = self._index(collection_name)
+        params = (search_params or {}).get('params') or {}
+        distances, rows = index.search(np.asarray(data, dtype=np.float32), k=limit, **params)
+        results = []
+        for q_dist, q_rows in zip(distances, rows):
+            hits = []
+            for d, row in zip(q_dist.tolist(), q_rows.tolist()):
+                if row < 0:
+                    continue
+                hits.append({
+                    'id': int(index.ids[row]),
+                    'distance': float(d),
+                    'entity': self._entity(index, row, output_fields),
+                })
+            results.append(hits)
+        return results
+
+    def _name_rows(self, collection_name, index):
+        """图像名 -> 行号（首次按名查询时建立）"""
+        key = ('names', collection_name)
+        if key not in self._indexes:
+            self._indexes[key] = {name.decode('utf-8'): row for row, name in enumerate(index.names)}
+        return self._indexes[key]
+
+    def query(self, collection_name, filter="", output_fields=None, limit=None, **kwargs):
+        """
+        按存储顺序返回实体
+        :param filter: 只支持空条件（查询全部）或 'image_name in ["a.jpg", ...]'
+        """
+        index = self._index(collection_name)
+        if filter:
+            match = re.fullmatch(r'\s*image_name\s+in\s+(\[.*\])\s*', filter, re.S)
+            if match is None:
+                raise ValueError(f"本地索引的query不支持该过滤条件: {filter}")
+            name_rows = self._name_rows(collection_name, index)
+            rows = [name_rows[name] for name in ast.literal_eval(match.group(1)) if name in name_rows]
+        else:
+            rows = range(len(index))
+        if limit is not None:
+            rows = rows[:limit]
+        return [dict(id=int(index.ids[row]), **self._entity(index, row, output_fields)) for row in rows]
+
+
+def create_search_client(config):
+    """
+    按配置创建检索客户端
+    :param config: 完整配置字典，search.backend 为 milvus | local
+    """
+    search_config = config.get('search') or {}
+    if search_config.get('backend', 'milvus') == 'local':
+        return LocalSearchClient(search_config.get('local_index_dir', '../data/local_index'))
+
+    from pymilvus import MilvusClient
+    from main.utils import get_ipadress
+    return MilvusClient(f"http://{get_ipadress.get_host_ip()}:{config['milvus']['port']}")
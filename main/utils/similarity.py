@@ -0,0 +1,112 @@
+import os
+
+import numpy as np
+
+'''
+2025年10月19日
+批量图像相似度API：
+1.embed_images：一组图像按batch做一次前向，支持CLS与mean两种池化，输出L2归一化特征；
+  可选的嵌入缓存（vector_io格式的.npy + _names.txt）中已有的图像不再重复前向，
+  可选的预解码图像缓存（image_shard_cache）命中时不再解码JPEG。
+2.similarity_matrix / iter_similarity_blocks：分块矩阵乘计算余弦相似度，耗时与图像数成正比而不是与图像对数成正比。
+'''
+
+POOLINGS = ('cls', 'mean')
+
+
+def pool_features(last_hidden_state, pooling='cls'):
+    """
+    :param last_hidden_state: [B, T, D] torch张量
+    :param pooling: cls取第0个token，mean对全部token取平均（与sc_test.py原实现一致）
+    :return: [B, D] L2归一化后的float32 numpy数组
+    """
+    import torch
+    if pooling not in POOLINGS:
+        raise ValueError(f"未知的池化方式: {pooling}")
+    feat = last_hidden_state[:, 0, :] if pooling == 'cls' else last_hidden_state.mean(dim=1)
+    return torch.nn.functional.normalize(feat, p=2, dim=1).cpu().numpy().astype('float32')
+
+
+def _load_image(path, image_cache):
+    from PIL import Image
+    name = os.path.basename(path)
+    # 源文件在构建缓存后被替换时视为未命中，重新解码
+    if image_cache is not None and image_cache.is_fresh(name, path):
+        return image_cache.get(name)
+    return Image.open(path).convert('RGB')
+
+
+def embed_images(processor, model, device, images, pooling='cls', batch_size=32,
+                 cache_path=None, image_cache=None):
+    """
+    批量提取图像特征
+    :param images: 图像路径列表或PIL图像列表（只有路径才能使用缓存）
+    :param cache_path: 嵌入缓存.npy，不同的模型/池化方式请使用不同的文件
+    :param image_cache: ImageShardCache，按文件名查找预解码图像
+    :return: [n, D] float32，顺序与images一致
+    """
+    import torch
+    from main.utils import vector_io
+
+    keys = [os.path.abspath(image) if isinstance(image, str) else None for image in images]
+    cached = {}
+    if cache_path and os.path.exists(cache_path):
+        vectors, names = vector_io.load_vectors(cache_path, mmap=False)
+        cached = {name: vector for name, vector in zip(names, vectors)}
+
+    todo = [i for i, key in enumerate(keys) if key is None or key not in cached]
+    new_vectors = []
+    with torch.no_grad():
+        for start in range(0, len(todo), batch_size):
+            batch = [images[i] for i in todo[start:start + batch_size]]
+            batch = [_load_image(image, image_cache) if isinstance(image, str) else image for image in batch]
+            inputs = processor(images=batch, return_tensors="pt").to(device)
+            new_vectors.append(pool_features(model(**inputs).last_hidden_state, pooling))
+
+    computed = dict(zip(todo, np.concatenate(new_vectors))) if new_vectors else {}
+    features = np.stack([computed[i] if i in computed else cached[key] for i, key in enumerate(keys)])
+
+    # 新提取的（带路径的）图像追加进缓存
+    if cache_path and any(keys[i] is not None for i in computed):
+        for i, vector in computed.items():
+            if keys[i] is not None:
+                cached[keys[i]] = vector
+        names = list(cached)
+        vector_io.save_vectors(cache_path, np.stack([cached[name] for name in names]), names)
+    return features.astype('float32')
+
+
+def iter_similarity_blocks(a, b=None, block=4096):
+    """
+    分块计算余弦相似度（输入已L2归一化）
+    :param b: 为None时计算a与自身的相似度
+    :return: 生成 (行起点, 列起点, 相似度块[float32])
+    """
+    b = a if b is None else b
+    for i in range(0, len(a), block):
+        a_block = np.asarray(a[i:i + block], dtype=np.float32)
+        for j in range(0, len(b), block):
+            yield i, j, a_block @ np.asarray(b[j:j + block], dtype=np.float32).T
+
+
+def similarity_matrix(a, b=None, block=4096):
+    """完整的 [len(a), len(b)] 余弦相似度矩阵"""
+    b = a if b is None else b
+    result = np.empty((len(a), len(b)), dtype=np.float32)
+    for i, j, sim in iter_similarity_blocks(a, b, block):
+        result[i:i + sim.shape[0], j:j + sim.shape[1]] = sim
+    return result
+
+
+def pair_similarities(features, pairs, block=65536):
+    """
+    指定图像对的相似度
+    :param pairs: [m, 2] 特征下标对
+    :return: [m] float32
+    """
+    pairs = np.asarray(pairs, dtype=np.int64)
+    result = np.empty(len(pairs), dtype=np.float32)
+    for start in range(0, len(pairs), block):
+        chunk = pairs[start:start + block]
+        result[start:start + len(chunk)] = np.einsum('ij,ij->i', features[chunk[:, 0]], features[chunk[:, 1]])
+    return result
@@ -0,0 +1,120 @@
+import torch
+import torch.nn.functional as F
+
+'''
+2025年10月19日
+DINOv3 ViT前向的token剪枝/合并（只用CLS输出，逐层减少patch token数以加速CPU前向）：
+1.prune：在指定层之前保留与CLS余弦相似度最高的patch token，其余丢弃。
+2.merge：ToMe式二分图软匹配，把最相似的patch token按大小加权平均合并到另一组中。
+DINOv3的RoPE只作用在patch token上（apply_rotary_pos_emb按cos/sin的长度区分前缀token），
+因此每次减少token时同步取出对应位置的cos/sin，扩展成[B, 1, P', head_dim]随batch各自携带，合并后的token沿用目标token的位置。
+用 wrap(model, config) 替换原模型即可，调用方式（model(**inputs).last_hidden_state）不变。
+'''
+
+MODES = ('prune', 'merge')
+
+
+def _gather_tokens(x, idx):
+    """x: [B, N, C]，idx: [B, K] -> [B, K, C]"""
+    return torch.gather(x, 1, idx.unsqueeze(-1).expand(-1, -1, x.shape[-1]))
+
+
+def prune_tokens(prefix, patches, cos, sin, sizes, remove):
+    """保留与CLS最相似的patch token"""
+    keep = patches.shape[1] - remove
+    score = F.cosine_similarity(patches, prefix[:, :1], dim=-1)
+    idx = score.topk(keep, dim=1).indices.sort(dim=1).values
+    return _gather_tokens(patches, idx), _gather_tokens(cos, idx), _gather_tokens(sin, idx), _gather_tokens(sizes, idx)
+
+
+def merge_tokens(prefix, patches, cos, sin, sizes, remove):
+    """ToMe二分图软匹配：A组中最相似的remove个token按大小加权合并到B组"""
+    a, b = patches[:, ::2], patches[:, 1::2]
+    remove = min(remove, a.shape[1])
+    sim = F.normalize(a, dim=-1) @ F.normalize(b, dim=-1).transpose(1, 2)
+    node_max, node_idx = sim.max(dim=-1)
+    edge_idx = node_max.argsort(dim=-1, descending=True)
+    src_idx, unm_idx = edge_idx[:, :remove], edge_idx[:, remove:]
+    dst_idx = torch.gather(node_idx, 1, src_idx)
+
+    size_a, size_b = sizes[:, ::2], sizes[:, 1::2]
+    src_size = _gather_tokens(size_a, src_idx)
+    b_sum = (b * size_b).scatter_reduce(1, dst_idx.unsqueeze(-1).expand(-1, -1, b.shape[-1]),
+                                        _gather_tokens(a, src_idx) * src_size, reduce='sum')
+    merged_size = size_b.scatter_reduce(1, dst_idx.unsqueeze(-1), src_size, reduce='sum')
+
+    patches = torch.cat([_gather_tokens(a, unm_idx), b_sum / merged_size], dim=1)
+    cos = torch.cat([_gather_tokens(cos[:, ::2], unm_idx), cos[:, 1::2]], dim=1)
+    sin = torch.cat([_gather_tokens(sin[:, ::2], unm_idx), sin[:, 1::2]], dim=1)
+    sizes = torch.cat([_gather_tokens(size_a, unm_idx), merged_size], dim=1)
+    return patches, cos, sin, sizes
+
+
+class TokenReducedModel(torch.nn.Module):
+    """
+    :param model: transformers的DINOv3ViTModel
+    :param mode: prune | merge
+    :param rate: 每个减少点去掉的patch token比例
+    :param layers: 在这些层（序号从0开始）之前减少token
+    """
+
+    def __init__(self, model, mode='merge', rate=0.25, layers=(3, 6, 9)):
+        super().__init__()
+        if mode not in MODES:
+            raise ValueError(f"未知的token_reduction.mode: {mode}")
+        for attr in ('embeddings', 'rope_embeddings', 'layer', 'norm'):
+            if not hasattr(model, attr):
+                raise ValueError(f"token_reduction只支持DINOv3 ViT模型（缺少 {attr}）")
+        self.model = model
+        self.mode = mode
+        self.rate = rate
+        self.layers = set(layers)
+        self.num_prefix_tokens = 1 + getattr(model.config, 'num_register_tokens', 0)
+
+    @property
+    def config(self):
+        return self.model.config
+
+    def forward(self, pixel_values, **kwargs):
+        model = self.model
+        pixel_values = pixel_values.to(model.embeddings.patch_embeddings.weight.dtype)
+        hidden_states = model.embeddings(pixel_values)
+        cos, sin = model.rope_embeddings(pixel_values)
+        batch_size = hidden_states.shape[0]
+        # RoPE随token一起裁剪，需要每张图像各自一份
+        cos = cos.unsqueeze(0).expand(batch_size, -1, -1)
+        sin = sin.unsqueeze(0).expand(batch_size, -1, -1)
+        sizes = hidden_states.new_ones(batch_size, cos.shape[1], 1)
+        reduce = prune_tokens if self.mode == 'prune' else merge_tokens
+
+        for i, layer_module in enumerate(model.layer):
+            if i in self.layers:
+                prefix = hidden_states[:, :self.num_prefix_tokens]
+                patches = hidden_states[:, self.num_prefix_tokens:]
+                remove = int(patches.shape[1] * self.rate)
+                if remove > 0:
+                    patches, cos, sin, sizes = reduce(prefix, patches, cos, sin, sizes, remove)
+                    hidden_states = torch.cat([prefix, patches], dim=1)
+            hidden_states = layer_module(hidden_states, position_embeddings=(cos.unsqueeze(1), sin.unsqueeze(1)))
+
+        sequence_output = model.norm(hidden_states)
+        return _Output(sequence_output)
+
+
+class _Output:
+    """与transformers输出相同的取法：outputs.last_hidden_state / outputs.pooler_output"""
+
+    def __init__(self, last_hidden_state):
+        self.last_hidden_state = last_hidden_state
+        self.pooler_output = last_hidden_state[:, 0, :]
+
+
+def wrap(model, config):
+    """
+    按config.yml中model.token_reduction包装模型，未启用时原样返回
+    """
+    reduction_config = config['model'].get('token_reduction') or {}
+    if not reduction_config.get('enabled'):
+        return model
+    return TokenReducedModel(model, reduction_config.get('mode', 'merge'), float(reduction_config.get('rate', 0.25)),
+                             reduction_config.get('layers', (3, 6, 9))).eval()
@@ -0,0 +1,94 @@
+import os
+
+import numpy as np
+
+'''
+2025年10月19日
+特征向量的导入导出：
+1.export_collection：用query_iterator分批把Milvus集合中的向量、图像名、主键读出来（按主键排序，即插入顺序）。
+2.save_vectors / load_vectors：以 .npy（向量）+ _names.txt（图像名）的形式落盘，加载时对向量做内存映射。
+供本地索引、PCA白化、近重复检测等离线任务使用，避免每个任务各自连Milvus全量查询。
+load_vectors 同样可以读取 feature_store.py 的 .fstore 特征存储文件。
+'''
+
+
+def export_collection(client, collection_name, batch_size=1000, vector_field="vector", name_field="image_name"):
+    """
+    导出Milvus集合中的全部向量
+    :param client: MilvusClient
+    :return: (ids int64数组, vectors float32数组[n, dim], names列表)，按主键升序
+    """
+    iterator = client.query_iterator(
+        collection_name=collection_name,
+        batch_size=batch_size,
+        filter="",
+        output_fields=[vector_field, name_field],
+    )
+    ids, vectors, names = [], [], []
+    while True:
+        batch = iterator.next()
+        if not batch:
+            iterator.close()
+            break
+        for item in batch:
+            ids.append(item["id"])
+            vectors.append(item[vector_field])
+            names.append(item[name_field])
+
+    ids = np.asarray(ids, dtype=np.int64)
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+    order = np.argsort(ids, kind='stable')
+    return ids[order], vectors[order], [names[i] for i in order]
+
+
+def export_fields(client, collection_name, fields, batch_size=1000):
+    """
+    导出集合中的标量字段
+    :return: {字段名: 值列表}，按主键升序（与export_collection的顺序一致）
+    """
+    iterator = client.query_iterator(
+        collection_name=collection_name,
+        batch_size=batch_size,
+        filter="",
+        output_fields=list(fields),
+    )
+    rows = []
+    while True:
+        batch = iterator.next()
+        if not batch:
+            iterator.close()
+            break
+        rows.extend(batch)
+    rows.sort(key=lambda item: item["id"])
+    return {field: [item[field] for item in rows] for field in fields}
+
+
+def names_path_for(vectors_path):
+    """xxx.npy -> xxx_names.txt"""
+    return os.path.splitext(vectors_path)[0] + '_names.txt'
+
+
+def save_vectors(vectors_path, vectors, names):
+    """保存向量和对应的图像名"""
+    if os.path.dirname(vectors_path):
+        os.makedirs(os.path.dirname(vectors_path), exist_ok=True)
+    np.save(vectors_path, np.ascontiguousarray(vectors, dtype=np.float32))
+    with open(names_path_for(vectors_path), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(names))
+
+
+def load_vectors(vectors_path, mmap=True):
+    """
+    加载向量和图像名
+    :return: (vectors [n, dim], names列表)；没有名字文件时names为None
+    """
+    if vectors_path.endswith('.fstore'):
+        from main.utils.feature_store import open_feature_store
+        store = open_feature_store(vectors_path)
+        return (store.vectors if mmap else np.array(store.vectors)), store.names
+    vectors = np.load(vectors_path, mmap_mode='r' if mmap else None)
+    names = None
+    if os.path.exists(names_path_for(vectors_path)):
+        with open(names_path_for(vectors_path), 'r', encoding='utf-8') as f:
+            names = f.read().splitlines()
+    return vectors, names